@@ -0,0 +1,174 @@
+import json
+import logging
+
+import metrics
+import egress_pool
+import launch_cache
+
+# Settings.
+
+# Toggle to turn on/off resource blocking in scraping browsers.
+BLOCK_RESOURCES = True
+# Url patterns to block by resource group. Patterns use the wildcard syntax of
+# the DevTools Network.setBlockedURLs command.
+# Url patterns to block by resource group. Patterns use the wildcard syntax of
+# the DevTools Network.setBlockedURLs command and end with * so urls with a
+# query string e.g. image.png?w=640 match too. Every page type blocks all of them
+# since the scrapers only read kickstarter's own html, scripts and json.
+BLOCKED_PATTERNS = {
+    "image": ["*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.avif*", "*.ico*", "*.svg*", "*.bmp*"],
+    "media": ["*.mp4*", "*.webm*", "*.m3u8*", "*.ts", "*.ts?*", "*.mp3*", "*.ogg*", "*.mov*"],
+    "font": ["*.woff*", "*.ttf*", "*.otf*", "*.eot*"],
+    "third_party": ["*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+                    "*facebook.net*", "*facebook.com/tr*", "*connect.facebook*", "*hotjar.com*",
+                    "*segment.io*", "*segment.com*", "*optimizely.com*", "*sentry.io*",
+                    "*newrelic.com*", "*nr-data.net*", "*youtube.com*", "*vimeo.com*",
+                    "*ytimg.com*", "*embedly.com*", "*twitter.com*", "*stripe.com*"],
+}
+# Estimated size in bytes of a blocked request for each resource type. Used to
+# estimate bytes saved since blocked requests never report their size.
+AVERAGE_BYTES = {
+    "Image": 60_000,
+    "Media": 500_000,
+    "Font": 40_000,
+    "Script": 50_000,
+    "XHR": 5_000,
+    "Fetch": 5_000,
+    "Other": 10_000,
+}
+
+def get_chrome_options():
+    """
+    Returns uc.ChromeOptions with images disabled through preferences and performance
+    logging turned on so network usage can be reported.
+    """
+    import undetected_chromedriver as uc
+
+    options = uc.ChromeOptions()
+    if BLOCK_RESOURCES:
+        # 2 = block.
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.default_content_setting_values.notifications": 2,
+            "profile.default_content_setting_values.automatic_downloads": 2,
+        })
+        options.add_argument("--autoplay-policy=user-gesture-required")
+        options.add_argument("--blink-settings=imagesEnabled=false")
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    return options
+
+def new_driver(chromedriver_path, headless=False, egress=None, **kwargs):
+    """
+    Returns a uc.Chrome webdriver using the scraping browser profile.
+
+    chromedriver_path [str] - Path to chromedriver.
+    headless [bool] - True to run chrome headless. False by default.
+    egress [str] - Proxy from egress_pool to send the browser's traffic through. None by default.
+    kwargs - Extra keyword arguments for uc.Chrome.
+    """
+    import undetected_chromedriver as uc
+
+    options = get_chrome_options()
+    for argument in egress_pool.proxy_arguments(egress):
+        options.add_argument(argument)
+    with metrics.timer(stage="browser_launch"):
+        # Reuse a chromedriver patched once per version and a clone of a prebuilt profile.
+        profile = None
+        if launch_cache.ENABLED:
+            chromedriver_path = launch_cache.patched_driver_path(chromedriver_path)
+            if "user_data_dir" not in kwargs:
+                profile = launch_cache.clone_profile(chromedriver_path, "headless" if headless else "headed",
+                                                     lambda path: build_profile(chromedriver_path, path, headless))
+                kwargs["user_data_dir"] = profile
+
+        driver = uc.Chrome(driver_executable_path=chromedriver_path, options=options, headless=headless, **kwargs)
+        driver.execute_cdp_cmd("Network.enable", {})
+        if profile != None:
+            launch_cache.track(driver, profile)
+    metrics.inc("browser_launches_total")
+    return driver
+
+def build_profile(chromedriver_path, path, headless=False):
+    """
+    Launches and quits a browser so it creates a profile in path. Used to build launch_cache
+    templates.
+
+    chromedriver_path [str] - Path to a patched chromedriver.
+    path [str] - Folder for the profile.
+    headless [bool] - True to run chrome headless. False by default.
+    """
+    import undetected_chromedriver as uc
+
+    uc.Chrome(driver_executable_path=chromedriver_path, options=get_chrome_options(), user_data_dir=path, headless=headless).quit()
+
+def get_blocked_patterns():
+    """Returns a list of url patterns to block."""
+    return [pattern for group_patterns in BLOCKED_PATTERNS.values() for pattern in group_patterns]
+
+def prepare_page(driver):
+    """
+    Sets network level blocking on driver for the next page load. Should be called
+    before driver.get.
+
+    driver [selenium webdriver] - A webdriver created by new_driver.
+    """
+    if not BLOCK_RESOURCES:
+        return
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": get_blocked_patterns()})
+
+def get_network_events(driver):
+    """
+    Returns a list of DevTools Network events (dicts with "method" and "params") logged
+    since the last call. The performance log is emptied on every read so callers
+    which need the events should share the returned list.
+
+    driver [selenium webdriver] - A webdriver created by new_driver.
+    """
+    events = []
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return events
+
+    for entry in entries:
+        message = json.loads(entry["message"])["message"]
+        if message["method"].startswith("Network."):
+            events.append(message)
+    return events
+
+def get_bandwidth_report(events):
+    """
+    Returns a dict with the number of requests made, bytes loaded, requests blocked and
+    the estimated bytes saved by blocking from a list of Network events.
+
+    events [list] - Events returned by get_network_events.
+    """
+    resource_types = {}
+    report = {"requests": 0, "bytes_loaded": 0, "blocked": 0, "bytes_saved": 0}
+    for event in events:
+        params = event["params"]
+        if event["method"] == "Network.requestWillBeSent":
+            resource_types[params["requestId"]] = params.get("type", "Other")
+            report["requests"] += 1
+        elif event["method"] == "Network.loadingFinished":
+            report["bytes_loaded"] += int(params.get("encodedDataLength", 0))
+        elif event["method"] == "Network.loadingFailed" and params.get("blockedReason"):
+            resource_type = params.get("type") or resource_types.get(params["requestId"], "Other")
+            report["blocked"] += 1
+            report["bytes_saved"] += AVERAGE_BYTES.get(resource_type, AVERAGE_BYTES["Other"])
+    return report
+
+def log_bandwidth(link, events):
+    """
+    Logs the bandwidth report for link and returns it.
+
+    link [str] - Link of the loaded page.
+    events [list] - Events returned by get_network_events.
+    """
+    report = get_bandwidth_report(events)
+    metrics.inc("requests_total", report["requests"])
+    metrics.inc("bytes_loaded_total", report["bytes_loaded"])
+    metrics.inc("requests_blocked_total", report["blocked"])
+    logging.info(f"{link}: {report['requests']} requests, {report['bytes_loaded'] / 1e6:.2f} MB loaded, "
+                 f"{report['blocked']} blocked (~{report['bytes_saved'] / 1e6:.2f} MB saved).")
+    return report
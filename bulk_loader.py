@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import logging
+import tempfile
+
+import job_queue
+
+# Settings.
+
+# Number of rows inserted per statement batch.
+BATCH_SIZE = 10000
+# Number of characters read from a json file at a time.
+READ_SIZE = 1 << 20
+
+def iter_json_array(path):
+    """
+    Yields the items of the top level json array in the file at path one at a time without
+    reading the whole file into memory.
+
+    path [str] - Path to a json file containing an array.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf8") as f_obj:
+        buffer = f_obj.read(READ_SIZE)
+        eof = len(buffer) == 0
+        pos = 0
+
+        def fill():
+            nonlocal buffer, pos, eof
+            chunk = f_obj.read(READ_SIZE)
+            eof = len(chunk) == 0
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def skip(chars):
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in chars:
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                fill()
+
+        skip(" \t\r\n")
+        if pos >= len(buffer) or buffer[pos] != "[":
+            raise ValueError(f"{path} does not contain a json array.")
+        pos += 1
+
+        while True:
+            skip(" \t\r\n,")
+            if pos >= len(buffer):
+                raise ValueError(f"{path} ended before its json array was closed.")
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            # A number near the end of the buffer may continue in the next read e.g. "1." + "5" or
+            # "1e" + "3", where raw_decode stops before the unfinished part.
+            if type(item) in (int, float) and not eof and len(buffer) - end <= 2 and not any(char in ",] \t\r\n" for char in buffer[end:]):
+                fill()
+                continue
+            pos = end
+            yield item
+
+def is_loaded(con, path, table):
+    """
+    Returns True if the file at path was already loaded into table and has not changed since.
+
+    con [sqlite3.Connection] - A database connection.
+    path [str] - Path to the input file.
+    table [str] - Table the file is loaded into.
+    """
+    con.execute("""CREATE TABLE IF NOT EXISTS bulk_sources(
+                path TEXT,
+                target TEXT,
+                fingerprint TEXT,
+                loaded_at REAL,
+                PRIMARY KEY (path, target)
+                )""")
+    row = con.execute("SELECT fingerprint FROM bulk_sources WHERE path = ? AND target = ?", (path, table)).fetchone()
+    return row != None and row[0] == job_queue.file_fingerprint(path)
+
+def has_unique_index(con, table, column):
+    """Returns True if column of table has a unique index of its own."""
+    for index in con.execute(f"PRAGMA index_list({table})").fetchall():
+        name, unique = index[1], index[2]
+        columns = [info[2] for info in con.execute(f"PRAGMA index_info('{name}')").fetchall()]
+        if unique and columns == [column]:
+            return True
+    return False
+
+def load_json_column(con, path, table, column):
+    """
+    Adds every value of the json array in the file at path to column of table, skipping values
+    already there. Does nothing if the file is unchanged since it was last loaded. Values are
+    streamed into a staging table and copied over in one statement in a single transaction. If
+    table is empty its unique index on column is only built after the copy.
+
+    con [sqlite3.Connection] - A database connection.
+    path [str] - Path to a json file containing an array of values.
+    table [str] - Table to load into.
+    column [str] - Column of table to load into.
+    """
+    if is_loaded(con, path, table):
+        logging.info(f"{path} is already loaded into {table}.")
+        return
+
+    start = time.time()
+    cur = con.cursor()
+    cur.execute("DROP TABLE IF EXISTS temp.staging")
+    cur.execute("CREATE TEMP TABLE staging(value)")
+
+    batch = []
+    for value in iter_json_array(path):
+        batch.append((value,))
+        if len(batch) == BATCH_SIZE:
+            cur.executemany("INSERT INTO staging VALUES (?)", batch)
+            batch.clear()
+    cur.executemany("INSERT INTO staging VALUES (?)", batch)
+
+    index_name = f"{table}_{column}_unique"
+    empty = cur.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {table})").fetchone()[0]
+    if empty and not has_unique_index(con, table, column):
+        # Sorting once and building the index afterwards is faster than updating it per row.
+        cur.execute(f"INSERT INTO {table} ({column}) SELECT DISTINCT value FROM staging ORDER BY value")
+    else:
+        cur.execute(f"INSERT OR IGNORE INTO {table} ({column}) SELECT value FROM staging ORDER BY value")
+    if not has_unique_index(con, table, column):
+        cur.execute(f"CREATE UNIQUE INDEX {index_name} ON {table}({column})")
+
+    cur.execute("INSERT OR REPLACE INTO bulk_sources VALUES (?, ?, ?, ?)", (path, table, job_queue.file_fingerprint(path), time.time()))
+    cur.execute("DROP TABLE staging")
+    con.commit()
+    logging.info(f"Loaded {path} into {table} in {time.time() - start:.1f}s.")
+
+def test_iter_json_array():
+    # Testing code. Reads arrays with small READ_SIZE values so numbers, strings and objects are
+    # split at every position between reads.
+    global READ_SIZE
+    items = [1.5, 1500.0, -2.25e-3, 6e10, 12345, "a,]b", {"x": [1, 2.5e+3]}, True, None, 0, 1e5]
+    text = "[" + ", ".join(json.dumps(item) for item in items) + "]\n"
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf8") as f_obj:
+        f_obj.write(text)
+    read_size = READ_SIZE
+    try:
+        for READ_SIZE in range(1, 9):
+            assert list(iter_json_array(f_obj.name)) == items, READ_SIZE
+    finally:
+        READ_SIZE = read_size
+        os.remove(f_obj.name)
+    logging.info("iter_json_array test passed.")
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%m/%d/%Y %I:%M:%S %p')
+    test_iter_json_array()
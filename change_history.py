@@ -0,0 +1,128 @@
+import time
+
+import db_writer
+
+def create_history_tables(con):
+    """
+    Creates the history tables in the database of con if they don't exist.
+
+    con [sqlite3.Connection] - A database connection.
+    """
+    cur = con.cursor()
+
+    # Append only table of field values. A field only has rows once it has changed. Its first
+    # row is the value it had when the entity was first seen and every following row is a
+    # new value seen at observed_at.
+    cur.execute("""CREATE TABLE IF NOT EXISTS history(
+                entity_type TEXT NOT NULL,
+                entity_id TEXT NOT NULL,
+                field TEXT NOT NULL,
+                observed_at REAL NOT NULL,
+                value,
+                PRIMARY KEY (entity_type, entity_id, field, observed_at)
+                ) WITHOUT ROWID""")
+
+    # Last time each entity was observed.
+    cur.execute("""CREATE TABLE IF NOT EXISTS observations(
+                entity_type TEXT NOT NULL,
+                entity_id TEXT NOT NULL,
+                first_observed_at REAL,
+                observed_at REAL,
+                PRIMARY KEY (entity_type, entity_id)
+                ) WITHOUT ROWID""")
+    con.commit()
+
+def same_value(old, new):
+    """Returns True if a stored value and a newly extracted value are equal, ignoring the type
+    differences sqlite column affinity introduces."""
+    if old == new:
+        return True
+    if old in (None, "") and new in (None, ""):
+        return True
+    try:
+        return float(old) == float(new)
+    except (TypeError, ValueError):
+        return str(old) == str(new)
+
+def apply_changes(cur, entity_type, table, key_column, row, ignore, observed_at, defaults=None):
+    """
+    db_writer handler which inserts row into table if its key is new and otherwise updates only
+    the changed fields and appends them to history.
+
+    cur [sqlite3.Cursor] - Writer cursor.
+    entity_type [str] - Entity type used in history e.g. project or creator.
+    table [str] - Table holding the latest version of each entity.
+    key_column [str] - Unique column of table identifying the entity.
+    row [dict] - Freshly extracted row.
+    ignore [tuple] - Fields which are updated but not compared or kept in history.
+    observed_at [float] - Unix time row was extracted.
+    defaults [dict] - Values for fields row is missing, only used if its key is new. None by default.
+    """
+    defaults = defaults or {}
+    key = row.get(key_column)
+    old = None
+    if key != None:
+        cur.execute(f"SELECT * FROM {table} WHERE {key_column} = ?", (key,))
+        values = cur.fetchone()
+        if values != None:
+            old = dict(zip([description[0] for description in cur.description], values))
+
+    if old == None:
+        row = dict(row)
+        for field, value in defaults.items():
+            if row.get(field) in (None, ""):
+                row[field] = value
+        cur.execute(f"INSERT OR IGNORE INTO {table} ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})", tuple(row.values()))
+    else:
+        # Fields the new row doesn't have anymore e.g. pledges of a removed reward are cleared.
+        new = dict(row)
+        for field, value in old.items():
+            if field not in new and value not in (None, ""):
+                new[field] = None
+        # Fields only the defaults had keep their stored value.
+        for field in defaults:
+            if new.get(field) in (None, "") and field in old:
+                new[field] = old[field]
+
+        changed = {field: value for field, value in new.items() if field != key_column and not same_value(old.get(field), value)}
+        updates = dict(changed)
+        updates.update({field: new[field] for field in ignore if field in new})
+        if updates:
+            cur.execute(f"UPDATE {table} SET {', '.join(f'{field} = ?' for field in updates)} WHERE {key_column} = ?",
+                        (*updates.values(), key))
+
+        previous = cur.execute("SELECT first_observed_at FROM observations WHERE entity_type = ? AND entity_id = ?",
+                               (entity_type, str(key))).fetchone()
+        for field, value in changed.items():
+            if field in ignore:
+                continue
+            # Keep the value from before the first change of a field.
+            has_history = cur.execute("SELECT 1 FROM history WHERE entity_type = ? AND entity_id = ? AND field = ? LIMIT 1",
+                                      (entity_type, str(key), field)).fetchone() != None
+            if not has_history and previous != None:
+                cur.execute("INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?)", (entity_type, str(key), field, previous[0], old.get(field)))
+            cur.execute("INSERT OR REPLACE INTO history VALUES (?, ?, ?, ?, ?)", (entity_type, str(key), field, observed_at, value))
+
+    if key != None:
+        cur.execute("""INSERT INTO observations VALUES (?, ?, ?, ?)
+                    ON CONFLICT(entity_type, entity_id) DO UPDATE SET observed_at = excluded.observed_at""",
+                    (entity_type, str(key), observed_at, observed_at))
+
+db_writer.HANDLERS["write_changes"] = apply_changes
+
+def write_changes(entity_type, table, key_column, row, ignore=(), defaults=None):
+    """
+    Sends row to the db_writer to be inserted, or diffed against the stored row with only the
+    changed fields written and appended to history.
+
+    entity_type [str] - Entity type used in history e.g. project or creator.
+    table [str] - Table holding the latest version of each entity. Must have been made with
+    create_history_tables called on the same database.
+    key_column [str] - Unique column of table identifying the entity.
+    row [dict] - Freshly extracted row.
+    ignore [tuple] - Fields which are updated but not compared or kept in history. Empty by default.
+    defaults [dict] - Values for fields row is missing (None or "") if its key is new e.g. values
+    of the input which go stale on revisits. Revisits keep the stored value of those fields
+    instead. None by default.
+    """
+    db_writer.send("write_changes", entity_type, table, key_column, dict(row), tuple(ignore), time.time(), dict(defaults or {}))
@@ -0,0 +1,429 @@
+import os
+import csv
+import sys
+import json
+import time
+import socket
+import sqlite3
+import logging
+import tempfile
+import threading
+import socketserver
+import multiprocessing
+
+import job_queue
+import bulk_loader
+
+# Settings.
+
+# host:port of the coordinator the scripts claim their jobs from e.g. "10.0.0.5:8765". None to
+# use the local jobs table.
+ADDRESS = None
+# Port the coordinator listens on.
+PORT = 8765
+# Seconds between heartbeats of a worker host. Every heartbeat renews its leases.
+HEARTBEAT_SECONDS = 30
+# Seconds without a heartbeat after which a worker host is considered dead and its jobs are
+# given to other hosts.
+WORKER_TIMEOUT = 3 * HEARTBEAT_SECONDS
+# Seconds a claimed job stays leased without a heartbeat renewing it.
+LEASE_SECONDS = 5 * 60
+# Attempts at reaching the coordinator before a request fails.
+RETRIES = 5
+
+def create_workers_table(con):
+    """
+    Creates the table of worker hosts in the coordinator's database if it doesn't exist.
+
+    con [sqlite3.Connection] - A database connection.
+    """
+    # One row per worker host which is connected or left without saying goodbye.
+    con.execute("""CREATE TABLE IF NOT EXISTS workers(
+                name TEXT PRIMARY KEY,
+                address TEXT,
+                first_seen REAL,
+                last_seen REAL,
+                claimed INTEGER NOT NULL DEFAULT 0,
+                finished INTEGER NOT NULL DEFAULT 0
+                )""")
+    con.commit()
+
+def touch_worker(con, worker, address=None):
+    """Records that worker was just heard from."""
+    now = time.time()
+    con.execute("""INSERT INTO workers (name, address, first_seen, last_seen) VALUES (?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET last_seen = excluded.last_seen,
+                address = COALESCE(excluded.address, address)""", (worker, address, now, now))
+    con.commit()
+
+def reclaim_dead_workers(con, timeout=None):
+    """
+    Makes the jobs leased by workers which have not sent a heartbeat for timeout seconds pending
+    again and forgets those workers. Returns the number of jobs reclaimed.
+
+    con [sqlite3.Connection] - A database connection.
+    timeout [float] - Seconds without a heartbeat. WORKER_TIMEOUT by default.
+    """
+    timeout = timeout if timeout != None else WORKER_TIMEOUT
+    reclaimed = 0
+    for (worker,) in con.execute("SELECT name FROM workers WHERE last_seen < ?", (time.time() - timeout,)).fetchall():
+        leased = con.execute("SELECT COUNT(*) FROM jobs WHERE status = 'leased' AND lease_owner = ?", (worker,)).fetchone()[0]
+        job_queue.release_leases(con, worker)
+        con.execute("DELETE FROM workers WHERE name = ?", (worker,))
+        con.commit()
+        reclaimed += leased
+        logging.info(f"Worker {worker} stopped sending heartbeats. Reclaimed its {leased} jobs.")
+    return reclaimed
+
+def handle_request(con, request, address=None):
+    """
+    Runs one request of a worker host on the coordinator's database and returns the response.
+
+    con [sqlite3.Connection] - Connection to the coordinator's database.
+    request [dict] - Request with an "op" and a "worker" name.
+    address [str] - Network address of the worker. None by default.
+    """
+    op = request["op"]
+    worker = request.get("worker")
+    if op == "status":
+        return {"jobs": dict(con.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()),
+                "workers": [dict(zip(("name", "address", "last_seen", "claimed", "finished"), row)) for row in
+                            con.execute("SELECT name, address, last_seen, claimed, finished FROM workers ORDER BY name")]}
+
+    touch_worker(con, worker, address)
+    if op == "claim":
+        jobs = job_queue.claim_jobs(con, request["n"], worker, LEASE_SECONDS)
+        con.execute("UPDATE workers SET claimed = claimed + ? WHERE name = ?", (len(jobs), worker))
+        con.commit()
+        wait = None
+        if not jobs:
+            wait = job_queue.seconds_until_retry(con)
+            # Jobs leased by other hosts may still come back if those hosts die.
+            if wait == None and con.execute("SELECT 1 FROM jobs WHERE status = 'leased' LIMIT 1").fetchone() != None:
+                wait = HEARTBEAT_SECONDS
+        pending = con.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        return {"jobs": jobs, "wait": wait, "pending": pending}
+
+    if op == "finish":
+        retried = 0
+        for key, outcome, error in request["results"]:
+            retried += job_queue.finish_job(con, key, outcome, error)
+        con.execute("UPDATE workers SET finished = finished + ? WHERE name = ?", (len(request["results"]), worker))
+        con.commit()
+        return {"retried": retried}
+
+    if op == "heartbeat":
+        # Only the jobs the worker knows it holds are renewed. Others leased to it e.g. by a claim
+        # whose response was lost expire and are claimed again.
+        keys = request.get("keys", [])
+        cur = con.executemany("UPDATE jobs SET lease_expires = ? WHERE status = 'leased' AND lease_owner = ? AND key = ?",
+                              [(time.time() + LEASE_SECONDS, worker, key) for key in keys])
+        con.commit()
+        return {"leased": cur.rowcount}
+
+    if op == "leave":
+        job_queue.release_leases(con, worker)
+        con.execute("DELETE FROM workers WHERE name = ?", (worker,))
+        con.commit()
+        return {}
+
+    raise ValueError(f"Unknown op {op}.")
+
+# Ops which change the jobs table and are answered from the last response of the worker when
+# they are resent with the same request id.
+REPLAYED_OPS = ("claim", "finish")
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Answers the JSON line requests of one worker connection, one response line per request.
+    A claim or finish resent after its response was lost gets the first response again instead
+    of being run twice."""
+    def handle(self):
+        address = f"{self.client_address[0]}:{self.client_address[1]}"
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                with self.server.lock:
+                    key = (request.get("worker"), request.get("id"))
+                    if request["op"] in REPLAYED_OPS and key[1] != None and self.server.replies.get(key[0], (None,))[0] == key:
+                        response = self.server.replies[key[0]][1]
+                    else:
+                        try:
+                            response = handle_request(self.server.con, request, address)
+                        except Exception:
+                            self.server.con.rollback()
+                            raise
+                        if request["op"] in REPLAYED_OPS:
+                            self.server.replies[key[0]] = (key, response)
+                        elif request["op"] == "leave":
+                            self.server.replies.pop(key[0], None)
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+
+class CoordinatorServer(socketserver.ThreadingTCPServer):
+    """Threaded server with the coordinator's database connection, shared by its handlers
+    under lock."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def shutdown(self):
+        """Stops serving and reclaiming and closes the database."""
+        self.stop.set()
+        super().shutdown()
+        self.server_close()
+        self.con.close()
+
+def start_server(database, port=PORT, host="0.0.0.0"):
+    """
+    Starts serving the jobs table of database in background threads, with another thread
+    reclaiming the jobs of dead workers, and returns the server. Stop it with server.shutdown().
+    Port 0 picks a free port, found in server.server_address.
+
+    database [str] - Path to a sqlite database whose jobs table was loaded with load.
+    port [int] - Port to listen on. PORT by default.
+    host [str] - Interface to listen on. Every interface by default.
+    """
+    con = sqlite3.connect(database, timeout=60, check_same_thread=False)
+    con.execute("PRAGMA journal_mode=WAL")
+    job_queue.create_jobs_table(con)
+    create_workers_table(con)
+
+    server = CoordinatorServer((host, port), RequestHandler)
+    server.con = con
+    server.lock = threading.Lock()
+    server.stop = threading.Event()
+    # Last ((worker, request id), response) of a claim or finish of every worker.
+    server.replies = {}
+
+    def reap():
+        while not server.stop.wait(HEARTBEAT_SECONDS):
+            with server.lock:
+                reclaim_dead_workers(con)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=reap, daemon=True).start()
+    logging.info(f"Coordinator serving {database} on {host}:{server.server_address[1]}.")
+    return server
+
+def load(database, path, key):
+    """
+    Loads the work items of a csv file or json array into the jobs table of database, skipping
+    the file if it is unchanged since it was last loaded. Json items which aren't objects e.g.
+    creator ids are loaded as {key: item}.
+
+    database [str] - Path to the coordinator's database.
+    path [str] - Input file e.g. DATA_PATH of project_data_extractor.
+    key [str] - Field of an item to use as its job key e.g. url or creator_id.
+    """
+    con = sqlite3.connect(database, timeout=60)
+    job_queue.create_jobs_table(con)
+    if job_queue.is_loaded(con, path):
+        logging.info(f"{path} is already loaded.")
+    elif path.endswith(".csv"):
+        with open(path, encoding="utf8", newline="") as f_obj:
+            job_queue.load_jobs(con, path, csv.DictReader(f_obj), key)
+    else:
+        items = (item if isinstance(item, dict) else {key: str(item)} for item in bulk_loader.iter_json_array(path))
+        job_queue.load_jobs(con, path, items, key)
+    con.close()
+
+class Client:
+    """
+    Connection of a worker host to the coordinator. Sends a heartbeat every HEARTBEAT_SECONDS
+    from a background thread so the jobs it claimed and hasn't finished stay leased while they
+    are worked on, and reconnects if the connection drops. Requests carry an id so one resent
+    after a lost response isn't run twice.
+
+    address [str] - host:port of the coordinator. ADDRESS by default.
+    worker [str] - Name of the worker host. Host name and pid by default.
+    heartbeat [bool] - False for clients which don't claim jobs e.g. to read the status. True by
+    default.
+    """
+    def __init__(self, address=None, worker=None, heartbeat=True):
+        host, port = (address if address != None else ADDRESS).rsplit(":", 1)
+        self.address = (host, int(port))
+        self.worker = worker if worker != None else f"{job_queue.WORKER_NAME}-{os.getpid()}"
+        self._lock = threading.Lock()
+        self._file = None
+        self._stop = threading.Event()
+        # Id of the last request and keys of the jobs claimed and not finished.
+        self._request_id = 0
+        self._held = set()
+        if heartbeat:
+            threading.Thread(target=self._send_heartbeats, daemon=True).start()
+
+    def request(self, op, **fields):
+        """Sends a request and returns the response, retrying with a new connection if the
+        coordinator can't be reached."""
+        with self._lock:
+            self._request_id += 1
+            request_id = self._request_id
+        line = (json.dumps({"op": op, "worker": self.worker, "id": request_id, **fields}) + "\n").encode()
+        for attempt in range(RETRIES):
+            try:
+                with self._lock:
+                    if self._file == None:
+                        self._file = socket.create_connection(self.address, timeout=60).makefile("rwb")
+                    self._file.write(line)
+                    self._file.flush()
+                    response = self._file.readline()
+                if not response:
+                    raise ConnectionError("Coordinator closed the connection.")
+                break
+            except OSError as e:
+                self._disconnect()
+                if attempt == RETRIES - 1:
+                    raise
+                logging.info(f"Coordinator unreachable ({e}). Retrying...")
+                time.sleep(2 ** attempt)
+
+        response = json.loads(response)
+        if "error" in response:
+            raise Exception(f"Coordinator error: {response['error']}")
+        return response
+
+    def claim(self, n):
+        """
+        Leases at most n jobs and returns (jobs, wait, pending) where jobs is a list of (key,
+        payload) tuples. If jobs is empty wait is the seconds to wait before claiming again or
+        None if the crawl is finished.
+
+        n [int] - Maximum number of jobs to claim.
+        """
+        response = self.request("claim", n=n)
+        jobs = [tuple(job) for job in response["jobs"]]
+        with self._lock:
+            self._held.update(key for key, payload in jobs)
+        return jobs, response["wait"], response["pending"]
+
+    def finish(self, results):
+        """
+        Reports the outcomes of claimed jobs. Returns the number of jobs which will be retried.
+
+        results [list] - (key, outcome, error) tuples like the arguments of job_queue.finish_job.
+        """
+        retried = self.request("finish", results=[list(result) for result in results])["retried"]
+        with self._lock:
+            self._held.difference_update(key for key, outcome, error in results)
+        return retried
+
+    def status(self):
+        """Returns the number of jobs by status and the connected workers."""
+        return self.request("status")
+
+    def _send_heartbeats(self):
+        while not self._stop.wait(HEARTBEAT_SECONDS):
+            try:
+                with self._lock:
+                    keys = list(self._held)
+                self.request("heartbeat", keys=keys)
+            except Exception as e:
+                logging.info(f"Heartbeat failed: {e}")
+
+    def _disconnect(self):
+        with self._lock:
+            if self._file != None:
+                try:
+                    self._file.close()
+                except OSError:
+                    pass
+                self._file = None
+
+    def close(self):
+        """Stops the heartbeats and gives back any jobs still leased."""
+        self._stop.set()
+        try:
+            self.request("leave")
+        finally:
+            self._disconnect()
+
+def run_test_worker(address, worker, settings, crash=False):
+    # Testing code. A worker host which claims jobs, sleeps instead of scraping and reports them
+    # done, or stops sending heartbeats after its first claim if crash is True.
+    global HEARTBEAT_SECONDS, WORKER_TIMEOUT, LEASE_SECONDS
+    HEARTBEAT_SECONDS, WORKER_TIMEOUT, LEASE_SECONDS = settings
+    client = Client(address, worker)
+    while True:
+        jobs, wait, pending = client.claim(3)
+        if crash:
+            os._exit(1)
+        if not jobs:
+            if wait == None:
+                break
+            time.sleep(min(wait, 0.5))
+            continue
+        time.sleep(0.05)
+        client.finish([(key, job_queue.SUCCESS, None) for key, payload in jobs])
+    client.close()
+
+def test_coordinator():
+    # Testing code. Runs a crawl of 60 jobs with four worker processes posing as hosts on
+    # localhost. One of them dies right after claiming jobs, which are reclaimed by the others.
+    global HEARTBEAT_SECONDS, WORKER_TIMEOUT, LEASE_SECONDS
+    settings = HEARTBEAT_SECONDS, WORKER_TIMEOUT, LEASE_SECONDS = 0.2, 1, 3
+
+    with tempfile.TemporaryDirectory() as path:
+        database = os.path.join(path, "coordinator.db")
+        items_path = os.path.join(path, "creator_ids.json")
+        with open(items_path, "w") as f_obj:
+            json.dump(list(range(60)), f_obj)
+        load(database, items_path, "creator_id")
+
+        server = start_server(database, 0, "127.0.0.1")
+        address = f"127.0.0.1:{server.server_address[1]}"
+        start = time.time()
+
+        # A claim and a finish resent after a lost response are answered without running again.
+        with socket.create_connection(server.server_address) as sock:
+            f_obj = sock.makefile("rwb")
+            def send(request):
+                f_obj.write((json.dumps({"worker": "resender", **request}) + "\n").encode())
+                f_obj.flush()
+                return json.loads(f_obj.readline())
+            claimed = [send({"op": "claim", "id": 1, "n": 2}) for i in range(2)]
+            assert claimed[0] == claimed[1] and len(claimed[0]["jobs"]) == 2, claimed
+            results = [[key, job_queue.SUCCESS, None] for key, payload in claimed[0]["jobs"]]
+            finished = [send({"op": "finish", "id": 2, "results": results}) for i in range(2)]
+            assert finished[0] == finished[1], finished
+            send({"op": "leave", "id": 3})
+        hosts = [multiprocessing.Process(target=run_test_worker, args=(address, f"host-{i}", settings, i == 0)) for i in range(4)]
+        for host in hosts:
+            host.start()
+        for host in hosts:
+            host.join()
+
+        status = Client(address, "tester", heartbeat=False).status()
+        server.shutdown()
+
+        con = sqlite3.connect(database)
+        attempts = dict(con.execute("SELECT key, attempts FROM jobs"))
+        con.close()
+
+    assert status["jobs"] == {"done": 60}, status
+    # The dead host's three jobs were claimed a second time.
+    assert sorted(attempts.values()).count(2) == 3, attempts
+    # Finished hosts left and the dead one was forgotten.
+    assert status["workers"] == [], status
+    logging.info(f"Coordinator test passed in {time.time() - start:.1f}s.")
+
+if __name__ == "__main__":
+    # python coordinator.py load <database> <input file> <key>
+    # python coordinator.py serve <database> [port]
+    # python coordinator.py status <host:port>
+    # python coordinator.py test
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%m/%d/%Y %I:%M:%S %p')
+    command = sys.argv[1] if len(sys.argv) > 1 else "test"
+    if command == "load":
+        load(sys.argv[2], sys.argv[3], sys.argv[4])
+    elif command == "serve":
+        server = start_server(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else PORT)
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif command == "status":
+        client = Client(sys.argv[2], "status", heartbeat=False)
+        print(json.dumps(client.status(), indent=2))
+    else:
+        test_coordinator()
@@ -10,16 +10,31 @@ import multiprocessing
 import sqlite3
 import traceback
 
-import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
-
-import pyautogui
 from bs4 import BeautifulSoup
 
+import browser_profile
+import profile_pages
+import project_store
+import job_queue
+import bulk_loader
+import db_writer
+import page_archive
+import refresh_scheduler
+import change_history
+import metrics
+import egress_pool
+import worker_session
+import profiling
+import tracing
+import coordinator
+import sharding
+
 # Location of creator_ids.json
 CREATOR_FILE_PATH = r"D:\remaining_creator_ids_0.json"
 # Output file path.
 OUTPUT_PATH = r"D:"
+# Output file path used in replay mode.
+REPLAY_OUTPUT_PATH = r"D:\replay"
 # Chromedriver path
 CHROMEDRIVER_PATH = r"C:\Users\jaber\OneDrive\Desktop\Research_JaberChowdhury\Kickstarter-Data-Scraper\chromedriver.exe"
 # Proton vpn windows taskbar location.
@@ -27,67 +42,116 @@ icon_num = 5
 
 # Number of processes per try.
 chunk_size = 10
+# Set to True to load backed projects by scrolling the profile page instead of
+# fetching its list pages directly.
+SCROLL_BACKED = False
+# Set to True to extract from pages stored by page_archive instead of scraping them. Results
+# are written to REPLAY_OUTPUT_PATH and creators that were never archived are skipped. Pages
+# are only archived by runs with page_archive.ENABLED set.
+REPLAY = False
 # Set logging.
 logging.getLogger('uc').setLevel(logging.ERROR)
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%m/%d/%Y %I:%M:%S %p')
-# Pyautogui settings.
-pyautogui.PAUSE = 1
-pyautogui.FAILSAFE = True
-
-# Lock to prevent multiple processes from trying to access database.
-db_lock = multiprocessing.Lock()
 
 def main():
-    with open(CREATOR_FILE_PATH, "r") as f_obj:
-        creator_ids = json.load(f_obj)
-    os.makedirs(OUTPUT_PATH, exist_ok=True)
+    output_path = REPLAY_OUTPUT_PATH if REPLAY else OUTPUT_PATH
+    os.makedirs(output_path, exist_ok=True)
+    metrics.start_exporter()
+    profiling.start()
+    tracing.start()
+    # Spread workers over the egress pool if one is configured.
+    if egress_pool.ENABLED:
+        egress_pool.reset()
+        egress_pool.probe_all()
 
     # Get connection to database file.
-    con = create_creators_db(OUTPUT_PATH)
-    cur = con.cursor()
-
-    deleted = set(cid[0] for cid in cur.execute("SELECT creator_id FROM deleted_creators;"))
-    extracted_creators = set(cid[0] for cid in cur.execute("SELECT creator_id FROM creator;"))
-    aliases = set(cid[0] for cid in cur.execute("SELECT alias FROM creator_alias;"))
-    con.close()
-
-    skip = extracted_creators | deleted | aliases
-    creator_ids = [creator_id for creator_id in creator_ids if creator_id not in skip]
-
-    pool = multiprocessing.Pool()
+    con = create_creators_db(output_path)
+
+    # Load creators to extract into the jobs table, skipping extracted, deleted and aliased
+    # creators. Only done again if CREATOR_FILE_PATH changes. Jobs are claimed from the
+    # coordinator instead if one is set.
+    client = coordinator.Client() if coordinator.ADDRESS != None else None
+    if client == None and not job_queue.is_loaded(con, CREATOR_FILE_PATH):
+        logging.info("Loading creators to extract...")
+        creator_ids = ({"creator_id": str(creator_id)} for creator_id in sharding.select(bulk_loader.iter_json_array(CREATOR_FILE_PATH)))
+        job_queue.load_jobs(con, CREATOR_FILE_PATH, creator_ids, "creator_id")
+        job_queue.mark_done(con, "SELECT creator_id FROM creator UNION SELECT creator_id FROM deleted_creators UNION SELECT alias FROM creator_alias")
+    # Resume jobs this host had claimed before a restart.
+    job_queue.release_leases(con)
+
+    # Revisit extracted creators which are due. Visits are recorded under the canonical creator
+    # id, which has no job yet if the creator was loaded under an alias.
+    if client == None:
+        logging.info(f"{job_queue.requeue_jobs(con, refresh_scheduler.DUE_SQL, ('creator', time.time()), 'creator_id')} creators are due for a revisit.")
+
+    # Workers send their rows to a single writer process.
+    writer = db_writer.start_writer(os.path.join(output_path, sharding.shard_path("creators.db")))
+    pool = multiprocessing.Pool(initializer=db_writer.init_worker, initargs=(writer.queue,))
 
     click_random(icon_num)
-    total = 0
-    for i in range(0, len(creator_ids), chunk_size):
-        while True:
-            try:
-                pool.map(extract_write, creator_ids[i:i + chunk_size])
-            except Exception:
-                logging.info(f"\nException -\n {traceback.format_exc()} \nRetrying...")
+    while True:
+        # Claim at maximum chunk_size jobs per iteration.
+        if client != None:
+            jobs, wait, pending = client.claim(chunk_size)
+        else:
+            jobs = job_queue.claim_jobs(con, chunk_size)
+        if len(jobs) == 0:
+            # Wait for failed jobs to finish their backoff.
+            if client == None:
+                wait = job_queue.seconds_until_retry(con)
+            if wait == None:
+                break
+            time.sleep(min(wait, 60))
+            continue
+
+        results = pool.map(extract_write_job, [row["creator_id"] for key, row in jobs])
+        # Make sure the rows are committed before their jobs are marked done. Only failed jobs
+        # are retried, including jobs whose rows the writer failed to write.
+        failed = db_writer.flush(writer)
+        results = [(job_queue.TRANSIENT, "A write of the job failed in the db_writer.")
+                   if key in failed and outcome not in (job_queue.TRANSIENT, job_queue.PERMANENT) else (outcome, error)
+                   for (key, row), (outcome, error) in zip(jobs, results)]
+        for (key, row), (outcome, error) in zip(jobs, results):
+            if client == None:
+                job_queue.finish_job(con, key, outcome, error)
+            metrics.inc("items_total", script="creator", outcome=outcome)
+            if error != None:
+                metrics.inc("errors_total", script="creator")
+        if client != None:
+            client.finish([(key, outcome, error) for (key, row), (outcome, error) in zip(jobs, results)])
+        else:
+            pending = con.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        metrics.set_gauge("queue_depth", pending, queue="jobs")
+
+        # Workers replace their own browsers when they are blocked or reach their request budget.
+        # Without an egress pool a new IP needs the VPN switch, which pauses every worker.
+        errors = [error for outcome, error in results if outcome == job_queue.TRANSIENT]
+        if errors:
+            logging.info(f"\nException -\n {errors[0]} \nRetrying later...")
+            if not egress_pool.ENABLED:
                 click_random(icon_num)
                 time.sleep(10)
-            else:
-                break      
-            
-        # Stop scraping for a period of time to not be blocked as a bot.
-        total += chunk_size
-        if total % (chunk_size * 10) == 0:
-            logging.info("Changing server...\n")
-            click_random(icon_num)
     
+    if client != None:
+        client.close()
     pool.close()
     pool.join()
+    db_writer.stop_writer(writer)
+    con.close()
+    metrics.stop_exporter()
+    profiling.report()
 
 def create_creators_db(path):
     """
-    Creates creators.db in path and returns a connection.
+    Creates creators.db in path and returns a connection. Every shard has its own e.g.
+    creators_shard2of4.db.
     
     path[str] - Location to save/load 'creators.db'
     """
-    con = sqlite3.connect(os.path.join(path, "creators.db"))
+    con = sqlite3.connect(os.path.join(path, sharding.shard_path("creators.db")))
     cur = con.cursor()
 
-    # Table for creators data.
+    # Table for creators data. created_projects and backed_projects are json lists of ids in project_store.
     cur.execute("""CREATE TABLE IF NOT EXISTS creator(
                 url	TEXT,
                 creator_id	TEXT UNIQUE,
@@ -122,6 +186,12 @@ def create_creators_db(path):
 	            alias TEXT
     )          
                 """)
+    cur.execute("CREATE INDEX IF NOT EXISTS creator_alias_alias ON creator_alias(alias)")
+
+    project_store.create_project_store(con)
+    refresh_scheduler.create_visits_table(con)
+    change_history.create_history_tables(con)
+    job_queue.create_jobs_table(con)
 
     con.commit()
     return con
@@ -135,6 +205,13 @@ def click_random(icon_num, wait=True):
     wait [bool] - If True, function will sleep for 10s to make sure Proton Vpn
     connects and otherwise it will not sleep. True by default.
     """
+    # Nothing is fetched in replay mode and workers rotate their own egress if there is a pool.
+    if REPLAY or egress_pool.ENABLED:
+        return
+    import pyautogui
+
+    pyautogui.PAUSE = 1
+    pyautogui.FAILSAFE = True
     pyautogui.hotkey('win', str(icon_num))
     pyautogui.click(333, 563, clicks=3, interval=0.15)
     time.sleep(2)
@@ -160,6 +237,7 @@ def get_digits(string, conv="float"):
             return ""
         return int("".join(res))
     
+@tracing.traced
 def get_live_soup(link, scroll=False, given_driver=None):
     """Returns a bs4 soup object of the given link. Returns None if it is a deleted kickstarter account.
     
@@ -167,20 +245,35 @@ def get_live_soup(link, scroll=False, given_driver=None):
     scroll [bool] - True if you want selenium to keep scrolling down till loading no longer happens.
     False by default.
     given_driver [selenium webdriver] - A webdriver. None by default."""
+    from selenium.webdriver.common.by import By
+
     if given_driver == None:
-        driver = uc.Chrome(driver_executable_path=CHROMEDRIVER_PATH)
+        driver = browser_profile.new_driver(CHROMEDRIVER_PATH, egress=egress_pool.get_egress())
     else:
         driver = given_driver
-    driver.get(link)
+    browser_profile.prepare_page(driver)
+    fetch_started = time.perf_counter()
+    with metrics.timer(stage="fetch"):
+        driver.get(link)
+    fetch_seconds = time.perf_counter() - fetch_started
+    metrics.inc("pages_total", page="profile")
 
     soup = BeautifulSoup(driver.page_source, "lxml")
 
     # If there is a capcha, Beep and sleep.
     capcha_elem = soup.select_one('div[id="px-captcha"]')
+    worker_session.record_page(fetch_seconds, capcha_elem != None)
     if capcha_elem != None:
+        metrics.inc("captchas_total")
+        # The worker's session moves to a new browser on another egress. The creator is retried.
+        if egress_pool.ENABLED:
+            if given_driver == None:
+                driver.quit()
+            raise worker_session.BlockedError("Captcha encountered.")
         winsound.Beep(440, 1000)        
         time.sleep(30)
     
+    wait_started = time.perf_counter()
     if not scroll:
         time.sleep(1)
     else:
@@ -208,13 +301,22 @@ def get_live_soup(link, scroll=False, given_driver=None):
             else:
                 break
 
-    soup = BeautifulSoup(driver.page_source, "lxml")
+    metrics.observe("stage_seconds", time.perf_counter() - wait_started, stage="wait")
+
+    browser_profile.log_bandwidth(link, browser_profile.get_network_events(driver))
+    page_source = driver.page_source
+    if page_archive.ENABLED:
+        page_archive.store(link, page_source)
+    with metrics.timer(stage="parse"):
+        soup = BeautifulSoup(page_source, "lxml")
 
     # If it is a deleted account or there is a 404 error, return.
     deleted_elem = soup.select_one('div[class="center"]')
     non_existent_elem = soup.select_one('a[href="/?ref=404-ksr10"]')
     if deleted_elem != None or non_existent_elem != None:
-        driver.quit()
+        metrics.inc("deleted_pages_total")
+        if given_driver == None:
+            driver.quit()
         return
     
     if given_driver == None:
@@ -222,6 +324,30 @@ def get_live_soup(link, scroll=False, given_driver=None):
 
     return soup
 
+def get_archived_soup(link):
+    """Returns a bs4 soup object of the latest archived copy of link. Returns None if it is a deleted
+    kickstarter account. Raises job_queue.PermanentError if link was never archived.
+    
+    link [str] - A link to a website."""
+    page_source = page_archive.load(link)
+    if page_source == None:
+        raise job_queue.PermanentError(f"{link} is not in the page archive.")
+
+    soup = BeautifulSoup(page_source, "lxml")
+    if soup.select_one('div[class="center"]') != None or soup.select_one('a[href="/?ref=404-ksr10"]') != None:
+        return
+    return soup
+
+def archive_data_projects(link, data_projects):
+    """Stores the kickstarter data project dicts read from link in page_archive if archiving is enabled."""
+    if page_archive.ENABLED:
+        page_archive.store(link, json.dumps(data_projects), "data_projects", "application/json")
+
+def load_data_projects(link):
+    """Returns the archived kickstarter data project dicts of link or an empty list if there are none."""
+    data_projects = page_archive.load(link, "data_projects")
+    return json.loads(data_projects) if data_projects != None else []
+
 def extract_elem_text(soup, selector):
     """Returns resulting text of using given selector in soup.
     If there was no text, returns empty string. 
@@ -242,6 +368,7 @@ def parse_data_project(data_project):
     data-project [dict]- A kickstarter data project dict."""
     result = {}
 
+    result['id'] = data_project['id']
     result['name'] = data_project['name']
     result['url'] = data_project['urls']['web']['project']
     result['creator_id'] = data_project['creator']['id']
@@ -272,32 +399,59 @@ def parse_data_project(data_project):
 
     return result
 
+def get_backed_data_projects(backed_soup):
+    """Returns a list of kickstarter data project dicts from a fully loaded backed projects page.
+    
+    backed_soup [bs4.BeautifulSoup] - Soup of a scrolled profile page."""
+    if backed_soup == None:
+        return []
+    return [json.loads(elem['data-project']) for elem in backed_soup.select('div[data-project]')]
+
+def get_backed_projects(backed_soup):
+    """Returns a list of parsed data projects from a fully loaded backed projects page.
+    
+    backed_soup [bs4.BeautifulSoup] - Soup of a scrolled profile page."""
+    return [parse_data_project(data_project) for data_project in get_backed_data_projects(backed_soup)]
+
+def launch_driver(egress=None):
+    """Returns a new webdriver for a worker session.
+
+    egress [str] - Egress from egress_pool or None. None by default."""
+    return browser_profile.new_driver(CHROMEDRIVER_PATH, egress=egress)
+
+@tracing.traced
 def extract_creator_data(path, is_link=True):
     """Returns a dictionary of the data for the creator. If passed a file, it should be of
     a format like 'Dice Dungeons — About.html'. Returns None in case of a deleted account."""
     data = {}
 
-    if is_link:
+    if is_link and REPLAY:
+        # Same pages as below from the archive. Project lists are archived as data projects.
+        about_soup = get_archived_soup(path + "/about")
+        if about_soup == None:
+            return
+
+        created_projects = [parse_data_project(data_project) for data_project in load_data_projects(path + "/created")]
+        backed_projects = [parse_data_project(data_project) for data_project in load_data_projects(path + "/backed")]
+        comment_soup = None
+        backed = get_digits(extract_elem_text(about_soup, 'span[class="backed"]'), "int")
+    elif is_link:
+        # The worker keeps its browser between creators.
+        session = worker_session.get_session(launch_driver)
         try:
-            driver = uc.Chrome(driver_executable_path=CHROMEDRIVER_PATH)
+            driver = session.get_driver()
             # Extract data from available pages.
             about_soup = get_live_soup(path + "/about", given_driver=driver)
 
             if about_soup == None:
                 return 
             
-            # There may be multiple pages for created projects.
+            # There may be multiple pages for created projects. Remaining pages are fetched
+            # concurrently and parsed as they arrive.
             created_soup = get_live_soup(path + "/created", given_driver=driver)
-            created_soups = [created_soup]
-            while True:
-                next_elem = created_soup.select_one('a[rel="next"]')
-
-                # No further pages.
-                if next_elem == None:
-                    break   
-                
-                created_soup = get_live_soup("https://www.kickstarter.com/" + next_elem['href'], given_driver=driver)
-                created_soups.append(created_soup)
+            created_data_projects = list(profile_pages.iter_created_data_projects(driver, path + "/created", created_soup))
+            archive_data_projects(path + "/created", created_data_projects)
+            created_projects = [parse_data_project(data_project) for data_project in created_data_projects]
 
             # Do not try to scrap pages if they are not public. 
             comment_soup = None
@@ -310,14 +464,32 @@ def extract_creator_data(path, is_link=True):
             backed = extract_elem_text(about_soup, 'span[class="backed"]')
             backed = get_digits(backed, "int")
 
+            backed_data_projects = []
             if about_soup.select_one('a[class="nav--subnav__item__link nav--subnav__item__link--gray js-backed-link"]') != None and backed != 0:
-                backed_soup = get_live_soup(path, True, driver)
-            else:
-                backed_soup = None
+                if not SCROLL_BACKED:
+                    try:
+                        backed_data_projects = list(profile_pages.iter_backed_data_projects(driver, path))
+                    except worker_session.BlockedError:
+                        raise
+                    except Exception as e:
+                        logging.info(f"Fetching the backed list pages of {path} failed, scrolling instead: {e!r}")
+                        backed_data_projects = []
+
+                # Fall back to scrolling the profile page if the list pages couldn't be fetched or
+                # failed.
+                if not backed_data_projects:
+                    backed_soup = get_live_soup(path, True, driver)
+                    backed_data_projects = get_backed_data_projects(backed_soup)
+            archive_data_projects(path + "/backed", backed_data_projects)
+            backed_projects = [parse_data_project(data_project) for data_project in backed_data_projects]
+        except worker_session.BlockedError:
+            # The egress is blocked so the next creator uses another one.
+            session.rotate(blocked=True)
+            raise
         except Exception:
-            raise Exception
-        finally:
-            driver.quit()
+            # Replace a browser left in an unknown state before the next creator.
+            session.rotate(blocked=False)
+            raise
     else:
         with open(path + " — About.html", encoding='utf8', errors="backslashreplace") as infile:
             about_soup = BeautifulSoup(infile, "lxml")
@@ -325,11 +497,14 @@ def extract_creator_data(path, is_link=True):
             comment_soup = BeautifulSoup(infile, "lxml")
         with open(path + " — Created.html", encoding='utf8', errors="backslashreplace") as infile:
             created_soup = BeautifulSoup(infile, "lxml")
+        created_project_elem = created_soup.select_one('div[data-projects]')
+        created_projects = [parse_data_project(data_project) for data_project in json.loads(created_project_elem['data-projects'])]
         if about_soup.select_one('a[class="nav--subnav__item__link nav--subnav__item__link--gray js-backed-link"]') != None:
             with open(path + " — Backed.html", encoding='utf8', errors="backslashreplace") as infile:
                 backed_soup = BeautifulSoup(infile, "lxml")
+            backed_projects = get_backed_projects(backed_soup)
         else:
-            backed_soup = None                  
+            backed_projects = []
 
     # Creator id.
     url_elem = about_soup.select_one('meta[property="og:url"]')
@@ -384,57 +559,68 @@ def extract_creator_data(path, is_link=True):
     data['comments'] = comments
 
     # Created projects.
-    created_data_projects = []
-    for created_soup in created_soups:
-        created_project_elem = created_soup.select_one('div[data-projects]')
-        created_data_projects.extend(json.loads(created_project_elem['data-projects']))
-
-    created_projects = []
-    for created_data_project in created_data_projects:
-        created_projects.append(parse_data_project(created_data_project))
     data['created_projects'] = created_projects
 
     # Backed projects.
-    backed_projects = []
-    if backed_soup != None:
-        backed_data_projects = [json.loads(elem['data-project']) for elem in backed_soup.select('div[data-project]')]
-        for backed_data_project in backed_data_projects:
-            backed_projects.append(parse_data_project(backed_data_project))   
     data['backed_projects'] = backed_projects
 
-    # Serialize lists to make it possible to add them as TEXT type in sql table.
+    # Serialize lists to make it possible to add them as TEXT type in sql table. Projects are
+    # replaced by their ids in extract_write once they are sent to project_store.
     data['websites'] = json.dumps(data['websites'])
     data['comments'] = json.dumps(data['comments'])
-    data['created_projects'] = json.dumps(data['created_projects'])
-    data['backed_projects'] = json.dumps(data['backed_projects'])
     
     return data
 
+@tracing.traced
 def extract_write(creator_id):
-    """Takes a creator_id, extracts data from pages and adds data to database."""
-    logging.info(f"Started extracting {creator_id} data...")
-    creator_datum = extract_creator_data(r"https://www.kickstarter.com/profile/" + creator_id)
-
-    with db_lock:
-        con = sqlite3.connect(os.path.join(OUTPUT_PATH, "creators.db"))
-        cur = con.cursor()
+    """Takes a creator_id, extracts data from pages and adds data to database. Returns the
+    job_queue outcome."""
+    path = r"https://www.kickstarter.com/profile/" + creator_id
+    if REPLAY and not page_archive.has(path + "/about"):
+        logging.info(f"{creator_id} is not archived. Skipping...")
+        return job_queue.PERMANENT
 
-        # Add creator to deleted_creators table.
-        if creator_datum == None:
-            cur.execute("INSERT OR IGNORE INTO deleted_creators VALUES (?)", (creator_id,))
-            logging.info(f"Added {creator_id} to table...")
-        # Add data to creator table.
-        else:
-            cur.execute("INSERT OR IGNORE INTO creator VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", tuple(creator_datum.values()))
-
-            # Creator has alternate creator id.
-            if creator_id != creator_datum['creator_id']:
-                cur.execute("INSERT OR IGNORE INTO creator_alias VALUES (?, ?)", (creator_datum['creator_id'], creator_id))
-    
-            logging.info(f"Added {creator_id} to table...")
-        
-        con.commit()
-        con.close()
+    logging.info(f"Started extracting {creator_id} data...")
+    creator_datum = extract_creator_data(path)
+
+    # Add creator to deleted_creators table.
+    if creator_datum == None:
+        db_writer.write("INSERT OR IGNORE INTO deleted_creators VALUES (?)", (creator_id,))
+        logging.info(f"Added {creator_id} to table...")
+        return job_queue.DELETED
+    # Add data to creator table.
+    else:
+        # Store each project once and keep only their ids in the creator row.
+        creator = creator_datum['creator_id']
+        for relation, key in (("created", "created_projects"), ("backed", "backed_projects")):
+            projects = creator_datum[key]
+            db_writer.write_many(project_store.UPSERT_SQL, [project_store.project_params(project) for project in projects])
+            db_writer.write_many(project_store.LINK_SQL, project_store.link_params(creator, relation, projects))
+            creator_datum[key] = json.dumps([project['id'] for project in projects])
+
+        # Revisits only write changed fields.
+        change_history.write_changes("creator", "creator", "creator_id", creator_datum)
+        refresh_scheduler.record_visit("creator", creator_datum['creator_id'], refresh_scheduler.creator_volatile(creator_datum))
+
+        # Creator has alternate creator id.
+        if creator_id != creator_datum['creator_id']:
+            db_writer.write("INSERT OR IGNORE INTO creator_alias VALUES (?, ?)", (creator_datum['creator_id'], creator_id))
+
+        logging.info(f"Added {creator_id} to table...")
+        return job_queue.SUCCESS
+
+@profiling.profiled
+def extract_write_job(creator_id):
+    """Runs extract_write on creator_id in a new trace and returns (outcome, error) where error
+    is None if it succeeded or the traceback otherwise."""
+    with tracing.trace(creator_id) as root, db_writer.job(creator_id):
+        try:
+            outcome, error = extract_write(creator_id), None
+        except Exception as e:
+            outcome, error = job_queue.error_outcome(e), traceback.format_exc()
+        root["outcome"] = outcome
+    return outcome, error
 
 if __name__ == "__main__":
+    sharding.from_args()
     main()
@@ -0,0 +1,258 @@
+import time
+import queue
+import sqlite3
+import logging
+import threading
+import traceback
+import multiprocessing
+from collections import namedtuple
+from contextlib import contextmanager
+
+import metrics
+import tracing
+
+# Settings.
+
+# Commit after this many writes.
+BATCH_SIZE = 100
+# Commit at least this often in seconds while there are uncommitted writes.
+BATCH_SECONDS = 2
+# Seconds between write latency and queue depth reports.
+REPORT_SECONDS = 60
+
+# Handle to a running writer. queue takes (method, args, enqueued_at, trace_id, job) items and
+# replies gets answers to flush requests.
+Writer = namedtuple("Writer", ["process", "manager", "queue", "replies"])
+
+# Write queue of the current process. Set by init_worker in pool workers.
+_queue = None
+# Job key each thread's writes belong to.
+_local = threading.local()
+
+def start_writer(database):
+    """
+    Starts a process which holds the only writing connection to database and returns a Writer.
+    The database should already have its tables created.
+
+    database [str] - Path to a sqlite database.
+    """
+    global _queue
+
+    # Manager queues are used so a put has reached the writer's queue once it returns. This keeps
+    # writes made by pool workers ahead of any flush the parent sends after the work returns.
+    manager = multiprocessing.Manager()
+    write_queue = manager.Queue()
+    replies = manager.Queue()
+    process = multiprocessing.Process(target=run_writer, args=(database, write_queue, replies), daemon=True)
+    process.start()
+
+    _queue = write_queue
+    return Writer(process, manager, write_queue, replies)
+
+def init_worker(write_queue):
+    """
+    Pool initializer which lets write be used in pool workers.
+
+    write_queue [queue] - Writer.queue of a running writer.
+    """
+    global _queue
+    _queue = write_queue
+
+@contextmanager
+def job(key):
+    """
+    Context manager which tags the writes sent by the calling thread in its block with a job
+    key, so flush can report the job if one of them fails.
+
+    key [str] - Job key.
+    """
+    previous = getattr(_local, "job", None)
+    _local.job = key
+    try:
+        yield
+    finally:
+        _local.job = previous
+
+def _put(method, args):
+    _queue.put((method, args, time.time(), tracing.current_id(), getattr(_local, "job", None)))
+
+def write(sql, params=()):
+    """
+    Sends a statement to the writer. Only usable in the process that started the writer or in
+    pool workers initialized with init_worker.
+
+    sql [str] - A sql statement.
+    params [tuple] - Statement parameters. Empty by default.
+    """
+    with metrics.timer(stage="ipc"):
+        _put("execute", (sql, tuple(params)))
+
+def write_many(sql, seq_of_params):
+    """
+    Sends a statement to the writer to execute for every params in seq_of_params.
+
+    sql [str] - A sql statement.
+    seq_of_params [list] - List of statement parameters.
+    """
+    with metrics.timer(stage="ipc"):
+        _put("executemany", (sql, [tuple(params) for params in seq_of_params]))
+
+def send(method, *args):
+    """
+    Sends args to the writer to be run by HANDLERS[method]. Modules add their own handlers to
+    HANDLERS when they need to read and write in the same transaction.
+
+    method [str] - Key of a handler in HANDLERS.
+    args - Arguments passed to the handler after the cursor.
+    """
+    with metrics.timer(stage="ipc"):
+        _put(method, args)
+
+def flush(writer):
+    """
+    Blocks until everything sent to the writer so far is committed or failed. Returns the set of
+    job keys with a write which failed since the last flush. Their jobs must be retried since
+    their rows weren't written.
+
+    writer [Writer] - A running writer.
+    """
+    with metrics.timer(stage="flush_wait"):
+        writer.queue.put(("flush", (), time.time(), None, None))
+        return set(writer.replies.get())
+
+def stop_writer(writer):
+    """
+    Commits remaining writes and stops the writer.
+
+    writer [Writer] - A running writer.
+    """
+    writer.queue.put(None)
+    writer.process.join()
+    writer.manager.shutdown()
+
+# Functions the writer runs for each method. Each takes a cursor followed by the item's args.
+HANDLERS = {
+    "execute": lambda cur, sql, params: cur.execute(sql, params),
+    "executemany": lambda cur, sql, seq_of_params: cur.executemany(sql, seq_of_params),
+}
+
+def run_writer(database, write_queue, replies):
+    """
+    Writer process loop. Executes queued writes on one connection in WAL mode and commits them in
+    batches bounded by BATCH_SIZE and BATCH_SECONDS. Writes sent inside a trace get db_queue,
+    db_write and db_commit spans in it.
+
+    database [str] - Path to a sqlite database.
+    write_queue [queue] - Queue of (method, args, enqueued_at, trace_id, job) items. None stops
+    the writer.
+    replies [queue] - Queue to answer flush requests on with the failed job keys.
+    """
+    con = sqlite3.connect(database, timeout=60)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    cur = con.cursor()
+
+    uncommitted = []
+    # Jobs with a failed write since the last flush.
+    failed = set()
+    batch_started = None
+    stats = {"writes": 0, "batches": 0, "latency_total": 0.0, "latency_max": 0.0}
+    last_report = time.time()
+
+    def commit():
+        nonlocal batch_started
+        if uncommitted:
+            try:
+                with metrics.timer(stage="db_commit"):
+                    con.commit()
+            except Exception:
+                # Nothing of the batch was written.
+                metrics.inc("errors_total", stage="db_commit")
+                logging.info(f"\nWriter exception -\n {traceback.format_exc()}")
+                con.rollback()
+                failed.update(job for enqueued_at, trace_id, written_at, job in uncommitted if job != None)
+                uncommitted.clear()
+                batch_started = None
+                return
+            now = time.time()
+            for enqueued_at, trace_id, written_at, job in uncommitted:
+                if trace_id != None:
+                    tracing.add_span("db_commit", written_at, now - written_at, trace_id)
+                latency = now - enqueued_at
+                stats["latency_total"] += latency
+                stats["latency_max"] = max(stats["latency_max"], latency)
+            stats["writes"] += len(uncommitted)
+            stats["batches"] += 1
+            metrics.inc("db_writes_total", len(uncommitted))
+            metrics.inc("db_batches_total")
+            metrics.set_gauge("queue_depth", write_queue.qsize(), queue="writer")
+            uncommitted.clear()
+        batch_started = None
+
+    while True:
+        if batch_started != None:
+            timeout = max(0, batch_started + BATCH_SECONDS - time.time())
+        else:
+            timeout = REPORT_SECONDS
+        try:
+            item = write_queue.get(timeout=timeout)
+        except queue.Empty:
+            item = ()
+
+        if item == None:
+            commit()
+            break
+
+        if item:
+            method, args, enqueued_at, trace_id, job = item
+            if method == "flush":
+                commit()
+                replies.put(sorted(failed))
+                failed.clear()
+            else:
+                started_at = time.time()
+                # Each item runs in a savepoint so a failed one is undone without losing the
+                # rest of the batch.
+                if not con.in_transaction:
+                    cur.execute("BEGIN")
+                cur.execute("SAVEPOINT item")
+                try:
+                    with metrics.timer(stage="db_write"):
+                        HANDLERS[method](cur, *args)
+                    cur.execute("RELEASE item")
+                    ok = True
+                except Exception:
+                    metrics.inc("errors_total", stage="db_write")
+                    logging.info(f"\nWriter exception{f' for job {job}' if job != None else ''} -\n {traceback.format_exc()}")
+                    cur.execute("ROLLBACK TO item")
+                    cur.execute("RELEASE item")
+                    if not uncommitted:
+                        # Don't keep the write lock for a transaction with nothing in it.
+                        con.rollback()
+                    if job != None:
+                        failed.add(job)
+                    ok = False
+                written_at = time.time()
+                if trace_id != None:
+                    tracing.add_span("db_queue", enqueued_at, started_at - enqueued_at, trace_id, method=method)
+                    tracing.add_span("db_write", started_at, written_at - started_at, trace_id, method=method, failed=not ok)
+                if ok:
+                    uncommitted.append((enqueued_at, trace_id, written_at, job))
+                    if batch_started == None:
+                        batch_started = time.time()
+
+        if uncommitted and (len(uncommitted) >= BATCH_SIZE or time.time() - batch_started >= BATCH_SECONDS):
+            commit()
+
+        if time.time() - last_report >= REPORT_SECONDS:
+            log_stats(stats, write_queue)
+            last_report = time.time()
+
+    log_stats(stats, write_queue)
+    con.close()
+
+def log_stats(stats, write_queue):
+    """Logs writes, batches, write latency and queue depth of the writer."""
+    average = stats["latency_total"] / stats["writes"] if stats["writes"] else 0
+    logging.info(f"Writer: {stats['writes']} writes in {stats['batches']} batches, queue depth {write_queue.qsize()}, "
+                 f"latency avg {average * 1000:.0f} ms max {stats['latency_max'] * 1000:.0f} ms.")
@@ -0,0 +1,344 @@
+import os
+import time
+import socket
+import sqlite3
+import logging
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+import multiprocessing.util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+
+# Settings.
+
+# Egresses workers are spread over. Each is a proxy url for chrome's --proxy-server e.g.
+# "http://10.0.0.2:3128" or "socks5://127.0.0.1:1081", or "direct" for no proxy. Network
+# interfaces are used through a local proxy bound to each of them. Leave empty to change the
+# IP with the Proton VPN clicks instead.
+EGRESSES = []
+# True if there are egresses to assign.
+ENABLED = len(EGRESSES) > 0
+# Database shared by the processes of this host with egress scores and assignments.
+POOL_PATH = "egress_pool.db"
+# Weight of the newest observation in the latency and block rate moving averages.
+SMOOTHING = 0.2
+# Seconds a blocked egress is only assigned if every other egress is cooling down too.
+COOLDOWN_SECONDS = 10 * 60
+# Egresses with a higher block rate are only assigned if there is no better one.
+MAX_BLOCK_RATE = 0.5
+# Url fetched through every egress by probe_all.
+PROBE_URL = "https://www.kickstarter.com/robots.txt"
+# Seconds to wait for a probe.
+PROBE_TIMEOUT = 15
+
+# Connection of the current process and the pid it was made in. Shared by the threads of a
+# process under _lock.
+_con = None
+_pid = None
+_lock = threading.RLock()
+# Egress assigned to each owner of the current process.
+_assigned = {}
+
+def get_connection():
+    """Returns this process's connection to the pool database, creating its tables if needed.
+    Must be called with _lock held."""
+    global _con, _pid
+    if _con == None or _pid != os.getpid():
+        _con = sqlite3.connect(POOL_PATH, timeout=60, check_same_thread=False)
+        _pid = os.getpid()
+        _assigned.clear()
+        _con.execute("PRAGMA journal_mode=WAL")
+
+        # One row per egress. latency and block_rate are moving averages over its page loads.
+        _con.execute("""CREATE TABLE IF NOT EXISTS egresses(
+                    address TEXT PRIMARY KEY,
+                    enabled INTEGER NOT NULL DEFAULT 1,
+                    latency REAL,
+                    block_rate REAL NOT NULL DEFAULT 0,
+                    uses INTEGER NOT NULL DEFAULT 0,
+                    blocks INTEGER NOT NULL DEFAULT 0,
+                    cooldown_until REAL NOT NULL DEFAULT 0
+                    )""")
+
+        # Egress currently used by each worker.
+        _con.execute("""CREATE TABLE IF NOT EXISTS assignments(
+                    owner TEXT PRIMARY KEY,
+                    address TEXT,
+                    assigned_at REAL
+                    )""")
+        _con.commit()
+    return _con
+
+def owner_name(slot=None):
+    """
+    Returns the name assignments of the current process are kept under.
+
+    slot [int] - Index of a browser when a process runs several e.g. threads. None by default.
+    """
+    name = f"{socket.gethostname()}-{os.getpid()}"
+    if slot != None:
+        name += f"-{slot}"
+    return name
+
+def reset():
+    """Adds EGRESSES to the pool, disables egresses no longer in it and drops the assignments of
+    this host left over from an earlier run. Called once by the parent process on startup."""
+    with _lock:
+        con = get_connection()
+        con.executemany("INSERT OR IGNORE INTO egresses (address) VALUES (?)", [(address,) for address in EGRESSES])
+        con.execute("UPDATE egresses SET enabled = 0")
+        con.executemany("UPDATE egresses SET enabled = 1 WHERE address = ?", [(address,) for address in EGRESSES])
+        con.execute("DELETE FROM assignments WHERE owner LIKE ?", (socket.gethostname() + "-%",))
+        con.commit()
+        _assigned.clear()
+
+def score(latency, block_rate):
+    """Returns the expected seconds per successful page load of an egress. Lower is better.
+    Egresses never measured score 0 so they are tried first."""
+    return (latency or 0) / max(1 - block_rate, 0.05)
+
+def acquire(owner=None, exclude=None):
+    """
+    Assigns the best egress to owner and returns it. Egresses cooling down after a block, with
+    a block rate above MAX_BLOCK_RATE or used by more workers come last. Returns None if the pool
+    is empty.
+
+    owner [str] - Assignment owner. owner_name() by default.
+    exclude [str] - Egress to avoid e.g. the one being rotated away from. None by default.
+    """
+    if owner == None:
+        owner = owner_name()
+    now = time.time()
+    with _lock:
+        con = get_connection()
+        cur = con.cursor()
+        # Take the write lock first so workers assigned at the same time see each other.
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            rows = cur.execute("""SELECT e.address, e.latency, e.block_rate, e.cooldown_until, COUNT(a.owner)
+                               FROM egresses e LEFT JOIN assignments a ON a.address = e.address AND a.owner != ?
+                               WHERE e.enabled = 1 GROUP BY e.address""", (owner,)).fetchall()
+            if not rows:
+                con.rollback()
+                return
+
+            address = min(rows, key=lambda row: (row[3] > now, row[2] > MAX_BLOCK_RATE, row[0] == exclude,
+                                                 row[4], score(row[1], row[2])))[0]
+            cur.execute("INSERT OR REPLACE INTO assignments VALUES (?, ?, ?)", (owner, address, now))
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+
+        if not _assigned:
+            # Finalizers also run when pool workers exit, unlike atexit handlers.
+            multiprocessing.util.Finalize(None, release_all, exitpriority=0)
+        _assigned[owner] = address
+    return address
+
+def get_egress(owner=None):
+    """
+    Returns the egress assigned to owner, assigning one if it has none. Returns None if the
+    pool is not enabled.
+
+    owner [str] - Assignment owner. owner_name() by default.
+    """
+    if not ENABLED:
+        return
+    if owner == None:
+        owner = owner_name()
+    with _lock:
+        get_connection()
+        address = _assigned.get(owner)
+    if address == None:
+        address = acquire(owner)
+    return address
+
+def record(address, seconds=None, blocked=False):
+    """
+    Adds a page load through address to its moving averages. A block also starts its cooldown.
+
+    address [str] - An egress.
+    seconds [float] - Load time or None if unknown. None by default.
+    blocked [bool] - True if the load hit a captcha or was refused. False by default.
+    """
+    with _lock:
+        con = get_connection()
+        con.execute("""UPDATE egresses SET uses = uses + 1, blocks = blocks + ?,
+                    latency = CASE WHEN ? IS NULL THEN latency WHEN latency IS NULL THEN ? ELSE latency + ? * (? - latency) END,
+                    block_rate = block_rate + ? * (? - block_rate),
+                    cooldown_until = CASE WHEN ? THEN ? ELSE cooldown_until END
+                    WHERE address = ?""",
+                    (int(blocked), seconds, seconds, SMOOTHING, seconds, SMOOTHING, float(blocked),
+                     int(blocked), time.time() + COOLDOWN_SECONDS, address))
+        con.commit()
+
+def report(seconds=None, blocked=False, owner=None):
+    """
+    Records a page load through the egress assigned to owner. Does nothing if it has none.
+
+    seconds [float] - Load time or None if unknown. None by default.
+    blocked [bool] - True if the load hit a captcha or was refused. False by default.
+    owner [str] - Assignment owner. owner_name() by default.
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        get_connection()
+        address = _assigned.get(owner if owner != None else owner_name())
+    if address != None:
+        record(address, seconds, blocked)
+
+def rotate(owner=None, blocked=True):
+    """
+    Moves owner to a different egress and returns it. Only owner changes egress, every other
+    worker keeps its own. The browser of owner has to be relaunched to use it.
+
+    owner [str] - Assignment owner. owner_name() by default.
+    blocked [bool] - True if rotating because of a block, which is recorded on the old egress.
+    True by default.
+    """
+    if not ENABLED:
+        return
+    if owner == None:
+        owner = owner_name()
+    with _lock:
+        get_connection()
+        old = _assigned.get(owner)
+    if old != None and blocked:
+        record(old, blocked=True)
+
+    address = acquire(owner, exclude=old)
+    metrics.inc("egress_rotations_total")
+    logging.info(f"Rotated {owner} from {old} to {address}.")
+    return address
+
+def release(owner=None):
+    """
+    Removes the assignment of owner so its egress counts as free.
+
+    owner [str] - Assignment owner. owner_name() by default.
+    """
+    if owner == None:
+        owner = owner_name()
+    with _lock:
+        con = get_connection()
+        con.execute("DELETE FROM assignments WHERE owner = ?", (owner,))
+        con.commit()
+        _assigned.pop(owner, None)
+
+def release_all():
+    """Removes every assignment of the current process."""
+    if _pid != os.getpid():
+        return
+    for owner in list(_assigned):
+        release(owner)
+
+def proxy_arguments(address):
+    """Returns the chrome arguments which send a browser's traffic through address."""
+    if address in (None, "", "direct"):
+        return []
+    return [f"--proxy-server={address}"]
+
+def probe(address, url=PROBE_URL, timeout=PROBE_TIMEOUT):
+    """
+    Fetches url through address and returns (seconds, blocked). A refused or failed request
+    counts as blocked. Returns None for socks proxies which urllib can't use.
+
+    address [str] - An egress.
+    url [str] - Url to fetch. PROBE_URL by default.
+    timeout [float] - Seconds to wait. PROBE_TIMEOUT by default.
+    """
+    if address.startswith("socks"):
+        return
+    proxies = {} if address == "direct" else {"http": address, "https": address}
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler(proxies))
+
+    start = time.perf_counter()
+    try:
+        with opener.open(url, timeout=timeout) as response:
+            blocked = b"px-captcha" in response.read()
+    except urllib.error.HTTPError as e:
+        blocked = e.code in (403, 407, 429) or b"px-captcha" in e.read()
+    except OSError:
+        return time.perf_counter() - start, True
+    return time.perf_counter() - start, blocked
+
+def probe_all(url=PROBE_URL):
+    """Probes every enabled egress so workers start on measured ones."""
+    with _lock:
+        addresses = [row[0] for row in get_connection().execute("SELECT address FROM egresses WHERE enabled = 1")]
+    for address in addresses:
+        result = probe(address, url)
+        if result != None:
+            record(address, *result)
+            logging.info(f"Egress {address}: {result[0]:.2f}s{', blocked' if result[1] else ''}.")
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers every proxied GET itself after the server's delay, with a captcha page if the
+    server is set to block."""
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        if self.server.blocked:
+            body = b'<div id="px-captcha"></div>'
+            self.send_response(403)
+        else:
+            body = b"ok"
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_stand_in(delay=0, blocked=False):
+    """
+    Starts a local stand-in for a proxy in a background thread and returns (server, address).
+    It only serves plain http urls. Stop it with server.shutdown().
+
+    delay [float] - Seconds every response is delayed. 0 by default.
+    blocked [bool] - True to answer every request with a captcha. False by default.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.delay = delay
+    server.blocked = blocked
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def test_egress_pool():
+    # Testing code. Scores and rotates a pool of local stand-ins in a temporary database.
+    global EGRESSES, ENABLED, POOL_PATH, _con
+    servers = []
+    addresses = []
+    for delay, blocked in [(0, False), (0.3, False), (0, True)]:
+        server, address = serve_stand_in(delay, blocked)
+        servers.append(server)
+        addresses.append(address)
+    fast, slow, blocking = addresses
+
+    with tempfile.TemporaryDirectory() as path:
+        EGRESSES, ENABLED, POOL_PATH = addresses, True, os.path.join(path, "egress_pool.db")
+        reset()
+        probe_all("http://stand-in.test/")
+
+        assert get_egress("worker-1") == fast
+        # The blocking stand-in is cooling down so the second worker gets the slow one.
+        assert get_egress("worker-2") == slow
+        # Rotating one worker leaves the other one where it is.
+        assert rotate("worker-1") == slow
+        assert get_egress("worker-2") == slow
+        release_all()
+        _con.close()
+        _con = None
+
+    for server in servers:
+        server.shutdown()
+    logging.info("Egress pool test passed.")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    test_egress_pool()
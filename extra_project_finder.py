@@ -7,15 +7,26 @@ import logging
 import os
 import winsound
 import threading
+import itertools
 import sqlite3
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
-
-import pyautogui
 from bs4 import BeautifulSoup
 
+import browser_profile
+import profile_pages
+import project_store
+import pending_work
+import bulk_loader
+import metrics
+import egress_pool
+import worker_session
+import sharding
+import profiling
+import tracing
+
 # Location of json with creator ids.
 CREATOR_ID_PATH = r'D:\unscraped_creators_0.json'
 # Location of json with already scraped project links.
@@ -27,90 +38,140 @@ CHROMEDRIVER_PATH = r"C:\Users\jaber\OneDrive\Desktop\Research_JaberChowdhury\Ki
 # Proton vpn windows taskbar location.
 icon_num = 5 
 
-# Number of threads per try.
+# Number of threads, each with its own browser.
 chunk_size = 5
+# Number of creators waiting for a free thread besides the ones being extracted.
+QUEUED_CREATORS = 10
+# Write results once this many creators are done.
+WRITE_BATCH_SIZE = 50
+# Write results at least this often in seconds while there are any.
+WRITE_SECONDS = 30
+# Attempts per creator before it is left for the next run.
+MAX_ATTEMPTS = 3
 # Set logging. 
 logging.getLogger('uc').setLevel(logging.ERROR)
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%m/%d/%Y %I:%M:%S %p')
-# Pyautogui settings.
-pyautogui.PAUSE = 1
-pyautogui.FAILSAFE = True
 
-def main():
-    global results, drivers
+# Owner name of the browser session of each executor thread.
+_thread = threading.local()
+_slots = itertools.count()
 
-    results = []
+def main():
+    metrics.start_exporter()
+    profiling.start()
+    tracing.start()
     click_random(icon_num, False)
-    logging.info("Creating driver instances...")
-    drivers = [uc.Chrome(driver_executable_path=CHROMEDRIVER_PATH, headless=True) for i in range(chunk_size)]
+
+    # Give every driver its own egress if a pool is configured.
+    if egress_pool.ENABLED:
+        egress_pool.reset()
+        egress_pool.probe_all()
 
     # Get connection to database file.
     con = create_project_db(OUTPUT_PATH)
-    cur = con.cursor()
-
-    # Get new creator ids.
-    with open(CREATOR_ID_PATH, "r") as f_obj:
-        new_creator_ids = json.load(f_obj)
 
-    # Get already scraped projects.
-    extracted = set(int(cid[0]) for cid in cur.execute("SELECT creator_id FROM projects;"))
+    # Skip creators with scraped projects and deleted creators.
+    pending_work.load_ids(con, sharding.select(bulk_loader.iter_json_array(CREATOR_ID_PATH)))
+    num_pending = pending_work.compute_pending(con, [("project_store", "creator_id"), ("projects", "creator_id"), ("deleted_creators", "creator_id")])
+    logging.info(f"{num_pending} creators to extract.")
+
+    # Each executor thread keeps its own browser and replaces it when blocked or out of request
+    # budget. New creators are submitted as soon as others finish and results are written in
+    # batches while the threads keep working.
+    executor = ThreadPoolExecutor(max_workers=chunk_size, initializer=init_thread)
+    creator_ids = itertools.chain.from_iterable(pending_work.iter_pending(con, chunk_size))
+    futures = {}
+    retries = deque()
+    attempts = {}
+    results = []
+    last_write = time.time()
+    last_switch = 0
+    while True:
+        # Failed creators are submitted again before new ones.
+        while len(futures) < chunk_size + QUEUED_CREATORS:
+            if retries:
+                creator_id = retries.popleft()
+            else:
+                creator_id = next(creator_ids, None)
+                if creator_id == None:
+                    break
+            futures[executor.submit(extract_creator_data, creator_id)] = creator_id
 
-    # Get deleted creators.
-    deleted = set(int(cid[0]) for cid in cur.execute("SELECT creator_id FROM deleted_creators;"))
-    
-    skip = extracted | deleted
-    creator_ids = [creator_id for creator_id in new_creator_ids if creator_id not in skip]
+        if not futures:
+            break
 
-    total = 0
-    for i in range(0, len(creator_ids), chunk_size):
-        # Retry after changing server in case of errors.
-        while True:
-            results.clear()
-            threads = []
+        done, not_done = wait(futures, timeout=WRITE_SECONDS, return_when=FIRST_COMPLETED)
+        for future in done:
+            creator_id = futures.pop(future)
             try:
-                for j, creator_id in enumerate(creator_ids[i:i + chunk_size]):
-                    thread = threading.Thread(target=extract_creator_data, args=(creator_id, j))
-                    thread.start()
-                    threads.append(thread)
-                for thread in threads:
-                    thread.join()
+                results.append(future.result())
             except Exception:
-                logging.info(f"\nException -\n {traceback.format_exc()} \nRetrying...")
-                winsound.Beep(440, 1000)
-                click_random(icon_num)
-            else:
-                break
+                metrics.inc("errors_total", script="extra_project")
+                attempts[creator_id] = attempts.get(creator_id, 0) + 1
+                if attempts[creator_id] < MAX_ATTEMPTS:
+                    logging.info(f"\nException for {creator_id} -\n {traceback.format_exc()} \nRetrying...")
+                    retries.append(creator_id)
+                else:
+                    logging.info(f"\nException for {creator_id} -\n {traceback.format_exc()} \nLeaving it for the next run.")
+
+                # Without an egress pool a new IP needs the VPN switch, which is done at most once a minute.
+                if not egress_pool.ENABLED and time.time() - last_switch > 60:
+                    winsound.Beep(440, 1000)
+                    click_random(icon_num, False)
+                    last_switch = time.time()
+
+        if len(results) >= WRITE_BATCH_SIZE or (results and time.time() - last_write >= WRITE_SECONDS):
+            num_pending -= write_results(con, results)
+            metrics.set_gauge("queue_depth", max(num_pending, 0), queue="creators")
+            results.clear()
+            last_write = time.time()
 
-        # Write results
+    write_results(con, results)
+    executor.shutdown()
+    worker_session.close_all()
+    con.close()
+    metrics.stop_exporter()
+    profiling.report()
+
+def write_results(con, results):
+    """
+    Writes the created projects of creators, or marks them deleted if they have none, in one
+    transaction and returns how many creators were written.
+
+    con [sqlite3.Connection] - Connection to projects.db.
+    results [list] - (creator_id, created projects) tuples returned by extract_creator_data.
+    """
+    cur = con.cursor()
+    with metrics.timer(stage="db_write"):
         for creator_id, created_projects in results:
             if created_projects:
-                cur.executemany("INSERT OR IGNORE INTO projects VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [tuple(project.values()) for project in created_projects])
+                cur.executemany(project_store.UPSERT_SQL, [project_store.project_params(project) for project in created_projects])
+                cur.executemany(project_store.LINK_SQL, project_store.link_params(creator_id, "created", created_projects))
             else:
                 cur.execute("INSERT OR IGNORE INTO deleted_creators VALUES (?)", (creator_id,))
-        con.commit()                
+        con.commit()
+    metrics.inc("items_total", len(results), script="extra_project")
+    return len(results)
 
-        # Change server after scraping a certain amount to not be blocked by kickstarter. Also refresh drivers
-        # to obfuscate bot detection.
-        total += chunk_size
-        if total % (chunk_size * 4) == 0:
-            logging.info("Changing server...\n")
-            click_random(icon_num, False)
+def init_thread():
+    """Executor initializer which gives the thread its own egress_pool owner name."""
+    _thread.owner = egress_pool.owner_name(next(_slots))
 
-            for driver in drivers:
-                driver.quit()
-            
-            drivers = [uc.Chrome(driver_executable_path=CHROMEDRIVER_PATH, headless=True) for i in range(chunk_size)]
+def get_thread_session():
+    """Returns the browser session of the calling thread, launching it if needed."""
+    return worker_session.get_session(launch_driver, getattr(_thread, "owner", None))
 
 def create_project_db(path):
     """
-    Creates projects.db in path and returns a connection.
+    Creates projects.db in path and returns a connection. Every shard has its own e.g.
+    projects_shard2of4.db.
     
     path[str] - Location to save/load 'projects.db'
     """
-    con = sqlite3.connect(os.path.join(path, "projects.db"))
+    con = sqlite3.connect(os.path.join(path, sharding.shard_path("projects.db")))
     cur = con.cursor()
 
-    # Table for project data.
+    # Table for project data written before project_store was used. Only read to skip creators.
     cur.execute("""CREATE TABLE IF NOT EXISTS projects(
                 name TEXT,
                 url TEXT UNIQUE,
@@ -131,6 +192,10 @@ def create_project_db(path):
                 launched_date TEXT,
                 deadline_date TEXT
                     )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS projects_creator_id ON projects(creator_id)")
+
+    # Tables for project data.
+    project_store.create_project_store(con)
     
     # Table for deleted creators.
     cur.execute("""CREATE TABLE IF NOT EXISTS deleted_creators(
@@ -138,18 +203,13 @@ def create_project_db(path):
     )
         """)
 
-    # Table for previously extracted project urls.
+    # Table for previously extracted project urls. The unique index on url is made by bulk_loader.
     cur.execute("""CREATE TABLE IF NOT EXISTS previous_projects(
-                url TEXT UNIQUE
+                url TEXT
                 )""")
-    
-    with open(EXISTING_LINKS_PATH) as f_obj:
-        new_creator_ids = json.load(f_obj)
-
-    for creator_id in new_creator_ids:
-        cur.execute("INSERT OR IGNORE INTO previous_projects VALUES (?)", (creator_id,))
-
     con.commit()
+
+    bulk_loader.load_json_column(con, EXISTING_LINKS_PATH, "previous_projects", "url")
     return con
 
 def click_random(icon_num, wait=True):
@@ -161,6 +221,13 @@ def click_random(icon_num, wait=True):
     wait [bool] - If True, function will sleep for 10s to make sure Proton Vpn
     connects and otherwise it will not sleep. True by default.
     """
+    # Drivers rotate their own egress if there is a pool.
+    if egress_pool.ENABLED:
+        return
+    import pyautogui
+
+    pyautogui.PAUSE = 1
+    pyautogui.FAILSAFE = True
     pyautogui.hotkey('win', str(icon_num))
     pyautogui.click(333, 563, clicks=3, interval=0.15)
     time.sleep(2)
@@ -168,6 +235,14 @@ def click_random(icon_num, wait=True):
     if wait:
         time.sleep(10)
 
+def launch_driver(egress=None):
+    """
+    Returns a new headless webdriver for a session.
+
+    egress [str] - Egress from egress_pool or None. None by default.
+    """
+    return browser_profile.new_driver(CHROMEDRIVER_PATH, headless=True, egress=egress)
+
 def get_digits(string, conv="float"):
     """
     Returns only digits from string as a single int/float. Default
@@ -188,7 +263,8 @@ def get_digits(string, conv="float"):
             return ""
         return int("".join(res))
     
-def get_live_soup(link, scroll=False, given_driver=None):
+@tracing.traced
+def get_live_soup(link, scroll=False, given_driver=None, owner=None):
     """
     Returns a bs4 soup object of the given link. Returns None if it is a deleted kickstarter account.
     
@@ -196,28 +272,40 @@ def get_live_soup(link, scroll=False, given_driver=None):
     scroll [bool] - True if you want selenium to keep scrolling down till loading no longer happens.
     False by default.
     given_driver [selenium webdriver] - A webdriver. None by default.
+    owner [str] - Owner of the worker_session given_driver belongs to. None by default.
     """
+    from selenium.webdriver.common.by import By
+
     if given_driver == None:
-        driver = uc.Chrome(executable_path=CHROMEDRIVER_PATH, headless=True)
+        driver = browser_profile.new_driver(CHROMEDRIVER_PATH, headless=True, egress=egress_pool.get_egress(owner))
     else:
         driver = given_driver
-    driver.get(link)
+    browser_profile.prepare_page(driver)
+    fetch_started = time.perf_counter()
+    with metrics.timer(stage="fetch"):
+        driver.get(link)
+    fetch_seconds = time.perf_counter() - fetch_started
+    metrics.inc("pages_total", page="profile")
 
     soup = BeautifulSoup(driver.page_source, "lxml")
 
     # If there is a capcha, raise an exception.
     capcha_elem = soup.select_one('div[id="px-captcha"]')
+    worker_session.record_page(fetch_seconds, capcha_elem != None, owner)
     if capcha_elem != None:
-        raise Exception("Captcha encountered.")
+        metrics.inc("captchas_total")
+        raise worker_session.BlockedError("Captcha encountered.")
     
     # If it is a deleted account or there is a 404 error, return.
     deleted_elem = soup.select_one('div[class="center"]')
     non_existent_elem = soup.select_one('a[href="/?ref=404-ksr10"]')
     if deleted_elem != None or non_existent_elem != None:
+        metrics.inc("deleted_pages_total")
         if given_driver == None:
             driver.quit()
         return
     
+    wait_started = time.perf_counter()
     if scroll:
         scroll_num = 1
         while True:
@@ -244,7 +332,11 @@ def get_live_soup(link, scroll=False, given_driver=None):
             else:
                 break
 
-    soup = BeautifulSoup(driver.page_source, "lxml")
+    metrics.observe("stage_seconds", time.perf_counter() - wait_started, stage="wait")
+
+    browser_profile.log_bandwidth(link, browser_profile.get_network_events(driver))
+    with metrics.timer(stage="parse"):
+        soup = BeautifulSoup(driver.page_source, "lxml")
 
     if given_driver == None:
         driver.quit()
@@ -275,6 +367,7 @@ def parse_data_project(data_project):
     """
     result = {}
 
+    result['id'] = data_project['id']
     result['name'] = data_project['name']
     url = data_project['urls']['web']['project']
 
@@ -307,60 +400,43 @@ def parse_data_project(data_project):
 
     return result
 
-def extract_creator_data(creator_id, index=None):
+@profiling.profiled
+@tracing.traced_item
+def extract_creator_data(creator_id):
     """
-    Returns a dictionary of the data for the creator. Returns None in case of a deleted account.
-    Can load a webdriver from the given index from the global list drivers (optional).
+    Returns (creator_id, created projects) for the creator. The list is empty in case of a
+    deleted account. Uses the browser session of the calling thread.
     
     creator_id [str/int] - A kickstarter creator id.
-    index [int] - Index of webdriver in drivers for this function call.
     """
     logging.info(f"Started extracting {creator_id} data...")
     path = r"https://www.kickstarter.com/profile/" + str(creator_id)
+    session = get_thread_session()
+    driver = session.get_driver()
 
-    if index == None:
-        driver = uc.Chrome(executable_path=CHROMEDRIVER_PATH, headless=True)
-    else:
-        driver = drivers[index]
     # Extract data from available pages. There may be multiple pages for created projects.
-
     try:
-        created_soup = get_live_soup(path + "/created", given_driver=driver)
-    except Exception as e:
-        if index == None:
-            driver.quit()
-        raise e
-
-    if created_soup == None:
-        return (creator_id, [])
-    
-    created_soups = [created_soup]
-    while True:
-        next_elem = created_soup.select_one('a[rel="next"]')
-
-        # No further pages.
-        if next_elem == None:
-            break   
-        
-        created_soup = get_live_soup("https://www.kickstarter.com/" + next_elem['href'], given_driver=driver)
-        created_soups.append(created_soup)
-
-    if index == None:
-        driver.quit()          
-
-    # Created projects.
-    created_data_projects = []
-    for created_soup in created_soups:
-        created_project_elem = created_soup.select_one('div[data-projects]')
-        created_data_projects.extend(json.loads(created_project_elem['data-projects']))
-
-    created_projects = []
-    for created_data_project in created_data_projects:
-        parsed = parse_data_project(created_data_project)
-        if parsed != None:
-            created_projects.append(parsed)
-
-    results.append((creator_id, created_projects))
+        created_soup = get_live_soup(path + "/created", given_driver=driver, owner=session.owner)
+        if created_soup == None:
+            return (creator_id, [])
+
+        # Created projects. Remaining pages are fetched concurrently and parsed as they arrive.
+        created_projects = []
+        for created_data_project in profile_pages.iter_created_data_projects(driver, path + "/created", created_soup):
+            parsed = parse_data_project(created_data_project)
+            if parsed != None:
+                created_projects.append(parsed)
+    except worker_session.BlockedError:
+        # Only this thread's browser moves to another egress before the creator is retried.
+        session.rotate(blocked=True)
+        raise
+    except Exception:
+        # Only this thread's browser is replaced before the creator is retried.
+        session.rotate(blocked=False)
+        raise
+
+    return (creator_id, created_projects)
 
 if __name__ == "__main__":
+    sharding.from_args()
     main()
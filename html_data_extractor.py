@@ -9,14 +9,12 @@ import time
 import shutil
 import json
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-
 from bs4 import BeautifulSoup
-import pandas as pd
-from tqdm import tqdm
+
+import metrics
+import profiling
+import tracing
+import sharding
 
 # Settings.
 
@@ -38,20 +36,27 @@ logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=lo
 # Script.
 
 def main():
+    # Only the parent process needs these so workers don't import them.
+    import pandas as pd
+    from tqdm import tqdm
+
     campaign_data = []
     update_data = {}
     zip_files = []
+    metrics.start_exporter()
+    profiling.start()
+    tracing.start()
     pool = multiprocessing.Pool()
 
     if UNZIP:
         # Find all zip files in DATA_PATH.
         for file in os.listdir(DATA_PATH):
-            if file.endswith(".zip"):
+            if file.endswith(".zip") and sharding.in_shard(file):
                 zip_files.append(os.path.join(DATA_PATH, file))
 
         # Folder which will contain unzipped data. Script will create it if
-        # it doesn't exist.
-        to_path = os.path.join(DATA_PATH, "Unzipped")
+        # it doesn't exist. Every shard unzips into its own.
+        to_path = sharding.shard_path(os.path.join(DATA_PATH, "Unzipped"))
 
         # Unzip one zip at a time, extract data from files and then delete
         # the unzipped data.
@@ -84,6 +89,9 @@ def main():
 
     else:
         campaign_files, update_files = classifier(DATA_PATH)
+        # Shard by campaign folder so the campaign and update files of a project stay together.
+        campaign_files = list(sharding.select(campaign_files, lambda file_path: os.path.basename(os.path.dirname(file_path))))
+        update_files = list(sharding.select(update_files, lambda file_path: os.path.basename(os.path.dirname(file_path))))
         # campaign_files = campaign_files[:10000]
         # Process update files.
         logging.info("Processing update files...")
@@ -137,7 +145,7 @@ def main():
     os.makedirs(output_folder, exist_ok=True)
     
     # Generate time string for output files for current zips.
-    time_str = datetime.now().strftime('%Y%m%d-%H%M%S')
+    time_str = datetime.now().strftime('%Y%m%d-%H%M%S') + sharding.suffix()
 
     with open(os.path.join(output_folder, f"zips_{time_str}.txt"), "w") as f_obj:
         f_obj.writelines([zip_file + "\n" for zip_file in zip_files])
@@ -148,6 +156,8 @@ def main():
 
     missing_df = pd.DataFrame(missing_data)
     missing_df.to_csv(os.path.join(output_folder, f'missing_{time_str}.csv'), index=False)
+    metrics.stop_exporter()
+    profiling.report()
 
 def test_extract_campaign_data():
     # Testing code.
@@ -159,6 +169,8 @@ def test_extract_campaign_data():
                 (r"F:/Kickstarter Zips/Unzipped/10-years-of-work-in-a-deluxe-artbook-paintings-and/10-years-of-work-in-a-deluxe-artbook-paintings-and_20181106-213950.html",), # Missing data
                 (r"F:/Kickstarter Zips/Unzipped/fixed-animal-collage/fixed-animal-collage_20181124-085618.html",), # Empty creator in data-initial
                 ]
+    import pandas as pd
+
     data = [extract_campaign_data(*file_path) for file_path in file_paths]
     df = pd.DataFrame(data)
     df.to_csv('test.csv', index = False)
@@ -180,6 +192,8 @@ def nested_unzipper(file_path, to_path):
         zip_ref.extractall(to_path)
 
     # Unzip any files inside unzipped zip.
+    from tqdm import tqdm
+
     logging.info(f"Unzipping nested zips inside \"{base}\"...")
     to_path_zips = []
     for (root, dirs, files) in os.walk(to_path):
@@ -347,6 +361,7 @@ def get_category_data(cat_str):
     
     return (category, subcategory)
 
+@profiling.profiled
 def extract_update_files_data(files):
     """"Takes a list of update files of the same root and returns a tuple of url and startdate."""
     url = MISSING
@@ -373,6 +388,11 @@ def extract_update_files_data(files):
     # if not offline.
     else:
         if not OFFLINE:
+            from selenium import webdriver
+            from selenium.webdriver.common.by import By
+            from selenium.webdriver.support.wait import WebDriverWait
+            from selenium.webdriver.support import expected_conditions as EC
+
             update_url = url + "/posts"
             driver = webdriver.Chrome()
             driver.get(update_url)
@@ -389,10 +409,13 @@ def extract_update_files_data(files):
 
     return (url, date)
 
+@tracing.traced
 def get_live_soup(link):
     """Returns a bs4 soup object of the given link.
     
     link [str] - A link to a website."""
+    from selenium import webdriver
+
     driver = webdriver.Chrome()
     driver.get(link)
     time.sleep(1)
@@ -401,6 +424,8 @@ def get_live_soup(link):
 
     return soup
 
+@profiling.profiled
+@tracing.traced_item
 def extract_campaign_data(path, is_link=False):
     """Extracts data from a kickstarter campaign page and returns
     it in a dictionary. 
@@ -409,8 +434,9 @@ def extract_campaign_data(path, is_link=False):
     path [str] - Path to html file.
     is_link [boolean] - True if path is a link and False otherwise. False by default."""
     if not is_link:
-        with open(path, encoding='utf8', errors="backslashreplace") as infile:
+        with metrics.timer(stage="parse"), open(path, encoding='utf8', errors="backslashreplace") as infile:
             soup = BeautifulSoup(infile, "lxml")
+        metrics.inc("pages_total", page="file")
     else:
         if OFFLINE:
             data = {"url": path}
@@ -789,6 +815,7 @@ def extract_campaign_data(path, is_link=False):
     return data
 
 if __name__ == "__main__":
+    sharding.from_args()
     if not TESTING:
         main()
     else:
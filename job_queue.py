@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import socket
+
+# Settings.
+
+# Seconds a claimed job stays leased before another worker may claim it again.
+LEASE_SECONDS = 15 * 60
+# Name this host uses for its leases. Restarting on the same host takes its leases back.
+WORKER_NAME = socket.gethostname()
+# Number of rows inserted per statement batch when loading jobs.
+LOAD_BATCH_SIZE = 10000
+# Attempts after which a job failing with transient errors is moved to dead_letter.
+MAX_ATTEMPTS = 5
+# Seconds a job waits before its first retry. Doubles with every further attempt.
+BACKOFF_SECONDS = 60
+# Maximum seconds a job waits before a retry.
+MAX_BACKOFF_SECONDS = 60 * 60
+# Exception types besides PermanentError which are moved to dead_letter without retrying.
+# Other errors, including lookup and conversion errors from a half rendered page, are retried
+# until MAX_ATTEMPTS.
+PERMANENT_ERRORS = ()
+
+# Job outcomes. The first three finish a job, transient errors are retried with backoff and
+# permanent errors are moved to dead_letter.
+SUCCESS = "success"
+DELETED = "deleted"
+HIDDEN = "hidden"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+class PermanentError(Exception):
+    """Raised by code which knows a job will fail the same way on every attempt e.g. a replayed
+    page that was never archived."""
+
+def create_jobs_table(con):
+    """
+    Creates the jobs tables in the database of con if they don't exist.
+
+    con [sqlite3.Connection] - A database connection.
+    """
+    cur = con.cursor()
+
+    # Table for work items. status is one of pending, leased, done or dead. outcome is the result
+    # of the last attempt and pending jobs are not claimed before next_attempt_at.
+    cur.execute("""CREATE TABLE IF NOT EXISTS jobs(
+                key TEXT PRIMARY KEY,
+                payload TEXT,
+                position INTEGER,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                last_error TEXT,
+                updated_at REAL,
+                outcome TEXT,
+                next_attempt_at REAL
+                )""")
+    # Add the columns jobs tables made before retries were tracked are missing.
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(jobs)")}
+    for column, column_type in (("outcome", "TEXT"), ("next_attempt_at", "REAL")):
+        if column not in columns:
+            cur.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+    cur.execute("CREATE INDEX IF NOT EXISTS jobs_status_position ON jobs(status, position)")
+
+    # Table for jobs which failed permanently or ran out of attempts.
+    cur.execute("""CREATE TABLE IF NOT EXISTS dead_letter(
+                key TEXT PRIMARY KEY,
+                payload TEXT,
+                outcome TEXT,
+                attempts INTEGER,
+                last_error TEXT,
+                dead_at REAL
+                )""")
+
+    # Table for input files already loaded into jobs.
+    cur.execute("""CREATE TABLE IF NOT EXISTS job_sources(
+                path TEXT PRIMARY KEY,
+                fingerprint TEXT,
+                loaded_at REAL
+                )""")
+    con.commit()
+
+def file_fingerprint(path):
+    """
+    Returns a string which changes whenever the file at path is modified.
+
+    path [str] - Path to a file.
+    """
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+def is_loaded(con, path):
+    """
+    Returns True if the file at path was already loaded into jobs and has not changed since.
+
+    con [sqlite3.Connection] - A database connection.
+    path [str] - Path to the input file.
+    """
+    row = con.execute("SELECT fingerprint FROM job_sources WHERE path = ?", (path,)).fetchone()
+    return row != None and row[0] == file_fingerprint(path)
+
+def load_jobs(con, path, items, key):
+    """
+    Adds every item as a pending job keyed by item[key] in one transaction and records path as
+    loaded. Items which already have a job are left as they are.
+
+    con [sqlite3.Connection] - A database connection.
+    path [str] - Path to the input file the items come from.
+    items [iterable] - Dicts to add e.g. a csv.DictReader.
+    key [str] - Key of the item to use as the job key.
+    """
+    now = time.time()
+    cur = con.cursor()
+    cur.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM jobs")
+    start = cur.fetchone()[0]
+
+    batch = []
+    for position, item in enumerate(items, start):
+        batch.append((item[key], json.dumps(item), position, now))
+        if len(batch) == LOAD_BATCH_SIZE:
+            cur.executemany("INSERT OR IGNORE INTO jobs (key, payload, position, updated_at) VALUES (?, ?, ?, ?)", batch)
+            batch.clear()
+    cur.executemany("INSERT OR IGNORE INTO jobs (key, payload, position, updated_at) VALUES (?, ?, ?, ?)", batch)
+
+    cur.execute("INSERT OR REPLACE INTO job_sources VALUES (?, ?, ?)", (path, file_fingerprint(path), now))
+    con.commit()
+
+def mark_done(con, select_keys_sql):
+    """
+    Marks jobs whose keys are returned by select_keys_sql as done. Used to skip items that were
+    finished before the jobs table existed.
+
+    con [sqlite3.Connection] - A database connection.
+    select_keys_sql [str] - A SELECT statement returning one column of keys.
+    """
+    con.execute(f"UPDATE jobs SET status = 'done', updated_at = ? WHERE status != 'done' AND key IN ({select_keys_sql})", (time.time(),))
+    con.commit()
+
+def requeue_jobs(con, select_keys_sql, params=(), payload_key=None):
+    """
+    Makes done jobs whose keys are returned by select_keys_sql pending again and returns how
+    many were requeued. Used to revisit items.
+
+    con [sqlite3.Connection] - A database connection.
+    select_keys_sql [str] - A SELECT statement returning one column of keys.
+    params [tuple] - Parameters of select_keys_sql. Empty by default.
+    payload_key [str] - If given, keys without a job are added as pending jobs with the payload
+    {payload_key: key} e.g. items first seen under another key. None by default.
+    """
+    now = time.time()
+    cur = con.execute(f"""UPDATE jobs SET status = 'pending', attempts = 0, last_error = NULL, next_attempt_at = NULL, updated_at = ?
+                      WHERE status = 'done' AND key IN ({select_keys_sql})""", (now, *params))
+    requeued = cur.rowcount
+    if payload_key != None:
+        changes = con.total_changes
+        con.execute(f"""WITH due(key) AS ({select_keys_sql})
+                    INSERT OR IGNORE INTO jobs (key, payload, position, updated_at)
+                    SELECT key, json_object(?, key), (SELECT COALESCE(MAX(position), -1) FROM jobs) + ROW_NUMBER() OVER (), ?
+                    FROM due WHERE key NOT IN (SELECT key FROM jobs)""", (*params, payload_key, now))
+        # rowcount isn't set for statements starting with WITH.
+        requeued += con.total_changes - changes
+    con.commit()
+    return requeued
+
+def release_leases(con, owner=WORKER_NAME):
+    """
+    Makes jobs leased by owner pending again. Called on startup to resume after a crash.
+
+    con [sqlite3.Connection] - A database connection.
+    owner [str] - Lease owner. WORKER_NAME by default.
+    """
+    con.execute("UPDATE jobs SET status = 'pending', lease_owner = NULL, lease_expires = NULL WHERE status = 'leased' AND lease_owner = ?", (owner,))
+    con.commit()
+
+def claim_jobs(con, n, owner=WORKER_NAME, lease_seconds=LEASE_SECONDS):
+    """
+    Atomically leases at most n jobs to owner and returns a list of (key, payload) tuples with
+    the payload decoded. Jobs with expired leases are claimed before pending jobs. Pending jobs
+    waiting for a retry are skipped until their next_attempt_at.
+
+    con [sqlite3.Connection] - A database connection.
+    n [int] - Maximum number of jobs to claim.
+    owner [str] - Lease owner. WORKER_NAME by default.
+    lease_seconds [int] - Length of the lease. LEASE_SECONDS by default.
+    """
+    now = time.time()
+    cur = con.cursor()
+    # Take the write lock first so no other process can claim the same jobs.
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        rows = cur.execute("SELECT key, payload FROM jobs WHERE status = 'leased' AND lease_expires < ? LIMIT ?", (now, n)).fetchall()
+        if len(rows) < n:
+            rows += cur.execute("""SELECT key, payload FROM jobs WHERE status = 'pending' AND (next_attempt_at IS NULL OR next_attempt_at <= ?)
+                                ORDER BY position LIMIT ?""", (now, n - len(rows))).fetchall()
+
+        cur.executemany("""UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1,
+                        updated_at = ? WHERE key = ?""", [(owner, now + lease_seconds, now, key) for key, payload in rows])
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+
+    return [(key, json.loads(payload)) for key, payload in rows]
+
+def complete_job(con, key, outcome=SUCCESS):
+    """
+    Marks a job as done.
+
+    con [sqlite3.Connection] - A database connection.
+    key [str] - Job key.
+    outcome [str] - SUCCESS, DELETED or HIDDEN. SUCCESS by default.
+    """
+    con.execute("""UPDATE jobs SET status = 'done', outcome = ?, lease_owner = NULL, lease_expires = NULL, last_error = NULL,
+                next_attempt_at = NULL, updated_at = ? WHERE key = ?""", (outcome, time.time(), key))
+    con.commit()
+
+def backoff_seconds(attempts):
+    """Returns the seconds to wait before retrying a job which has been attempted attempts times."""
+    return min(BACKOFF_SECONDS * 2 ** max(attempts - 1, 0), MAX_BACKOFF_SECONDS)
+
+def fail_job(con, key, error, permanent=False):
+    """
+    Makes a job pending again after its backoff and records its error. The job is moved to
+    dead_letter instead if the error is permanent or it has been attempted MAX_ATTEMPTS times.
+    Returns True if the job will be retried.
+
+    con [sqlite3.Connection] - A database connection.
+    key [str] - Job key.
+    error [str] - Error message or traceback.
+    permanent [bool] - True if retrying can't help. False by default.
+    """
+    now = time.time()
+    row = con.execute("SELECT attempts FROM jobs WHERE key = ?", (key,)).fetchone()
+    attempts = row[0] if row != None else 0
+
+    if permanent or attempts >= MAX_ATTEMPTS:
+        outcome = PERMANENT if permanent else TRANSIENT
+        con.execute("INSERT OR REPLACE INTO dead_letter SELECT key, payload, ?, attempts, ?, ? FROM jobs WHERE key = ?", (outcome, error, now, key))
+        con.execute("""UPDATE jobs SET status = 'dead', outcome = ?, lease_owner = NULL, lease_expires = NULL, last_error = ?,
+                    next_attempt_at = NULL, updated_at = ? WHERE key = ?""", (outcome, error, now, key))
+        con.commit()
+        return False
+
+    con.execute("""UPDATE jobs SET status = 'pending', outcome = ?, lease_owner = NULL, lease_expires = NULL, last_error = ?,
+                next_attempt_at = ?, updated_at = ? WHERE key = ?""", (TRANSIENT, error, now + backoff_seconds(attempts), now, key))
+    con.commit()
+    return True
+
+def error_outcome(error):
+    """Returns PERMANENT if the exception error can't be fixed by retrying and TRANSIENT otherwise."""
+    return PERMANENT if isinstance(error, (PermanentError, *PERMANENT_ERRORS)) else TRANSIENT
+
+def finish_job(con, key, outcome, error=None):
+    """
+    Records the outcome of an attempt at a job. Returns True if the job will be retried.
+
+    con [sqlite3.Connection] - A database connection.
+    key [str] - Job key.
+    outcome [str] - One of the job outcomes e.g. SUCCESS or TRANSIENT.
+    error [str] - Error message or traceback for TRANSIENT and PERMANENT. None by default.
+    """
+    if outcome in (TRANSIENT, PERMANENT):
+        return fail_job(con, key, error, outcome == PERMANENT)
+    complete_job(con, key, outcome)
+    return False
+
+def seconds_until_retry(con):
+    """Returns the seconds until the next pending job can be claimed, 0 if one can be claimed
+    now or None if there are no pending jobs."""
+    row = con.execute("SELECT COUNT(*), MIN(COALESCE(next_attempt_at, 0)) FROM jobs WHERE status = 'pending'").fetchone()
+    if row[0] == 0:
+        return
+    return max(row[1] - time.time(), 0)
+
+def requeue_dead_letters(con):
+    """
+    Makes every job in dead_letter pending again with its attempts reset e.g. after fixing
+    the cause of its error. Returns how many jobs were requeued.
+
+    con [sqlite3.Connection] - A database connection.
+    """
+    cur = con.execute("""UPDATE jobs SET status = 'pending', attempts = 0, outcome = NULL, next_attempt_at = NULL, updated_at = ?
+                      WHERE status = 'dead' AND key IN (SELECT key FROM dead_letter)""", (time.time(),))
+    con.execute("DELETE FROM dead_letter")
+    con.commit()
+    return cur.rowcount
@@ -0,0 +1,218 @@
+import os
+import sys
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+import weakref
+import threading
+import subprocess
+
+# Settings.
+
+# Set to False to let undetected_chromedriver patch chromedriver and create a new profile on
+# every launch.
+ENABLED = True
+# Folder for patched chromedrivers, profile templates and their clones.
+CACHE_PATH = os.path.join(tempfile.gettempdir(), "kickstarter_launch_cache")
+# Profile folders left out of templates. They are rebuilt by chrome and only slow down cloning.
+SKIPPED_FOLDERS = {"Cache", "Code Cache", "GPUCache", "ShaderCache", "GrShaderCache", "GraphiteDawnCache",
+                   "DawnCache", "Crashpad", "component_crx_cache", "Service Worker"}
+# Files left out of templates because they belong to the browser that built them.
+SKIPPED_FILES = {"SingletonLock", "SingletonCookie", "SingletonSocket", "lockfile", "LOCK"}
+# Seconds after which clones left behind by crashed runs are deleted.
+CLONE_MAX_AGE = 24 * 60 * 60
+
+# Patched chromedriver path for each (path, size, mtime) of the original and the version of
+# each patched chromedriver in this process.
+_drivers = {}
+_versions = {}
+_lock = threading.Lock()
+_cleaned = False
+
+def get_version(chromedriver_path):
+    """Returns the version of the chromedriver at chromedriver_path e.g. 120.0.6099.109."""
+    output = subprocess.run([chromedriver_path, "--version"], capture_output=True, text=True, timeout=30).stdout
+    return output.split()[1]
+
+def patched_driver_path(chromedriver_path):
+    """
+    Returns the path of a copy of chromedriver_path patched by undetected_chromedriver. The
+    copy is patched once per chromedriver version and reused by every later launch, so
+    undetected_chromedriver only checks it instead of patching it again.
+
+    chromedriver_path [str] - Path to an unpatched chromedriver.
+    """
+    import undetected_chromedriver as uc
+
+    stat = os.stat(chromedriver_path)
+    key = (chromedriver_path, stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        if key in _drivers:
+            return _drivers[key]
+
+        version = get_version(chromedriver_path)
+        path = os.path.join(CACHE_PATH, "drivers", version, os.path.basename(chromedriver_path))
+        if not os.path.exists(path):
+            # Patch a temporary copy so processes starting at the same time never use a half
+            # patched binary.
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            shutil.copy2(chromedriver_path, temp_path)
+            uc.Patcher(executable_path=temp_path).auto()
+            try:
+                os.replace(temp_path, path)
+            except OSError:
+                # Another process finished first and its copy is in use.
+                os.remove(temp_path)
+            logging.info(f"Patched chromedriver {version} into the launch cache.")
+
+        _drivers[key] = path
+        _versions[path] = version
+    return path
+
+def ignore_skipped(folder, names):
+    """shutil.copytree ignore function which leaves out SKIPPED_FOLDERS and SKIPPED_FILES."""
+    return [name for name in names if name in SKIPPED_FOLDERS or name in SKIPPED_FILES]
+
+def clone_tree(source, destination):
+    """
+    Copies the folder source to destination. Uses copy on write clones where the file system
+    supports them.
+
+    source [str] - Folder to copy.
+    destination [str] - Folder to create.
+    """
+    if sys.platform.startswith("linux") and shutil.which("cp") != None:
+        result = subprocess.run(["cp", "-a", "--reflink=auto", source, destination], capture_output=True)
+        if result.returncode == 0:
+            return
+        shutil.rmtree(destination, ignore_errors=True)
+    elif sys.platform == "darwin":
+        result = subprocess.run(["cp", "-c", "-R", source, destination], capture_output=True)
+        if result.returncode == 0:
+            return
+        shutil.rmtree(destination, ignore_errors=True)
+    shutil.copytree(source, destination)
+
+def get_template(name, version, build):
+    """
+    Returns the path of the profile template name for a chromedriver version, building it with
+    build if it doesn't exist.
+
+    name [str] - Template name e.g. headless.
+    version [str] - Chromedriver version. Templates are rebuilt when chrome changes.
+    build [function] - Takes a folder and launches and quits a browser using it as its profile.
+    """
+    path = os.path.join(CACHE_PATH, "templates", version, name)
+    if os.path.exists(path):
+        return path
+
+    start = time.perf_counter()
+    build_path = os.path.join(CACHE_PATH, "templates", version, f"{name}.{os.getpid()}.build")
+    shutil.rmtree(build_path, ignore_errors=True)
+    build(build_path)
+
+    # Copy without caches and locks so clones start small and unlocked.
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    shutil.copytree(build_path, temp_path, ignore=ignore_skipped)
+    shutil.rmtree(build_path, ignore_errors=True)
+    try:
+        os.replace(temp_path, path)
+    except OSError:
+        # Another process built it first.
+        shutil.rmtree(temp_path, ignore_errors=True)
+    logging.info(f"Built profile template {name} for chrome {version} in {time.perf_counter() - start:.1f}s.")
+    return path
+
+def clone_profile(chromedriver_path, name, build):
+    """
+    Returns a new profile folder cloned from the template name. The clone should be passed to
+    track together with the browser using it so it is deleted afterwards.
+
+    chromedriver_path [str] - Path to the chromedriver the profile is used with.
+    name [str] - Template name e.g. headless.
+    build [function] - Takes a folder and launches and quits a browser using it as its profile.
+    """
+    global _cleaned
+    if not _cleaned:
+        clean_clones()
+        _cleaned = True
+
+    template = get_template(name, _versions[patched_driver_path(chromedriver_path)], build)
+    path = os.path.join(CACHE_PATH, "clones", f"{os.getpid()}-{uuid.uuid4().hex}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    clone_tree(template, path)
+    # Copies keep the template's modification time which clean_clones goes by.
+    os.utime(path)
+    return path
+
+def remove_clone(path):
+    """Deletes a profile clone, retrying while the browser that used it releases its files."""
+    for _ in range(5):
+        shutil.rmtree(path, ignore_errors=True)
+        if not os.path.exists(path):
+            return
+        time.sleep(1)
+
+def track(driver, path):
+    """
+    Deletes the profile clone at path once driver is quit and garbage collected or the process
+    exits.
+
+    driver [selenium webdriver] - Browser using the clone.
+    path [str] - Folder returned by clone_profile.
+    """
+    weakref.finalize(driver, remove_clone, path)
+
+def clean_clones():
+    """Deletes clones older than CLONE_MAX_AGE left behind by crashed runs."""
+    folder = os.path.join(CACHE_PATH, "clones")
+    if not os.path.exists(folder):
+        return
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            if time.time() - os.path.getmtime(path) > CLONE_MAX_AGE:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+def benchmark(chromedriver_path, launches=5, headless=True):
+    """
+    Launches and quits browsers with and without the launch cache and logs and returns the
+    average launch seconds of each as a dict.
+
+    chromedriver_path [str] - Path to chromedriver.
+    launches [int] - Launches per mode. 5 by default.
+    headless [bool] - True to run chrome headless. True by default.
+    """
+    global ENABLED
+    import browser_profile
+
+    enabled = ENABLED
+    averages = {}
+    try:
+        for mode in (False, True):
+            ENABLED = mode
+            # The first cached launch builds the template so it isn't counted.
+            if mode:
+                browser_profile.new_driver(chromedriver_path, headless=headless).quit()
+            seconds = []
+            for _ in range(launches):
+                start = time.perf_counter()
+                driver = browser_profile.new_driver(chromedriver_path, headless=headless)
+                seconds.append(time.perf_counter() - start)
+                driver.quit()
+            averages["cached" if mode else "uncached"] = sum(seconds) / len(seconds)
+    finally:
+        ENABLED = enabled
+
+    logging.info(f"Average launch: {averages['uncached']:.2f}s uncached, {averages['cached']:.2f}s cached "
+                 f"({averages['uncached'] / averages['cached']:.1f}x faster).")
+    return averages
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    benchmark(sys.argv[1])
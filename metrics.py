@@ -0,0 +1,314 @@
+import os
+import glob
+import json
+import time
+import bisect
+import threading
+import multiprocessing.util
+from contextlib import contextmanager
+
+import tracing
+
+# Settings.
+
+# Set to False to turn off metrics.
+ENABLED = True
+# Folder for per process snapshots and the exported files.
+METRICS_PATH = "metrics"
+# Prefix of exported metric names.
+PREFIX = "kickstarter_"
+# Minimum seconds between snapshot writes of a process.
+SNAPSHOT_SECONDS = 5
+# Seconds between exports.
+EXPORT_SECONDS = 15
+# Upper bounds of the latency histogram buckets in seconds.
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+# Metrics of the current process keyed by (name, labels) where labels is a sorted tuple of
+# (label, value) pairs. Gauges are (value, time set) tuples and histograms are
+# [bucket counts..., sum, count] lists.
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_pid = None
+_last_snapshot = 0
+
+# Exporter state of the parent process.
+_exporter = None
+_stop = threading.Event()
+_started_at = None
+_previous = None
+
+def _check_process():
+    """Clears metrics inherited from a parent process and registers the exit snapshot. Must be
+    called with _lock held."""
+    global _pid, _last_snapshot
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+        _last_snapshot = time.time()
+        # Finalizers also run when pool workers exit, unlike atexit handlers.
+        multiprocessing.util.Finalize(None, snapshot, exitpriority=0)
+
+def _key(name, labels):
+    return (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+
+def inc(name, value=1, **labels):
+    """
+    Adds value to a counter.
+
+    name [str] - Metric name e.g. pages_total.
+    value [int/float] - Amount to add. 1 by default.
+    labels - Label values e.g. page="campaign".
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        _check_process()
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+    _maybe_snapshot()
+
+def set_gauge(name, value, **labels):
+    """
+    Sets a gauge e.g. a queue depth.
+
+    name [str] - Metric name.
+    value [int/float] - Current value.
+    labels - Label values.
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        _check_process()
+        _gauges[_key(name, labels)] = (value, time.time())
+    _maybe_snapshot()
+
+def observe(name, seconds, **labels):
+    """
+    Adds a latency to a histogram.
+
+    name [str] - Metric name e.g. stage_seconds.
+    seconds [float] - Observed latency.
+    labels - Label values e.g. stage="fetch".
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        _check_process()
+        key = _key(name, labels)
+        histogram = _histograms.get(key)
+        if histogram == None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 3)
+        histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+    _maybe_snapshot()
+
+@contextmanager
+def timer(name="stage_seconds", **labels):
+    """
+    Context manager which observes the seconds its block took, also when it raises. Inside a
+    trace the block is also recorded as a span named after its stage.
+
+    name [str] - Histogram name. "stage_seconds" by default.
+    labels - Label values e.g. stage="parse".
+    """
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        observe(name, seconds, **labels)
+        tracing.add_span(labels.get("stage", name), started_at, seconds)
+
+def _maybe_snapshot():
+    if time.time() - _last_snapshot >= SNAPSHOT_SECONDS:
+        snapshot()
+
+def snapshot():
+    """Writes the metrics of this process to its snapshot file in METRICS_PATH."""
+    global _last_snapshot
+    with _lock:
+        if _pid != os.getpid():
+            return
+        _last_snapshot = time.time()
+        data = {
+            "pid": _pid,
+            "time": _last_snapshot,
+            "counters": [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            "gauges": [[name, list(labels), value, set_at] for (name, labels), (value, set_at) in _gauges.items()],
+            "histograms": [[name, list(labels), values] for (name, labels), values in _histograms.items()],
+        }
+
+    os.makedirs(METRICS_PATH, exist_ok=True)
+    path = os.path.join(METRICS_PATH, f"proc-{data['pid']}.json")
+    with open(path + ".tmp", "w") as f_obj:
+        json.dump(data, f_obj)
+    os.replace(path + ".tmp", path)
+
+def merge():
+    """Returns (counters, gauges, histograms) dicts over every snapshot in METRICS_PATH. Counters
+    and histograms are summed. Gauges take the value set last by any process, since snapshots of
+    exited workers are kept and would otherwise add stale values to current ones."""
+    counters, gauges, histograms = {}, {}, {}
+    gauge_times = {}
+    for path in glob.glob(os.path.join(METRICS_PATH, "proc-*.json")):
+        try:
+            with open(path) as f_obj:
+                data = json.load(f_obj)
+        except (OSError, ValueError):
+            continue
+
+        for name, labels, value in data["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value, *set_at in data["gauges"]:
+            key = (name, tuple(map(tuple, labels)))
+            # Snapshots written before gauges had their own time use the snapshot's.
+            set_at = set_at[0] if set_at else data["time"]
+            if set_at >= gauge_times.get(key, float("-inf")):
+                gauges[key] = value
+                gauge_times[key] = set_at
+        for name, labels, values in data["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], values)]
+            else:
+                histograms[key] = list(values)
+    return counters, gauges, histograms
+
+def format_labels(labels, extra=()):
+    """Returns labels in prometheus format e.g. {stage="fetch"}."""
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{label}="{value}"' for label, value in pairs) + "}"
+
+def to_prometheus(counters, gauges, histograms):
+    """Returns merged metrics in the prometheus text format."""
+    lines = []
+    for kind, metrics in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({name for name, labels in metrics}):
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for (metric_name, labels), value in sorted(metrics.items()):
+                if metric_name == name:
+                    lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+
+    for name in sorted({name for name, labels in histograms}):
+        lines.append(f"# TYPE {PREFIX}{name} histogram")
+        for (metric_name, labels), values in sorted(histograms.items()):
+            if metric_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ["+Inf"], values[:-2]):
+                cumulative += count
+                lines.append(f"{PREFIX}{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {values[-2]}")
+            lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {values[-1]}")
+    return "\n".join(lines) + "\n"
+
+def quantile(values, q):
+    """Returns the upper bound of the histogram bucket holding quantile q."""
+    count = values[-1]
+    if count == 0:
+        return None
+    cumulative = 0
+    for bound, bucket_count in zip(BUCKETS + [float("inf")], values[:-2]):
+        cumulative += bucket_count
+        if cumulative >= q * count:
+            return bound
+    return float("inf")
+
+def total(counters, name):
+    """Returns the sum of a counter over all its labels."""
+    return sum(value for (metric_name, labels), value in counters.items() if metric_name == name)
+
+def summarize(counters, gauges, histograms, now):
+    """Returns a dict with totals, rates and stage latencies of merged metrics."""
+    global _previous
+    pages = total(counters, "pages_total")
+    if _previous == None:
+        recent_rate = None
+    else:
+        recent_rate = (pages - _previous[1]) / max(now - _previous[0], 1e-9)
+    _previous = (now, pages)
+
+    stages = {}
+    for (name, labels), values in histograms.items():
+        if name != "stage_seconds":
+            continue
+        stage = dict(labels).get("stage", "")
+        stages[stage] = {
+            "count": values[-1],
+            "total_seconds": round(values[-2], 3),
+            "average_seconds": round(values[-2] / values[-1], 4) if values[-1] else None,
+            "p50_seconds": quantile(values, 0.5),
+            "p95_seconds": quantile(values, 0.95),
+        }
+
+    return {
+        "time": now,
+        "uptime_seconds": round(now - _started_at, 1),
+        "pages": pages,
+        "pages_per_second": round(pages / max(now - _started_at, 1e-9), 3),
+        "recent_pages_per_second": round(recent_rate, 3) if recent_rate != None else None,
+        "captcha_rate": round(total(counters, "captchas_total") / pages, 4) if pages else None,
+        "deleted_rate": round(total(counters, "deleted_pages_total") / pages, 4) if pages else None,
+        "browser_launches": total(counters, "browser_launches_total"),
+        "errors": total(counters, "errors_total"),
+        "queue_depths": {dict(labels).get("queue", name): value for (name, labels), value in gauges.items() if name == "queue_depth"},
+        "stages": stages,
+        "counters": {name + format_labels(labels): value for (name, labels), value in sorted(counters.items())},
+    }
+
+def export():
+    """Merges the snapshots of every process and writes metrics.prom and metrics_summary.json."""
+    snapshot()
+    counters, gauges, histograms = merge()
+    os.makedirs(METRICS_PATH, exist_ok=True)
+
+    path = os.path.join(METRICS_PATH, "metrics.prom")
+    with open(path + ".tmp", "w") as f_obj:
+        f_obj.write(to_prometheus(counters, gauges, histograms))
+    os.replace(path + ".tmp", path)
+
+    path = os.path.join(METRICS_PATH, "metrics_summary.json")
+    with open(path + ".tmp", "w") as f_obj:
+        json.dump(summarize(counters, gauges, histograms, time.time()), f_obj, indent=2)
+    os.replace(path + ".tmp", path)
+
+def start_exporter():
+    """Removes snapshots of earlier runs and starts exporting every EXPORT_SECONDS in a background
+    thread. Called once by the parent process before starting workers."""
+    global _exporter, _started_at, _previous
+    if not ENABLED:
+        return
+    os.makedirs(METRICS_PATH, exist_ok=True)
+    for path in glob.glob(os.path.join(METRICS_PATH, "proc-*.json")):
+        os.remove(path)
+
+    _started_at = time.time()
+    _previous = None
+    _stop.clear()
+
+    def run():
+        while not _stop.wait(EXPORT_SECONDS):
+            export()
+
+    _exporter = threading.Thread(target=run, daemon=True)
+    _exporter.start()
+
+def stop_exporter():
+    """Stops the exporter thread and makes a final export."""
+    global _exporter
+    if _exporter == None:
+        return
+    _stop.set()
+    _exporter.join()
+    _exporter = None
+    export()
@@ -0,0 +1,310 @@
+import base64
+import json
+import logging
+import threading
+import time
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import browser_profile
+
+# Settings.
+
+# Seconds between reads of the performance log while waiting for responses.
+POLL_INTERVAL = 0.25
+# Chromedriver path used by test_network_capture. None lets undetected_chromedriver find one.
+TEST_CHROMEDRIVER_PATH = None
+
+def get_json_responses(driver, events, state=None):
+    """
+    Returns a list of (url, data) tuples for every finished JSON response in events. data
+    is the parsed response body. Bodies must be read before the page navigates away.
+
+    driver [selenium webdriver] - A webdriver created by browser_profile.new_driver.
+    events [list] - Events returned by browser_profile.get_network_events.
+    state [dict] - Requests seen by earlier calls, for reading events in several batches. A
+    response received in one batch and finished in a later one is only found with it. Only
+    events is used by default.
+    """
+    if state == None:
+        state = {}
+    json_requests = state.setdefault("json_requests", {})
+    finished = state.setdefault("finished", set())
+    read = state.setdefault("read", set())
+    for event in events:
+        params = event["params"]
+        if event["method"] == "Network.responseReceived":
+            response = params["response"]
+            if "json" in response.get("mimeType", ""):
+                json_requests[params["requestId"]] = response["url"]
+        elif event["method"] == "Network.loadingFinished":
+            finished.add(params["requestId"])
+
+    responses = []
+    for request_id in finished & json_requests.keys() - read:
+        read.add(request_id)
+        try:
+            body = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+        except Exception:
+            continue
+        text = body["body"]
+        if body.get("base64Encoded"):
+            text = base64.b64decode(text).decode("utf8", errors="replace")
+        try:
+            responses.append((json_requests[request_id], json.loads(text)))
+        except ValueError:
+            continue
+    return responses
+
+def wait_for_responses(driver, mapper, timeout):
+    """
+    Collects JSON responses made by the page until mapper returns something other than
+    None for them or timeout seconds pass. Returns a tuple of (mapped result or None,
+    responses, events).
+
+    driver [selenium webdriver] - A webdriver created by browser_profile.new_driver.
+    mapper [function] - A function taking a list of responses, e.g. map_rewards.
+    timeout [int/float] - Maximum seconds to wait.
+    """
+    events, responses = [], []
+    # Kept for the whole wait since a response and its end can be read in different polls.
+    state = {}
+    end = time.time() + timeout
+    while True:
+        new_events = browser_profile.get_network_events(driver)
+        events.extend(new_events)
+        responses.extend(get_json_responses(driver, new_events, state))
+
+        result = mapper(responses)
+        if result != None or time.time() >= end:
+            return result, responses, events
+        time.sleep(POLL_INTERVAL)
+
+def find_values(obj, key):
+    """
+    Yields every value stored under key anywhere in a nested JSON object.
+
+    obj [dict/list] - A parsed JSON object.
+    key [str] - Key to look for.
+    """
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k == key:
+                yield v
+            yield from find_values(v, key)
+    elif isinstance(obj, list):
+        for v in obj:
+            yield from find_values(v, key)
+
+def get_nodes(connection):
+    """
+    Returns the list of nodes of a GraphQL connection with either "nodes" or "edges".
+
+    connection [dict] - A GraphQL connection.
+    """
+    if not isinstance(connection, dict):
+        return None
+    if isinstance(connection.get("nodes"), list):
+        return connection["nodes"]
+    if isinstance(connection.get("edges"), list):
+        return [edge.get("node", edge) for edge in connection["edges"]]
+    return None
+
+def decode_id(graph_id):
+    """
+    Returns the numeric part of a GraphQL id like base64("Reward-123") as a string. Other
+    ids are returned unchanged.
+
+    graph_id [str/int] - A GraphQL id.
+    """
+    graph_id = str(graph_id)
+    try:
+        decoded = base64.b64decode(graph_id, validate=True).decode("utf8")
+    except Exception:
+        return graph_id
+    return decoded.split("-")[-1] if "-" in decoded else graph_id
+
+def map_reward(node):
+    """
+    Returns a GraphQL reward node as raw pledge fields in the same form as
+    project_data_extractor.get_pledge_fields so build_pledge_data can be used on it.
+
+    node [dict] - A reward node.
+    """
+    amount = node.get("amount") or {}
+    if isinstance(amount, dict):
+        amount = amount.get("amount", 0)
+
+    # Same text as the page: item name followed by its quantity.
+    items = None
+    if isinstance(node.get("items"), dict):
+        edges = node["items"].get("edges") or [{"node": item} for item in node["items"].get("nodes") or []]
+        if edges:
+            items = []
+            for edge in edges:
+                item = edge.get("node", {})
+                items.append(f"{item.get('name', '')}Quantity: {edge.get('quantity', item.get('quantity', 1))}")
+
+    limit = None
+    if node.get("limit") != None:
+        remaining = node.get("remainingQuantity")
+        if remaining == 0:
+            limit = "None left"
+        else:
+            limit = f"{remaining} left of {node['limit']}"
+
+    shipping = node.get("shippingSummarySentence") or node.get("shippingSummary")
+    backers = node.get("backersCount")
+    return {
+        "id": decode_id(node.get("id", "")),
+        "title": node.get("name") or "",
+        "price": str(int(round(float(amount or 0)))),
+        "description": node.get("description"),
+        "items": items,
+        "delivery_date": node.get("estimatedDeliveryOn"),
+        "shipping_location": shipping,
+        "backers": str(backers) if backers != None else None,
+        "limit": limit,
+    }
+
+def project_slug(link):
+    """
+    Returns the slug of a project link e.g. photo-time-machine for
+    https://www.kickstarter.com/projects/732431717/photo-time-machine/rewards, or None if link
+    is not a project link.
+
+    link [str] - A project link.
+    """
+    parts = link.split("?")[0].split("/projects/")
+    if len(parts) < 2 or len(parts[1].split("/")) < 2:
+        return None
+    return parts[1].split("/")[1]
+
+def find_project(data, slug):
+    """
+    Yields the project objects anywhere in a response whose slug is slug, so data of other
+    projects in the same page e.g. recommendations is never mapped. Yields the whole response
+    if slug is None.
+
+    data [dict/list] - A parsed JSON response.
+    slug [str] - Slug of the scraped project.
+    """
+    if slug == None:
+        yield data
+        return
+    for project in find_values(data, "project"):
+        if isinstance(project, dict) and project.get("slug") == slug:
+            yield project
+
+def map_rewards(responses, slug=None):
+    """
+    Returns a list of raw pledge fields from the first response with a rewards connection
+    of the project and None if there is none.
+
+    responses [list] - Responses returned by get_json_responses.
+    slug [str] - Slug of the project, see project_slug. Rewards anywhere in the responses are
+    used if None. None by default.
+    """
+    for url, data in responses:
+        for rewards in (rewards for project in find_project(data, slug) for rewards in find_values(project, "rewards")):
+            nodes = get_nodes(rewards)
+            if nodes != None:
+                return [map_reward(node) for node in nodes]
+    return None
+
+def map_creator(responses, slug=None):
+    """
+    Returns a dict with "created" and "backed" project counts of the creator from the first
+    response with creator counts of the project and None if there is none.
+
+    responses [list] - Responses returned by get_json_responses.
+    slug [str] - Slug of the project, see project_slug. Creators anywhere in the responses are
+    used if None. None by default.
+    """
+    for url, data in responses:
+        for creator in (creator for project in find_project(data, slug) for creator in find_values(project, "creator")):
+            if not isinstance(creator, dict):
+                continue
+
+            created = None
+            for key in ("createdProjects", "launchedProjects"):
+                if isinstance(creator.get(key), dict):
+                    created = creator[key].get("totalCount")
+                    break
+
+            backed = None
+            if isinstance(creator.get("backedProjects"), dict):
+                backed = creator["backedProjects"].get("totalCount")
+            elif "backingsCount" in creator:
+                backed = creator["backingsCount"]
+
+            if created != None or backed != None:
+                return {"created": created, "backed": backed}
+    return None
+
+# Local page for test_network_capture. Issues the same kind of GraphQL requests as
+# the creator modal and the rewards page.
+_TEST_PAGE = """<html><body><div id="out"></div><script>
+const post = (query) => fetch('/graph', {method: 'POST', headers: {'Content-Type': 'application/json'},
+                                         body: JSON.stringify({query})});
+post('similar').then(() => post('creator')).then(() => post('rewards')).then(() => document.getElementById('out').textContent = 'done');
+</script></body></html>"""
+
+# Slug of the test project. The similar response is another project's data the mappers must skip.
+_TEST_SLUG = "photo-time-machine"
+
+_TEST_RESPONSES = {
+    "similar": {"data": {"project": {"slug": "other-project", "creator": {"createdProjects": {"totalCount": 9}},
+                                     "rewards": {"nodes": [{"id": "Reward-1", "name": "Other"}]}}}},
+    "creator": {"data": {"project": {"slug": _TEST_SLUG, "creator": {"createdProjects": {"totalCount": 3}, "backingsCount": 42}}}},
+    "rewards": {"data": {"project": {"slug": _TEST_SLUG, "rewards": {"nodes": [
+        {"id": base64.b64encode(b"Reward-101").decode(), "name": "Early bird", "amount": {"amount": "25.0"},
+         "description": "A thank you.", "estimatedDeliveryOn": "2024-05-01", "backersCount": 10,
+         "limit": 50, "remainingQuantity": 40, "shippingSummarySentence": "Ships worldwide",
+         "items": {"edges": [{"quantity": 2, "node": {"name": "Sticker"}}]}},
+        {"id": base64.b64encode(b"Reward-102").decode(), "name": "Sold out", "amount": {"amount": "100"},
+         "description": None, "estimatedDeliveryOn": None, "backersCount": 5,
+         "limit": 5, "remainingQuantity": 0, "items": {"edges": []}},
+    ]}}}},
+}
+
+class _TestHandler(SimpleHTTPRequestHandler):
+    def do_GET(self):
+        self._send(_TEST_PAGE.encode(), "text/html")
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["query"]
+        self._send(json.dumps(_TEST_RESPONSES[query]).encode(), "application/json")
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def test_network_capture():
+    # Testing code. Serves a local page which makes GraphQL like requests and checks the
+    # captured responses map to the expected fields.
+    server = HTTPServer(("127.0.0.1", 0), _TestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    driver = browser_profile.new_driver(TEST_CHROMEDRIVER_PATH, headless=True)
+    try:
+        driver.get(f"http://127.0.0.1:{server.server_port}/")
+        rewards, responses, events = wait_for_responses(driver, lambda responses: map_rewards(responses, _TEST_SLUG), 10)
+        creator = map_creator(responses, _TEST_SLUG)
+    finally:
+        driver.quit()
+        server.shutdown()
+
+    assert creator == {"created": 3, "backed": 42}, creator
+    assert [reward["id"] for reward in rewards] == ["101", "102"], rewards
+    assert rewards[0]["items"] == ["StickerQuantity: 2"], rewards
+    assert rewards[0]["limit"] == "40 left of 50" and rewards[1]["limit"] == "None left", rewards
+    logging.info(f"Network capture test passed: {creator} {rewards}")
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%m/%d/%Y %I:%M:%S %p')
+    test_network_capture()
@@ -0,0 +1,524 @@
+import json
+import logging
+import sqlite3
+
+# Settings.
+
+# Databases to migrate. Set a path to None to skip it.
+# new_projects.db made by project_data_extractor.py.
+NEW_PROJECTS_PATH = r"D:\new_projects.db"
+# creators.db made by creator_data_extractor.py.
+CREATORS_PATH = r"D:\creators.db"
+# projects.db made by extra_project_finder.py.
+PROJECTS_PATH = r"D:\projects.db"
+# Output database.
+OUTPUT_PATH = r"D:\normalized.db"
+# Number of source rows read and written per transaction.
+BATCH_SIZE = 1000
+# Highest pledge index in the wide projects layout.
+MAX_PLEDGE_NUM = 126
+# Set logging.
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%m/%d/%Y %I:%M:%S %p')
+
+# Columns of the projects table other than url.
+PROJECT_COLUMNS = [
+    "kickstarter_id", "slug", "creator_id", "title", "creator_name", "blurb", "verified_identity", "status",
+    "collaborators", "original_currency", "converted_currency", "conversion_rate", "goal", "converted_goal",
+    "pledged", "converted_pledged", "backers", "created_date", "launched_date", "deadline_date", "duration",
+    "num_photos", "num_videos", "pwl", "make100", "category", "subcategory", "location", "creator_num_created",
+    "creator_num_backed", "num_comments", "num_updates", "num_faqs", "description", "risk", "num_rewards",
+    "hidden", "date_accessed",
+]
+
+def main():
+    con = create_normalized_db(OUTPUT_PATH)
+    if NEW_PROJECTS_PATH != None:
+        migrate_new_projects(NEW_PROJECTS_PATH, con)
+    if CREATORS_PATH != None:
+        migrate_creators(CREATORS_PATH, con)
+    if PROJECTS_PATH != None:
+        migrate_projects(PROJECTS_PATH, con)
+    con.execute("ANALYZE")
+    con.close()
+    logging.info("Finished migrating.")
+
+def create_normalized_db(path):
+    """
+    Creates the normalized database with its indexes and compatibility views if it doesn't exist
+    and returns a connection.
+
+    path [str] - Location to save/load the database.
+    """
+    con = sqlite3.connect(path, timeout=30)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA foreign_keys=ON")
+    cur = con.cursor()
+
+    # One row per project from any source. Projects are keyed by url since older data has no
+    # kickstarter ids and a renamed project shows up under one id with several urls. slug is the
+    # last part of the url.
+    cur.execute("""CREATE TABLE IF NOT EXISTS projects(
+                url TEXT PRIMARY KEY,
+                kickstarter_id INTEGER,
+                slug TEXT,
+                creator_id TEXT,
+                title TEXT,
+                creator_name TEXT,
+                blurb TEXT,
+                verified_identity TEXT,
+                status TEXT,
+                collaborators TEXT,
+                original_currency TEXT,
+                converted_currency TEXT,
+                conversion_rate REAL,
+                goal REAL,
+                converted_goal REAL,
+                pledged REAL,
+                converted_pledged REAL,
+                backers INTEGER,
+                created_date TEXT,
+                launched_date TEXT,
+                deadline_date TEXT,
+                duration INTEGER,
+                num_photos INTEGER,
+                num_videos INTEGER,
+                pwl INTEGER,
+                make100 INTEGER,
+                category TEXT,
+                subcategory TEXT,
+                location TEXT,
+                creator_num_created INTEGER,
+                creator_num_backed INTEGER,
+                num_comments INTEGER,
+                num_updates INTEGER,
+                num_faqs INTEGER,
+                description TEXT,
+                risk TEXT,
+                num_rewards INTEGER,
+                hidden INTEGER NOT NULL DEFAULT 0,
+                date_accessed TEXT
+                )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS projects_creator_id ON projects(creator_id)")
+    # Databases migrated before renamed projects were handled have a unique index under this name.
+    for row in cur.execute("PRAGMA index_list(projects)").fetchall():
+        if row[1] == "projects_kickstarter_id" and row[2]:
+            cur.execute("DROP INDEX projects_kickstarter_id")
+    cur.execute("CREATE INDEX IF NOT EXISTS projects_kickstarter_id ON projects(kickstarter_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS projects_category ON projects(category, subcategory)")
+    cur.execute("CREATE INDEX IF NOT EXISTS projects_status_deadline ON projects(status, deadline_date)")
+
+    # Pledges of a project.
+    cur.execute("""CREATE TABLE IF NOT EXISTS rewards(
+                project_url TEXT NOT NULL REFERENCES projects(url),
+                reward_index INTEGER NOT NULL,
+                reward_id TEXT,
+                title TEXT,
+                price REAL,
+                description TEXT,
+                items TEXT,
+                delivery_date TEXT,
+                shipping_location TEXT,
+                backers INTEGER,
+                reward_limit INTEGER,
+                gone INTEGER,
+                PRIMARY KEY (project_url, reward_index)
+                )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS creators(
+                creator_id TEXT PRIMARY KEY,
+                url TEXT,
+                join_day INTEGER,
+                join_month INTEGER,
+                join_year INTEGER,
+                location TEXT,
+                biography TEXT,
+                num_backed INTEGER,
+                num_created INTEGER,
+                comments_hidden INTEGER,
+                deleted INTEGER NOT NULL DEFAULT 0
+                )""")
+
+    # Alternate creator ids which redirect to creator_id.
+    cur.execute("""CREATE TABLE IF NOT EXISTS creator_aliases(
+                alias TEXT PRIMARY KEY,
+                creator_id TEXT NOT NULL
+                )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS creator_aliases_creator_id ON creator_aliases(creator_id)")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS websites(
+                creator_id TEXT NOT NULL REFERENCES creators(creator_id),
+                website_index INTEGER NOT NULL,
+                url TEXT,
+                PRIMARY KEY (creator_id, website_index)
+                )""")
+
+    # Projects created by a creator.
+    cur.execute("""CREATE TABLE IF NOT EXISTS creator_projects(
+                creator_id TEXT NOT NULL,
+                project_url TEXT NOT NULL REFERENCES projects(url),
+                PRIMARY KEY (creator_id, project_url)
+                ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS creator_projects_project_url ON creator_projects(project_url)")
+
+    # Projects backed by a creator.
+    cur.execute("""CREATE TABLE IF NOT EXISTS backings(
+                creator_id TEXT NOT NULL,
+                project_url TEXT NOT NULL REFERENCES projects(url),
+                PRIMARY KEY (creator_id, project_url)
+                ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS backings_project_url ON backings(project_url)")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS comments(
+                creator_id TEXT NOT NULL REFERENCES creators(creator_id),
+                comment_index INTEGER NOT NULL,
+                body TEXT,
+                date TEXT,
+                link TEXT,
+                PRIMARY KEY (creator_id, comment_index)
+                )""")
+
+    create_compatibility_views(cur)
+    con.commit()
+    return con
+
+def create_compatibility_views(cur):
+    """
+    Creates views which reproduce the tables of the old databases from the normalized tables:
+    projects_wide and hidden_projects_wide (new_projects.db), creator_wide, deleted_creators
+    and creator_alias (creators.db) and summary_projects (projects.db).
+
+    cur [sqlite3.Cursor] - A cursor of the normalized database.
+    """
+    def day_month_year(column, prefix):
+        return (f"CAST(strftime('%d', p.{column}) AS INTEGER) AS {prefix}day, "
+                f"CAST(strftime('%m', p.{column}) AS INTEGER) AS {prefix}month, "
+                f"CAST(strftime('%Y', p.{column}) AS INTEGER) AS {prefix}year")
+
+    # Wide layout with 10 columns per pledge.
+    pledge_columns = []
+    reward_fields = [("rd_id", "reward_id"), ("rd_title", "title"), ("rd_price", "price"), ("rd_desc", "description"),
+                     ("rd_list", "items"), ("rd_delivery_date", "delivery_date"), ("rd_shipping_location", "shipping_location"),
+                     ("rd_backers", "backers"), ("rd_limit", "reward_limit"), ("rd_gone", "gone")]
+    for i in range(MAX_PLEDGE_NUM + 1):
+        for old, new in reward_fields:
+            pledge_columns.append(f"MAX(CASE WHEN r.reward_index = {i} THEN r.{new} END) AS {old}_{i}")
+
+    cur.execute(f"""CREATE VIEW IF NOT EXISTS projects_wide AS
+                SELECT p.duration AS time_interval, p.date_accessed, p.url AS rd_project_link, p.slug AS project_id,
+                p.creator_id, p.title, p.creator_name AS rd_creator_name, p.blurb, p.verified_identity, p.status,
+                p.duration AS cv_duration, p.backers AS cv_num_backers, p.collaborators,
+                p.original_currency AS original_curr_symbol, p.converted_currency AS converted_curr_symbol,
+                p.conversion_rate, p.goal, p.converted_goal, p.pledged, p.converted_pledged,
+                {day_month_year("launched_date", "cv_start")}, {day_month_year("deadline_date", "cv_end")},
+                p.num_photos, p.num_videos, p.pwl, p.make100, p.category, p.subcategory, p.location,
+                p.creator_num_created AS rd_creator_created, p.creator_num_backed AS num_backed,
+                p.num_comments AS rd_comments, p.num_updates AS rd_updates, p.num_faqs AS rd_faqs,
+                p.description, p.risk, p.num_rewards AS cv_num_rewards,
+                {", ".join(pledge_columns)}
+                FROM projects p LEFT JOIN rewards r ON r.project_url = p.url
+                WHERE p.hidden = 0 AND p.date_accessed IS NOT NULL
+                GROUP BY p.url""")
+
+    summary_columns = """p.title AS name, p.url, p.creator_id, p.blurb, p.original_currency, p.converted_currency,
+                p.conversion_rate, p.converted_goal AS goal, p.converted_pledged AS pledged, p.backers, p.status AS state,
+                p.pwl, p.location, p.subcategory, p.category, p.created_date, p.launched_date, p.deadline_date"""
+
+    cur.execute(f"""CREATE VIEW IF NOT EXISTS hidden_projects_wide AS
+                SELECT {summary_columns} FROM projects p WHERE p.hidden = 1""")
+
+    cur.execute(f"""CREATE VIEW IF NOT EXISTS summary_projects AS
+                SELECT {summary_columns} FROM projects p WHERE p.hidden = 0""")
+
+    summary_object = """json_object('name', p.title, 'url', p.url, 'creator_id', p.creator_id, 'blurb', p.blurb,
+                'original_currency', p.original_currency, 'converted_currency', p.converted_currency,
+                'conversion_rate', p.conversion_rate, 'goal', p.converted_goal, 'pledged', p.converted_pledged,
+                'backers', p.backers, 'state', p.status, 'pwl', p.pwl, 'location', p.location,
+                'subcategory', p.subcategory, 'category', p.category, 'created_date', p.created_date,
+                'launched_date', p.launched_date, 'deadline_date', p.deadline_date)"""
+
+    cur.execute(f"""CREATE VIEW IF NOT EXISTS creator_wide AS
+                SELECT c.url, c.creator_id, c.join_day, c.join_month, c.join_year, c.location, c.biography,
+                c.num_backed, c.num_created,
+                (SELECT COUNT(*) FROM websites w WHERE w.creator_id = c.creator_id) AS num_websites,
+                EXISTS (SELECT 1 FROM websites w WHERE w.creator_id = c.creator_id AND w.url LIKE '%facebook%') AS has_facebook,
+                EXISTS (SELECT 1 FROM websites w WHERE w.creator_id = c.creator_id AND w.url LIKE '%twitter%') AS has_twitter,
+                EXISTS (SELECT 1 FROM websites w WHERE w.creator_id = c.creator_id AND w.url LIKE '%instagram%') AS has_instagram,
+                (SELECT json_group_array(w.url) FROM (SELECT url FROM websites WHERE creator_id = c.creator_id
+                    ORDER BY website_index) w) AS websites,
+                c.comments_hidden,
+                (SELECT COUNT(*) FROM comments m WHERE m.creator_id = c.creator_id) AS num_comments,
+                (SELECT json_group_array(json_array(m.body, m.date, m.link)) FROM (SELECT * FROM comments
+                    WHERE creator_id = c.creator_id ORDER BY comment_index) m) AS comments,
+                (SELECT json_group_array(json({summary_object})) FROM creator_projects cp
+                    JOIN projects p ON p.url = cp.project_url WHERE cp.creator_id = c.creator_id) AS created_projects,
+                (SELECT json_group_array(json({summary_object})) FROM backings b
+                    JOIN projects p ON p.url = b.project_url WHERE b.creator_id = c.creator_id) AS backed_projects
+                FROM creators c WHERE c.deleted = 0""")
+
+    cur.execute("CREATE VIEW IF NOT EXISTS deleted_creators AS SELECT creator_id FROM creators WHERE deleted = 1")
+    cur.execute("CREATE VIEW IF NOT EXISTS creator_alias AS SELECT creator_id AS actual, alias FROM creator_aliases")
+
+def blank(value):
+    """Returns None for the empty strings the scrapers use for missing data and value otherwise."""
+    return None if value == "" else value
+
+def to_date(day, month, year):
+    """Returns a YYYY-MM-DD string from date parts or None if any part is missing."""
+    if blank(day) == None or blank(month) == None or blank(year) == None:
+        return None
+    return f"{int(year):04d}-{int(month):02d}-{int(day):02d}"
+
+def upsert_projects(cur, projects):
+    """
+    Inserts project dicts with keys url and any of PROJECT_COLUMNS. Values already stored for a
+    project are kept and missing ones are filled in, so sources can be migrated in any order.
+
+    cur [sqlite3.Cursor] - A cursor of the normalized database.
+    projects [list] - List of project dicts.
+    """
+    placeholders = ", ".join("?" * (len(PROJECT_COLUMNS) + 1))
+    updates = ", ".join(f"{column} = COALESCE(projects.{column}, excluded.{column})" for column in PROJECT_COLUMNS)
+    cur.executemany(f"""INSERT INTO projects (url, {", ".join(PROJECT_COLUMNS)}) VALUES ({placeholders})
+                    ON CONFLICT(url) DO UPDATE SET {updates}""",
+                    [(project["url"], *(blank(project.get(column)) for column in PROJECT_COLUMNS)) for project in projects])
+
+def summary_to_project(summary, hidden=0):
+    """
+    Returns a project dict for upsert_projects from a parse_data_project style dict (used by
+    creators.db, projects.db and hidden_projects).
+
+    summary [dict] - A parsed data project.
+    hidden [int] - 1 if the project is hidden and 0 otherwise. 0 by default.
+    """
+    conversion_rate = blank(summary.get("conversion_rate"))
+    goal = blank(summary.get("goal"))
+    return {
+        "url": summary["url"],
+        "kickstarter_id": summary.get("id"),
+        "slug": summary["url"].rstrip("/").split("/")[-1],
+        "creator_id": blank(summary.get("creator_id")) and str(summary["creator_id"]),
+        "title": summary.get("name"),
+        "blurb": summary.get("blurb"),
+        "status": summary.get("state"),
+        "original_currency": summary.get("original_currency"),
+        "converted_currency": summary.get("converted_currency"),
+        "conversion_rate": conversion_rate,
+        # Summary goals and pledges are already converted to USD.
+        "goal": float(goal) / float(conversion_rate) if goal != None and conversion_rate else None,
+        "converted_goal": goal,
+        "converted_pledged": summary.get("pledged"),
+        "backers": summary.get("backers"),
+        "pwl": summary.get("pwl"),
+        "location": summary.get("location"),
+        "subcategory": summary.get("subcategory"),
+        "category": summary.get("category"),
+        "created_date": summary.get("created_date"),
+        "launched_date": summary.get("launched_date"),
+        "deadline_date": summary.get("deadline_date"),
+        "hidden": hidden,
+    }
+
+def iter_batches(cur, sql):
+    """
+    Yields lists of at most BATCH_SIZE rows as dicts from a query so that tables are never
+    fully loaded in memory.
+
+    cur [sqlite3.Cursor] - A cursor of the source database.
+    sql [str] - A SELECT statement.
+    """
+    cur.execute(sql)
+    columns = [description[0] for description in cur.description]
+    while True:
+        rows = cur.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        yield [dict(zip(columns, row)) for row in rows]
+
+def has_table(con, table):
+    """Returns True if table exists in the database of con."""
+    return con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() != None
+
+def migrate_new_projects(path, con):
+    """
+    Migrates the projects and hidden_projects tables of a new_projects.db.
+
+    path [str] - Path to new_projects.db.
+    con [sqlite3.Connection] - Connection to the normalized database.
+    """
+    src = sqlite3.connect(path)
+    cur = con.cursor()
+    total = 0
+    for rows in iter_batches(src.cursor(), "SELECT * FROM projects"):
+        projects, rewards = [], []
+        for row in rows:
+            url = row["rd_project_link"]
+            projects.append({
+                "url": url,
+                "slug": row["project_id"],
+                "creator_id": row["creator_id"],
+                "title": row["title"],
+                "creator_name": row["rd_creator_name"],
+                "blurb": row["blurb"],
+                "verified_identity": row["verified_identity"],
+                "status": row["status"],
+                "collaborators": row["collaborators"],
+                "original_currency": row["original_curr_symbol"],
+                "converted_currency": row["converted_curr_symbol"],
+                "conversion_rate": row["conversion_rate"],
+                "goal": row["goal"],
+                "converted_goal": row["converted_goal"],
+                "pledged": row["pledged"],
+                "converted_pledged": row["converted_pledged"],
+                "launched_date": to_date(row["cv_startday"], row["cv_startmonth"], row["cv_startyear"]),
+                "deadline_date": to_date(row["cv_endday"], row["cv_endmonth"], row["cv_endyear"]),
+                "duration": row["cv_duration"],
+                "num_photos": row["num_photos"],
+                "num_videos": row["num_videos"],
+                "pwl": row["pwl"],
+                "make100": row["make100"],
+                "category": row["category"],
+                "subcategory": row["subcategory"],
+                "location": row["location"],
+                "creator_num_created": row["rd_creator_created"],
+                "creator_num_backed": row["num_backed"],
+                "num_comments": row["rd_comments"],
+                "num_updates": row["rd_updates"],
+                "num_faqs": row["rd_faqs"],
+                "description": row["description"],
+                "risk": row["risk"],
+                "num_rewards": row["cv_num_rewards"],
+                "hidden": 0,
+                "date_accessed": row["date_accessed"],
+            })
+
+            for i in range(MAX_PLEDGE_NUM + 1):
+                if blank(row[f"rd_id_{i}"]) == None:
+                    continue
+                rewards.append((url, i, row[f"rd_id_{i}"], row[f"rd_title_{i}"], blank(row[f"rd_price_{i}"]),
+                                row[f"rd_desc_{i}"], row[f"rd_list_{i}"], blank(row[f"rd_delivery_date_{i}"]),
+                                blank(row[f"rd_shipping_location_{i}"]), blank(row[f"rd_backers_{i}"]),
+                                blank(row[f"rd_limit_{i}"]), blank(row[f"rd_gone_{i}"])))
+
+        upsert_projects(cur, projects)
+        cur.executemany("INSERT OR REPLACE INTO rewards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rewards)
+        con.commit()
+        total += len(rows)
+        logging.info(f"Migrated {total} projects from {path}...")
+
+    for rows in iter_batches(src.cursor(), "SELECT * FROM hidden_projects"):
+        upsert_projects(cur, [summary_to_project(row, hidden=1) for row in rows])
+        con.commit()
+    src.close()
+
+def migrate_creators(path, con):
+    """
+    Migrates the creator, deleted_creators and creator_alias tables of a creators.db.
+
+    path [str] - Path to creators.db.
+    con [sqlite3.Connection] - Connection to the normalized database.
+    """
+    src = sqlite3.connect(path)
+    cur = con.cursor()
+    total = 0
+    for rows in iter_batches(src.cursor(), "SELECT * FROM creator"):
+        creators, websites, comments, projects, created, backed = [], [], [], [], [], []
+        for row in rows:
+            creator_id = row["creator_id"]
+            creators.append((creator_id, row["url"], blank(row["join_day"]), blank(row["join_month"]), blank(row["join_year"]),
+                             row["location"], row["biography"], blank(row["num_backed"]), blank(row["num_created"]),
+                             row["comments_hidden"]))
+            websites.extend((creator_id, i, url) for i, url in enumerate(json.loads(row["websites"] or "[]")))
+            comments.extend((creator_id, i, *comment) for i, comment in enumerate(json.loads(row["comments"] or "[]")))
+
+            # Newer rows only hold project_store ids, which migrate_project_store links.
+            for summary in json.loads(row["created_projects"] or "[]"):
+                if isinstance(summary, dict):
+                    projects.append(summary_to_project(summary))
+                    created.append((creator_id, summary["url"]))
+            for summary in json.loads(row["backed_projects"] or "[]"):
+                if isinstance(summary, dict):
+                    projects.append(summary_to_project(summary))
+                    backed.append((creator_id, summary["url"]))
+
+        cur.executemany("""INSERT INTO creators (creator_id, url, join_day, join_month, join_year, location, biography,
+                        num_backed, num_created, comments_hidden) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(creator_id) DO UPDATE SET url = excluded.url, join_day = excluded.join_day,
+                        join_month = excluded.join_month, join_year = excluded.join_year, location = excluded.location,
+                        biography = excluded.biography, num_backed = excluded.num_backed, num_created = excluded.num_created,
+                        comments_hidden = excluded.comments_hidden, deleted = 0""", creators)
+        cur.executemany("INSERT OR REPLACE INTO websites VALUES (?, ?, ?)", websites)
+        cur.executemany("INSERT OR REPLACE INTO comments VALUES (?, ?, ?, ?, ?)", comments)
+        upsert_projects(cur, projects)
+        cur.executemany("INSERT OR IGNORE INTO creator_projects VALUES (?, ?)", created)
+        cur.executemany("INSERT OR IGNORE INTO backings VALUES (?, ?)", backed)
+        con.commit()
+        total += len(rows)
+        logging.info(f"Migrated {total} creators from {path}...")
+
+    migrate_project_store(src, con)
+    migrate_deleted_creators(src, con)
+    for rows in iter_batches(src.cursor(), "SELECT actual, alias FROM creator_alias"):
+        cur.executemany("INSERT OR IGNORE INTO creator_aliases VALUES (?, ?)", [(row["alias"], row["actual"]) for row in rows])
+        con.commit()
+    src.close()
+
+def migrate_projects(path, con):
+    """
+    Migrates the projects and deleted_creators tables of a projects.db.
+
+    path [str] - Path to projects.db.
+    con [sqlite3.Connection] - Connection to the normalized database.
+    """
+    src = sqlite3.connect(path)
+    cur = con.cursor()
+    total = 0
+    for rows in iter_batches(src.cursor(), "SELECT * FROM projects"):
+        projects = [summary_to_project(row) for row in rows]
+        upsert_projects(cur, projects)
+        cur.executemany("INSERT OR IGNORE INTO creator_projects VALUES (?, ?)",
+                        [(project["creator_id"], project["url"]) for project in projects if project["creator_id"] != None])
+        con.commit()
+        total += len(rows)
+        logging.info(f"Migrated {total} projects from {path}...")
+
+    migrate_project_store(src, con)
+    migrate_deleted_creators(src, con)
+    src.close()
+
+def migrate_project_store(src, con):
+    """
+    Migrates the project_store and creator_projects tables of src.
+
+    src [sqlite3.Connection] - Connection to the source database.
+    con [sqlite3.Connection] - Connection to the normalized database.
+    """
+    if not has_table(src, "project_store"):
+        return
+    cur = con.cursor()
+    for rows in iter_batches(src.cursor(), "SELECT * FROM project_store"):
+        upsert_projects(cur, [summary_to_project(row) for row in rows])
+        con.commit()
+
+    for rows in iter_batches(src.cursor(), """SELECT cp.creator_id, cp.relation, ps.url FROM creator_projects cp
+                             JOIN project_store ps ON ps.id = cp.project_id"""):
+        for relation, table in (("created", "creator_projects"), ("backed", "backings")):
+            cur.executemany(f"INSERT OR IGNORE INTO {table} VALUES (?, ?)",
+                            [(row["creator_id"], row["url"]) for row in rows if row["relation"] == relation])
+        con.commit()
+
+def migrate_deleted_creators(src, con):
+    """
+    Migrates the deleted_creators table of src.
+
+    src [sqlite3.Connection] - Connection to the source database.
+    con [sqlite3.Connection] - Connection to the normalized database.
+    """
+    if not has_table(src, "deleted_creators"):
+        return
+    for rows in iter_batches(src.cursor(), "SELECT creator_id FROM deleted_creators"):
+        con.executemany("INSERT INTO creators (creator_id, deleted) VALUES (?, 1) ON CONFLICT(creator_id) DO NOTHING",
+                        [(str(row["creator_id"]),) for row in rows])
+        con.commit()
+
+if __name__ == "__main__":
+    main()
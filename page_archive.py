@@ -0,0 +1,180 @@
+import os
+import gzip
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+# Settings.
+
+# Set to True to store fetched pages, e.g. to REPLAY them later. Storing serializes, hashes and
+# compresses every page, which costs a worker about as much as parsing it.
+ENABLED = False
+# Folder for the archive. Holds index.db and the compressed objects.
+ARCHIVE_PATH = r"D:\page_archive"
+# Maximum total size of the compressed objects in bytes. Least recently used objects are
+# evicted once it is exceeded.
+MAX_BYTES = 50 * 1024 ** 3
+# Fraction of MAX_BYTES eviction frees down to so it doesn't run on every store.
+EVICT_TO = 0.9
+# Number of stores by a process between archive size checks.
+EVICT_EVERY = 500
+# gzip compression level.
+COMPRESS_LEVEL = 6
+
+# Connection of the current process and the pid it was made in.
+_con = None
+_pid = None
+# Number of stores by the current process.
+_stores = 0
+
+def get_connection():
+    """Returns this process's connection to the archive index, creating the archive if needed."""
+    global _con, _pid
+    if _con == None or _pid != os.getpid():
+        os.makedirs(os.path.join(ARCHIVE_PATH, "objects"), exist_ok=True)
+        _con = sqlite3.connect(os.path.join(ARCHIVE_PATH, "index.db"), timeout=60)
+        _pid = os.getpid()
+        _con.execute("PRAGMA journal_mode=WAL")
+        _con.execute("PRAGMA synchronous=NORMAL")
+
+        # One row per fetch with WARC style response record fields.
+        _con.execute("""CREATE TABLE IF NOT EXISTS records(
+                    record_id TEXT PRIMARY KEY,
+                    target_uri TEXT NOT NULL,
+                    page_type TEXT,
+                    warc_date TEXT,
+                    fetched_at REAL,
+                    payload_digest TEXT,
+                    content_type TEXT,
+                    content_length INTEGER
+                    )""")
+        _con.execute("CREATE INDEX IF NOT EXISTS records_target ON records(target_uri, page_type, fetched_at)")
+        _con.execute("CREATE INDEX IF NOT EXISTS records_digest ON records(payload_digest)")
+
+        # One row per stored object. size is the compressed size.
+        _con.execute("""CREATE TABLE IF NOT EXISTS objects(
+                    digest TEXT PRIMARY KEY,
+                    size INTEGER,
+                    last_access REAL
+                    )""")
+        _con.execute("CREATE INDEX IF NOT EXISTS objects_last_access ON objects(last_access)")
+        _con.commit()
+    return _con
+
+def object_path(digest):
+    """Returns the path of the object with a sha256 hex digest."""
+    return os.path.join(ARCHIVE_PATH, "objects", digest[:2], digest + ".gz")
+
+def store(url, content, page_type="page", content_type="text/html"):
+    """
+    Stores content fetched from url and returns its sha256 digest. Identical content is only
+    stored once.
+
+    url [str] - Url the content was fetched from.
+    content [str] - Page source or other response body.
+    page_type [str] - Kind of content e.g. campaign or rewards. Used to tell apart different
+    content stored for the same url. "page" by default.
+    content_type [str] - Mime type of content. "text/html" by default.
+    """
+    global _stores
+    con = get_connection()
+    data = content.encode("utf8")
+    digest = hashlib.sha256(data).hexdigest()
+
+    path = object_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(temp_path, "wb", compresslevel=COMPRESS_LEVEL) as f_obj:
+            f_obj.write(data)
+        os.replace(temp_path, path)
+
+    now = time.time()
+    con.execute("INSERT INTO objects VALUES (?, ?, ?) ON CONFLICT(digest) DO UPDATE SET last_access = excluded.last_access",
+                (digest, os.path.getsize(path), now))
+    con.execute("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (f"<urn:uuid:{uuid.uuid4()}>", url, page_type, datetime.fromtimestamp(now, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                 now, "sha256:" + digest, content_type, len(data)))
+    con.commit()
+
+    _stores += 1
+    if _stores % EVICT_EVERY == 0:
+        evict()
+    return digest
+
+def has(url, page_type="page"):
+    """Returns True if content of page_type from url is archived."""
+    return get_connection().execute("SELECT 1 FROM records WHERE target_uri = ? AND page_type = ?", (url, page_type)).fetchone() != None
+
+def load(url, page_type="page", before=None):
+    """
+    Returns the latest archived content of page_type fetched from url or None if there is none.
+
+    url [str] - Url the content was fetched from.
+    page_type [str] - Kind of content. "page" by default.
+    before [float] - If given, only content fetched before this unix time is returned. None by default.
+    """
+    con = get_connection()
+    row = con.execute("""SELECT payload_digest FROM records WHERE target_uri = ? AND page_type = ? AND fetched_at < ?
+                      ORDER BY fetched_at DESC LIMIT 1""", (url, page_type, before if before != None else float("inf"))).fetchone()
+    if row == None:
+        return
+
+    digest = row[0].split(":", 1)[1]
+    try:
+        with gzip.open(object_path(digest), "rb") as f_obj:
+            data = f_obj.read()
+    except FileNotFoundError:
+        return
+
+    con.execute("UPDATE objects SET last_access = ? WHERE digest = ?", (time.time(), digest))
+    con.commit()
+    return data.decode("utf8")
+
+def iter_urls(page_type="page"):
+    """Yields every url with archived content of page_type."""
+    cur = get_connection().cursor()
+    cur.execute("SELECT DISTINCT target_uri FROM records WHERE page_type = ?", (page_type,))
+    while True:
+        rows = cur.fetchmany(1000)
+        if not rows:
+            break
+        for row in rows:
+            yield row[0]
+
+def evict(max_bytes=None):
+    """
+    Deletes least recently used objects and their records until the archive is at most
+    EVICT_TO of max_bytes. Does nothing if the archive is not larger than max_bytes. Returns
+    the number of objects deleted.
+
+    max_bytes [int] - Size limit in bytes. MAX_BYTES by default.
+    """
+    if max_bytes == None:
+        max_bytes = MAX_BYTES
+    con = get_connection()
+    total = con.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+    if total <= max_bytes:
+        return 0
+
+    evicted = []
+    for digest, size in con.execute("SELECT digest, size FROM objects ORDER BY last_access"):
+        if total <= max_bytes * EVICT_TO:
+            break
+        evicted.append(digest)
+        total -= size
+
+    con.executemany("DELETE FROM records WHERE payload_digest = ?", [("sha256:" + digest,) for digest in evicted])
+    con.executemany("DELETE FROM objects WHERE digest = ?", [(digest,) for digest in evicted])
+    con.commit()
+    for digest in evicted:
+        try:
+            os.remove(object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    logging.info(f"Evicted {len(evicted)} pages from the archive.")
+    return len(evicted)
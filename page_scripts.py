@@ -0,0 +1,126 @@
+# Javascript run in scraping browsers through execute_script. Scripts return
+# plain JSON values so only the needed fields cross the webdriver connection
+# instead of the whole serialized DOM. Selectors must be kept in sync with the
+# bs4 versions in project_data_extractor.py.
+
+# Helpers shared by the scripts below.
+_HELPERS = """
+const text = (root, selector) => {
+    const elem = root ? root.querySelector(selector) : null;
+    return elem ? elem.textContent : null;
+};
+const attr = (root, selector, name) => {
+    const elem = root ? root.querySelector(selector) : null;
+    return elem ? elem.getAttribute(name) : null;
+};
+const count = (root, selector) => root ? root.querySelectorAll(selector).length : 0;
+"""
+
+# Returns {hidden, captcha, deleted} flags for the loaded page.
+PAGE_STATUS_JS = """
+return {
+    hidden: document.querySelector('div[id="hidden_project"]') !== null,
+    captcha: document.querySelector('div[id="px-captcha"]') !== null,
+    deleted: document.querySelector('div[class="center"]') !== null
+             || document.querySelector('a[href="/?ref=404-ksr10"]') !== null,
+};
+"""
+
+# Returns the same dict as project_data_extractor.get_campaign_fields.
+CAMPAIGN_FIELDS_JS = _HELPERS + """
+const content = document.querySelector('div[id="content-wrap"]');
+const description = document.querySelector('div[class="story-content"]');
+const pastCollab = document.querySelector('p[class="col col-12"]');
+const singleCollab = document.querySelector('[class="flag col col-4 mb3"] > div[class="flag-body"]');
+
+let singleCollaborator = null;
+if (singleCollab) {
+    const a = singleCollab.querySelector('a');
+    singleCollaborator = [a.textContent, a.getAttribute('href'), singleCollab.querySelector('div').textContent];
+}
+
+return {
+    og_url: attr(document, 'meta[property="og:url"]', 'content'),
+    meta_description: attr(document, 'meta[name="description"]', 'content'),
+    data_initial: attr(document, 'div[data-initial]', 'data-initial'),
+    identity_name: text(document, 'span[class="identity_name"]'),
+    past_collaborators: pastCollab
+        ? Array.from(pastCollab.querySelectorAll('a')).map(a => [a.textContent, a.getAttribute('href')])
+        : [],
+    single_collaborator: singleCollaborator,
+    num_photos: count(content, 'img[class="js-feature-image"]') + count(description, 'img'),
+    num_videos: count(content, 'video[preload="none"]') + count(content, 'div[class="embedly-card-hug"]'),
+    created_backed_text: text(document, '[class="created-projects py2 f5 mb3"]'),
+    comments_count: attr(document, "a[id='comments-emoji']", 'data-comments-count'),
+    updates_count: attr(document, "a[id='updates-emoji']", 'emoji-data'),
+    faqs_count: attr(document, "a[id='faq-emoji']", 'emoji-data'),
+    description: description ? description.textContent : null,
+    risk: text(document, 'p[class="js-risks-text text-preline"]'),
+};
+"""
+
+# Returns a list with the same dicts as project_data_extractor.get_pledge_fields
+# for every reward on a rewards page.
+REWARD_FIELDS_JS = _HELPERS + """
+return Array.from(document.querySelectorAll('article[data-test-id]')).map(tag => {
+    const itemList = tag.querySelector('[class="flex flex-column gap1"]');
+    const limitHeading = Array.from(tag.querySelectorAll('h3')).find(h => h.textContent.includes('Limited quantity'));
+    const limitElem = limitHeading ? limitHeading.nextElementSibling : null;
+    return {
+        id: tag.getAttribute('id'),
+        title: text(tag, '[class="support-700 semibold type-18 m0 mr1 text-wrap-balance break-word"]'),
+        price: text(tag, '[class="support-700 type-18 m0 shrink0"]'),
+        description: text(tag, '[class="type-14 lh20px mb0 support-700 text-prewrap"]'),
+        items: itemList
+            ? Array.from(itemList.querySelectorAll('[class="border border-support-700 mb3 py3 px3 radius4px clip"]')).map(e => e.textContent)
+            : null,
+        delivery_date: attr(tag, 'time[datetime]', 'datetime'),
+        shipping_location: text(tag, 'div[class="flex1"] > div[class="type-14 lh20px mb0 support-700"]'),
+        backers: text(tag, 'span[aria-label]'),
+        limit: limitElem ? limitElem.textContent : null,
+    };
+});
+"""
+
+# Fetches urls from inside the page with at most limit requests in flight so the
+# browser's cookies and session are reused. Each finished page is parsed in the
+# browser and only {status, captcha, last, next, items} is kept in window[key][url],
+# where items are the attribute values of the elements matching selector. Results
+# are collected with POLL_PAGES_JS.
+FETCH_PAGES_JS = """
+const [urls, key, selector, attribute, limit] = arguments;
+window[key] = {};
+const queue = urls.slice();
+const fetchPage = async (url) => {
+    try {
+        const response = await fetch(url, {credentials: 'include', headers: {'X-Requested-With': 'XMLHttpRequest'}});
+        const doc = new DOMParser().parseFromString(await response.text(), 'text/html');
+        const next = doc.querySelector('a[rel="next"]');
+        window[key][url] = {
+            status: response.status,
+            captcha: doc.querySelector('div[id="px-captcha"]') !== null,
+            last: doc.querySelector('li[data-last_page="true"]') !== null,
+            next: next ? next.getAttribute('href') : null,
+            items: Array.from(doc.querySelectorAll(selector)).map(e => e.getAttribute(attribute)),
+        };
+    } catch (error) {
+        window[key][url] = {status: 0, error: String(error), captcha: false, last: false, next: null, items: []};
+    }
+};
+const worker = async () => {
+    while (queue.length) {
+        await fetchPage(queue.shift());
+    }
+};
+for (let i = 0; i < limit; i++) {
+    worker();
+}
+"""
+
+# Returns and forgets the pages finished since the last call for a FETCH_PAGES_JS key.
+POLL_PAGES_JS = """
+const key = arguments[0];
+const done = window[key] || {};
+window[key] = {};
+return done;
+"""
@@ -0,0 +1,77 @@
+# Works out which input ids still need scraping inside sqlite instead of loading
+# every finished id into Python sets.
+
+# Settings.
+
+# Number of ids inserted per statement batch.
+LOAD_BATCH_SIZE = 10000
+
+def load_ids(con, ids):
+    """
+    Loads ids into the temporary table input_ids of con, keeping their order.
+
+    con [sqlite3.Connection] - A database connection.
+    ids [iterable] - Input ids. Stored as TEXT.
+    """
+    cur = con.cursor()
+    cur.execute("DROP TABLE IF EXISTS temp.input_ids")
+    cur.execute("CREATE TEMP TABLE input_ids(position INTEGER PRIMARY KEY, id TEXT NOT NULL)")
+
+    batch = []
+    for id_ in ids:
+        batch.append((str(id_),))
+        if len(batch) == LOAD_BATCH_SIZE:
+            cur.executemany("INSERT INTO input_ids (id) VALUES (?)", batch)
+            batch.clear()
+    cur.executemany("INSERT INTO input_ids (id) VALUES (?)", batch)
+    con.commit()
+
+def compute_pending(con, exclusions):
+    """
+    Stores the ids of input_ids which are not found in any of the excluded columns in the
+    temporary table pending and returns how many there are. Each excluded column should be
+    indexed so every lookup is an index search.
+
+    con [sqlite3.Connection] - A database connection with input_ids loaded.
+    exclusions [list] - (table, column) tuples of ids to skip.
+    """
+    not_exists = " AND ".join(f"NOT EXISTS (SELECT 1 FROM {table} WHERE {table}.{column} = i.id)" for table, column in exclusions)
+    cur = con.cursor()
+    cur.execute("DROP TABLE IF EXISTS temp.pending")
+    cur.execute("CREATE TEMP TABLE pending(position INTEGER PRIMARY KEY, id TEXT NOT NULL)")
+    cur.execute(f"INSERT INTO pending SELECT position, id FROM input_ids i WHERE {not_exists or '1'}")
+    cur.execute("DROP TABLE input_ids")
+    con.commit()
+    return cur.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+def add_pending(con, select_ids_sql, params=()):
+    """
+    Adds the ids returned by select_ids_sql to the end of pending if they aren't already in it
+    and returns how many were added.
+
+    con [sqlite3.Connection] - A database connection with pending computed.
+    select_ids_sql [str] - A SELECT statement returning one column of ids.
+    params [tuple] - Parameters of select_ids_sql. Empty by default.
+    """
+    changes = con.total_changes
+    con.execute(f"""WITH new(id) AS ({select_ids_sql})
+                      INSERT INTO pending (id) SELECT DISTINCT CAST(id AS TEXT) FROM new
+                      WHERE CAST(id AS TEXT) NOT IN (SELECT id FROM pending)""", params)
+    con.commit()
+    return con.total_changes - changes
+
+def iter_pending(con, batch_size):
+    """
+    Yields lists of at most batch_size pending ids in input order. Each batch is read with its
+    own short query so no read transaction stays open while the ids are being worked on.
+
+    con [sqlite3.Connection] - A database connection with pending computed.
+    batch_size [int] - Number of ids per list.
+    """
+    position = -1
+    while True:
+        rows = con.execute("SELECT position, id FROM pending WHERE position > ? ORDER BY position LIMIT ?", (position, batch_size)).fetchall()
+        if not rows:
+            break
+        position = rows[-1][0]
+        yield [id_ for _, id_ in rows]
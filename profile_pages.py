@@ -0,0 +1,135 @@
+import re
+import json
+import time
+import uuid
+import logging
+
+import page_scripts
+import metrics
+import worker_session
+
+# Settings.
+
+# Maximum number of pages fetched at the same time by one browser.
+MAX_CONCURRENT_PAGES = 5
+# Seconds to wait for the next page to finish before giving up.
+PAGE_TIMEOUT = 60
+# Seconds between checks for finished pages.
+POLL_INTERVAL = 0.2
+# Response statuses which mean the egress is blocked.
+BLOCKED_STATUSES = {403, 429}
+
+def fetch_pages(driver, urls, selector, attribute):
+    """
+    Fetches urls concurrently from inside the page loaded in driver and yields (url, result)
+    tuples as soon as each page finishes. result is a dict with the response status, whether
+    it had a captcha ("captcha"), whether it was the last page of an infinite scroll list ("last"),
+    the href of its next page link or None ("next") and a list of the values of attribute for
+    every element matching selector ("items"). Raises a worker_session.BlockedError on captchas and
+    403 or 429 responses and an Exception on other failed requests.
+
+    driver [selenium webdriver] - A webdriver with a kickstarter page loaded.
+    urls [list] - Urls to fetch.
+    selector [str] - A css selector.
+    attribute [str] - Attribute to extract from elements matching selector.
+    """
+    key = "__ks_pages_" + uuid.uuid4().hex
+    driver.execute_script(page_scripts.FETCH_PAGES_JS, list(urls), key, selector, attribute, MAX_CONCURRENT_PAGES)
+
+    remaining = set(urls)
+    deadline = time.time() + PAGE_TIMEOUT
+    while remaining:
+        done = driver.execute_script(page_scripts.POLL_PAGES_JS, key)
+        if not done:
+            if time.time() > deadline:
+                raise Exception(f"Timed out fetching {len(remaining)} pages.")
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        deadline = time.time() + PAGE_TIMEOUT
+        for url, result in done.items():
+            remaining.discard(url)
+            metrics.inc("pages_total", page="profile_list")
+            if result["captcha"]:
+                metrics.inc("captchas_total")
+                raise worker_session.BlockedError("Captcha encountered.")
+            if result["status"] in BLOCKED_STATUSES:
+                raise worker_session.BlockedError(f"Blocked fetching {url} ({result['status']}).")
+            if result["status"] == 0 or result["status"] >= 400:
+                raise Exception(f"Failed to fetch {url} ({result['status']} {result.get('error', '')}).")
+            yield url, result
+
+def get_page_count(soup):
+    """
+    Returns the number of pages of a paginated kickstarter list from the page links in
+    its first page. Returns 1 if there are no page links.
+
+    soup [bs4.BeautifulSoup] - Soup of the first page.
+    """
+    page_count = 1
+    for elem in soup.select('a[href*="page="]'):
+        match = re.search(r'[?&]page=(\d+)', elem['href'])
+        if match != None:
+            page_count = max(page_count, int(match.group(1)))
+    return page_count
+
+def iter_created_data_projects(driver, created_url, first_soup):
+    """
+    Yields every kickstarter data project dict from a creator's created projects pages. The first
+    page is taken from first_soup and the remaining pages are fetched concurrently and parsed as
+    they arrive without keeping their soups.
+
+    driver [selenium webdriver] - A webdriver with the first created page loaded.
+    created_url [str] - Link to the creator's created page e.g. https://www.kickstarter.com/profile/123/created.
+    first_soup [bs4.BeautifulSoup] - Soup of the first created page.
+    """
+    created_project_elem = first_soup.select_one('div[data-projects]')
+    yield from json.loads(created_project_elem['data-projects'])
+
+    page_count = get_page_count(first_soup)
+    if page_count > 1:
+        urls = [f"{created_url}?page={page}" for page in range(2, page_count + 1)]
+        for url, result in fetch_pages(driver, urls, 'div[data-projects]', 'data-projects'):
+            for data_projects in result["items"]:
+                yield from json.loads(data_projects)
+        return
+
+    # Page count was not shown so follow next links one page at a time.
+    next_elem = first_soup.select_one('a[rel="next"]')
+    next_href = next_elem['href'] if next_elem != None else None
+    while next_href != None:
+        logging.info(f"No page count for {created_url}. Following next link...")
+        next_url = "https://www.kickstarter.com/" + next_href.lstrip("/")
+        for url, result in fetch_pages(driver, [next_url], 'div[data-projects]', 'data-projects'):
+            for data_projects in result["items"]:
+                yield from json.loads(data_projects)
+            next_href = result["next"]
+
+def iter_backed_data_projects(driver, profile_url):
+    """
+    Yields every kickstarter data project dict from a creator's backed projects list. Instead of
+    scrolling, the list pages the profile page loads while scrolling are fetched directly,
+    MAX_CONCURRENT_PAGES at a time, until the last page is reached.
+
+    driver [selenium webdriver] - A webdriver with a kickstarter page loaded.
+    profile_url [str] - Link to the creator's profile e.g. https://www.kickstarter.com/profile/123.
+    """
+    seen = set()
+    page = 1
+    while True:
+        urls = [f"{profile_url}?page={i}" for i in range(page, page + MAX_CONCURRENT_PAGES)]
+        done = False
+        for url, result in fetch_pages(driver, urls, 'div[data-project]', 'data-project'):
+            for item in result["items"]:
+                data_project = json.loads(item)
+                # Pages past the last page may repeat it.
+                if data_project['id'] in seen:
+                    continue
+                seen.add(data_project['id'])
+                yield data_project
+            if result["last"] or not result["items"]:
+                done = True
+
+        if done:
+            break
+        page += MAX_CONCURRENT_PAGES
@@ -0,0 +1,244 @@
+import os
+import sys
+import glob
+import json
+import time
+import random
+import pstats
+import cProfile
+import logging
+import functools
+import threading
+import multiprocessing.util
+
+# Settings.
+
+# Set to True to profile a fraction of the tasks of every worker.
+ENABLED = False
+# "cprofile" to trace every call of a profiled task or "sampling" to record its stack every
+# SAMPLE_INTERVAL seconds. Sampling costs far less and is the one to leave on in production.
+MODE = "sampling"
+# Fraction of tasks profiled.
+TASK_FRACTION = 0.05
+# Seconds between stack samples.
+SAMPLE_INTERVAL = 0.005
+# Folder for per process profiles and the merged report.
+PROFILE_PATH = "profiles"
+# Minimum seconds between profile writes of a process.
+DUMP_SECONDS = 30
+# Number of functions listed in the text report.
+REPORT_LINES = 40
+
+# Profiles of the current process. _stats holds the merged cProfile stats and _folded the
+# microseconds each stack was seen for, keyed by the frames joined with ";" from the task down.
+_lock = threading.Lock()
+_pid = None
+_stats = None
+_folded = {}
+_tasks = 0
+_last_dump = 0
+# Frame which called the task of each thread running a sampled task.
+_active = {}
+_sampler = None
+
+def _check_process():
+    """Clears profiles inherited from a parent process and registers the exit dump. Must be
+    called with _lock held."""
+    global _pid, _stats, _tasks, _last_dump, _sampler
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _stats = None
+        _folded.clear()
+        _active.clear()
+        _tasks = 0
+        _sampler = None
+        _last_dump = time.time()
+        # Finalizers also run when pool workers exit, unlike atexit handlers.
+        multiprocessing.util.Finalize(None, dump, exitpriority=0)
+
+def frame_name(frame):
+    """Returns the name of a frame in folded stacks e.g. project_data_extractor:get_pledge_data."""
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+def _sample():
+    last = time.perf_counter()
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        frames = sys._current_frames()
+        # Samples are weighted by the time since the previous one since the sampler waits for
+        # the GIL and can't keep to SAMPLE_INTERVAL while tasks run python code.
+        now = time.perf_counter()
+        weight = round((now - last) * 1e6)
+        last = now
+        with _lock:
+            if _pid != os.getpid():
+                return
+            for thread_id, entry in _active.items():
+                frame = frames.get(thread_id)
+                if frame == None:
+                    continue
+                stack = []
+                # Only the task's own frame and the frames below it are kept.
+                while frame != None and frame is not entry:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                _folded[key] = _folded.get(key, 0) + weight
+
+def _run_sampled(function, args, kwargs):
+    global _sampler
+    thread_id = threading.get_ident()
+    with _lock:
+        if thread_id in _active:
+            # Already inside a sampled task.
+            return function(*args, **kwargs)
+        if _sampler == None:
+            _sampler = threading.Thread(target=_sample, daemon=True)
+            _sampler.start()
+        _active[thread_id] = sys._getframe()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        with _lock:
+            _active.pop(thread_id, None)
+
+def _run_traced(function, args, kwargs):
+    global _stats
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Another thread of this process is being traced and only one tracer can be active.
+        return function(*args, **kwargs)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profile.disable()
+        with _lock:
+            if _stats == None:
+                _stats = pstats.Stats(profile)
+            else:
+                _stats.add(profile)
+
+def profiled(function):
+    """
+    Decorator for the task functions run by pool workers and threads. Profiles a TASK_FRACTION
+    of the calls when ENABLED and otherwise only calls function.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        global _tasks
+        if not ENABLED or random.random() >= TASK_FRACTION:
+            return function(*args, **kwargs)
+        with _lock:
+            _check_process()
+            _tasks += 1
+        try:
+            if MODE == "cprofile":
+                return _run_traced(function, args, kwargs)
+            return _run_sampled(function, args, kwargs)
+        finally:
+            if time.time() - _last_dump >= DUMP_SECONDS:
+                dump()
+    return wrapper
+
+def dump():
+    """Writes the profiles of this process to PROFILE_PATH."""
+    global _last_dump
+    with _lock:
+        if _pid != os.getpid():
+            return
+        _last_dump = time.time()
+        data = {"pid": _pid, "mode": MODE, "tasks": _tasks, "folded": dict(_folded)}
+        stats = _stats
+
+    os.makedirs(PROFILE_PATH, exist_ok=True)
+    path = os.path.join(PROFILE_PATH, f"proc-{data['pid']}")
+    if stats != None:
+        with _lock:
+            stats.dump_stats(path + ".prof.tmp")
+        os.replace(path + ".prof.tmp", path + ".prof")
+    with open(path + ".json.tmp", "w") as f_obj:
+        json.dump(data, f_obj)
+    os.replace(path + ".json.tmp", path + ".json")
+
+def start():
+    """Removes the profiles of earlier runs. Called once by the parent process before starting
+    workers."""
+    if not ENABLED:
+        return
+    for path in glob.glob(os.path.join(PROFILE_PATH, "proc-*")):
+        os.remove(path)
+
+def merge():
+    """Returns (merged pstats.Stats or None, folded stack microseconds, profiled tasks) over
+    every process profile in PROFILE_PATH."""
+    stats = None
+    for path in glob.glob(os.path.join(PROFILE_PATH, "proc-*.prof")):
+        try:
+            if stats == None:
+                stats = pstats.Stats(path)
+            else:
+                stats.add(path)
+        except (OSError, EOFError, TypeError, ValueError):
+            continue
+
+    folded = {}
+    tasks = 0
+    for path in glob.glob(os.path.join(PROFILE_PATH, "proc-*.json")):
+        try:
+            with open(path) as f_obj:
+                data = json.load(f_obj)
+        except (OSError, ValueError):
+            continue
+        tasks += data["tasks"]
+        for stack, count in data["folded"].items():
+            folded[stack] = folded.get(stack, 0) + count
+    return stats, folded, tasks
+
+def summarize_folded(folded, lines=REPORT_LINES):
+    """Returns a text table of the functions with the most self time (the function was running)
+    and their total time (it was on the stack) in seconds."""
+    own, inclusive = {}, {}
+    for stack, count in folded.items():
+        frames = stack.split(";")
+        own[frames[-1]] = own.get(frames[-1], 0) + count
+        for frame in set(frames):
+            inclusive[frame] = inclusive.get(frame, 0) + count
+
+    total = sum(folded.values())
+    rows = [f"{total / 1e6:.1f}s sampled.",
+            f"{'self s':>10} {'self %':>7} {'total s':>10} {'total %':>7}  function"]
+    for frame in sorted(inclusive, key=lambda frame: (own.get(frame, 0), inclusive[frame]), reverse=True)[:lines]:
+        rows.append(f"{own.get(frame, 0) / 1e6:10.2f} {own.get(frame, 0) / total:7.1%} "
+                    f"{inclusive[frame] / 1e6:10.2f} {inclusive[frame] / total:7.1%}  {frame}")
+    return "\n".join(rows) + "\n"
+
+def report():
+    """
+    Merges the profiles of every process and writes profile.txt (hottest functions) to
+    PROFILE_PATH, together with profile.pstats for cprofile mode (readable with pstats or
+    snakeviz) and profile.folded for sampling mode (readable with flamegraph.pl or speedscope).
+    Called once by the parent process after its workers have exited.
+    """
+    if not ENABLED:
+        return
+    dump()
+    stats, folded, tasks = merge()
+    os.makedirs(PROFILE_PATH, exist_ok=True)
+
+    with open(os.path.join(PROFILE_PATH, "profile.txt"), "w") as f_obj:
+        f_obj.write(f"{tasks} profiled tasks.\n\n")
+        if stats != None:
+            stats.dump_stats(os.path.join(PROFILE_PATH, "profile.pstats"))
+            stats.stream = f_obj
+            stats.sort_stats("cumulative").print_stats(REPORT_LINES)
+        if folded:
+            f_obj.write(summarize_folded(folded))
+
+    if folded:
+        with open(os.path.join(PROFILE_PATH, "profile.folded"), "w") as f_obj:
+            for stack, count in sorted(folded.items()):
+                f_obj.write(f"{stack} {count}\n")
+    logging.info(f"Profiled {tasks} tasks. Report written to {os.path.join(PROFILE_PATH, 'profile.txt')}.")
@@ -10,14 +10,23 @@ import os
 import csv
 import traceback 
 
-import undetected_chromedriver as uc
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-import pyautogui
 from bs4 import BeautifulSoup
-import pandas as pd
+
+import browser_profile
+import page_scripts
+import network_capture
+import job_queue
+import page_archive
+import refresh_scheduler
+import change_history
+import metrics
+import db_writer
+import egress_pool
+import worker_session
+import profiling
+import tracing
+import coordinator
+import sharding
 
 # Settings.
 
@@ -26,6 +35,8 @@ DATA_PATH = r"D:\scraping_projects_1.csv"
 # Output path.
 OUTPUT_PATH = r"D:\\"
 DATABASE = os.path.join(OUTPUT_PATH, "new_projects.db")
+# Output database used in replay mode.
+REPLAY_DATABASE = os.path.join(OUTPUT_PATH, "replayed_projects.db")
 # Chromedriver path
 CHROMEDRIVER_PATH = r"C:\Users\jaber\OneDrive\Desktop\Research_JaberChowdhury\Kickstarter-Data-Scraper\chromedriver.exe"
 
@@ -39,54 +50,107 @@ TESTING = 0
 chunk_size = 10
 # Proton vpn windows taskbar location.
 icon_num = 5 
+# Set to True to extract fields with javascript inside the browser instead of
+# parsing the page source with bs4. The page source is still read if page_archive.ENABLED
+# is set, which undoes most of the savings.
+IN_BROWSER = False
+# Set to True to read creator counts and rewards from the JSON responses the pages
+# request themselves instead of waiting for them to render.
+CAPTURE_NETWORK = False
+# Set to True to extract from pages stored by page_archive instead of scraping them. Results
+# are written to REPLAY_DATABASE and projects that were never archived are skipped. Pages are
+# only archived by runs with page_archive.ENABLED set.
+REPLAY = False
 
 # Script.
 
-# Lock to prevent multiple processes from trying to access database.
-db_lock = multiprocessing.Lock()
-
 def main():
-    pool = multiprocessing.Pool()
+    # Every shard writes its own database, merged afterwards with shard_merge.
+    database = sharding.shard_path(REPLAY_DATABASE if REPLAY else DATABASE)
+    metrics.start_exporter()
+    profiling.start()
+    tracing.start()
     click_random(icon_num)
-
-    # Get projects to scrape.
-    f_obj = open(DATA_PATH, encoding="utf8", newline='')
-    reader = csv.DictReader(f_obj)
-
-    total = 0
-    Done = False
-    while not Done:
-        # Get at maximum chunk_size number rows as a list per iteration.
-        rows = get_rows(reader, DATABASE, chunk_size)
-
-        try:
-            pool.map(scrape_write, rows)
-        except Exception:
-            logging.info(f"\nException -\n {traceback.format_exc()} \nRetrying...")
-
-            # Reopen reader so unscraped rows will get added in next iteration.
-            f_obj.close()
-            f_obj = open(DATA_PATH, encoding="utf8", newline='')
-            reader = csv.DictReader(f_obj)
-            
-            click_random(icon_num)
-            time.sleep(30)
-
-        # Scraping complete since there aren't enough rows left to reach chunk_size.
-        if len(rows) < chunk_size:
-            Done = True
-        if len(rows) == 0:
+    # Spread workers over the egress pool if one is configured.
+    if egress_pool.ENABLED:
+        egress_pool.reset()
+        egress_pool.probe_all()
+
+    # Load projects to scrape into the jobs table. Only done again if DATA_PATH changes. Jobs
+    # are claimed from the coordinator instead if one is set.
+    client = coordinator.Client() if coordinator.ADDRESS != None else None
+    con = create_new_projects_db(database)
+    job_queue.create_jobs_table(con)
+    refresh_scheduler.create_visits_table(con)
+    change_history.create_history_tables(con)
+    if client == None and not job_queue.is_loaded(con, DATA_PATH):
+        logging.info("Loading projects to scrape...")
+        with open(DATA_PATH, encoding="utf8", newline='') as f_obj:
+            job_queue.load_jobs(con, DATA_PATH, sharding.select(csv.DictReader(f_obj), lambda row: row["url"]), "url")
+        job_queue.mark_done(con, "SELECT rd_project_link FROM projects UNION SELECT url FROM hidden_projects")
+    # Resume jobs this host had claimed before a restart.
+    job_queue.release_leases(con)
+    if client == None:
+        logging.info(f"{refresh_scheduler.enqueue_due_projects(con)} projects are due for a revisit.")
+
+    # Workers send their rows to a single writer process.
+    writer = db_writer.start_writer(database)
+    pool = multiprocessing.Pool(initializer=db_writer.init_worker, initargs=(writer.queue,))
+
+    while True:
+        # Claim at maximum chunk_size jobs per iteration.
+        if client != None:
+            jobs, wait, pending = client.claim(chunk_size)
+        else:
+            jobs = job_queue.claim_jobs(con, chunk_size)
+        if len(jobs) == 0:
+            if client == None:
+                # Revisit projects which became due while scraping.
+                if refresh_scheduler.enqueue_due_projects(con) > 0:
+                    continue
+                # Wait for failed jobs to finish their backoff.
+                wait = job_queue.seconds_until_retry(con)
+            if wait == None:
+                break
+            time.sleep(min(wait, 60))
             continue
-        
-        # Stop scraping for a period of time to not be blocked as a bot.
-        total += chunk_size
-        if total % (chunk_size * 10) == 0:
-            logging.info("Changing server...\n")
-            click_random(icon_num)
-
-    f_obj.close()
+
+        results = pool.map(scrape_write_job, [row for key, row in jobs])
+        # Make sure the rows are committed before their jobs are marked done. Only failed jobs
+        # are retried, including jobs whose rows the writer failed to write.
+        failed = db_writer.flush(writer)
+        results = [(job_queue.TRANSIENT, "A write of the job failed in the db_writer.")
+                   if key in failed and outcome not in (job_queue.TRANSIENT, job_queue.PERMANENT) else (outcome, error)
+                   for (key, row), (outcome, error) in zip(jobs, results)]
+        for (key, row), (outcome, error) in zip(jobs, results):
+            if client == None:
+                job_queue.finish_job(con, key, outcome, error)
+            metrics.inc("items_total", script="project", outcome=outcome)
+            if error != None:
+                metrics.inc("errors_total", script="project")
+        if client != None:
+            client.finish([(key, outcome, error) for (key, row), (outcome, error) in zip(jobs, results)])
+        else:
+            pending = con.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        metrics.set_gauge("queue_depth", pending, queue="jobs")
+
+        # Workers replace their own browsers when they are blocked or reach their request budget.
+        # Without an egress pool a new IP needs the VPN switch, which pauses every worker.
+        errors = [error for outcome, error in results if outcome == job_queue.TRANSIENT]
+        if errors:
+            logging.info(f"\nException -\n {errors[0]} \nRetrying later...")
+            if not egress_pool.ENABLED:
+                click_random(icon_num)
+                time.sleep(30)
+
+    if client != None:
+        client.close()
+    con.close()
     pool.close()
     pool.join()
+    db_writer.stop_writer(writer)
+    metrics.stop_exporter()
+    profiling.report()
 
     # logging.info("Writing data to file...")
 
@@ -108,33 +172,11 @@ def test_extract_campaign_data():
     pool.close()
     pool.join()
 
+    import pandas as pd
+
     df = pd.DataFrame(data)
     df.to_csv('test.csv', index = False)
 
-def get_rows(reader, database, n_rows):
-    """Returns n rows from csv reader while making sure they weren't already scraped by checking in database."""
-    rows = []
-    # Get already scraped urls.
-    con = create_new_projects_db(database)
-    cur = con.cursor()
-    scraped_urls = set(url[0] for url in cur.execute("SELECT rd_project_link FROM projects;")) 
-    scraped_urls |= set(url[0] for url in cur.execute("SELECT url FROM hidden_projects;")) 
-    con.close()
-    
-    # Get n rows which haven't been scraped if there are enough remaining rows.
-    while len(rows) != n_rows:
-        try:
-            row = next(reader)
-        except StopIteration:
-            break
-
-        if row['url'] in scraped_urls:
-            continue
-        else:
-            rows.append(row)
-    
-    return rows
-
 def click_random(icon_num, wait=True):
     """
     Clicks random button in proton vpn. Proton VPN needs
@@ -144,6 +186,13 @@ def click_random(icon_num, wait=True):
     wait [bool] - If True, function will sleep for 10s to make sure Proton Vpn
     connects and otherwise it will not sleep. True by default.
     """
+    # Nothing is fetched in replay mode and workers rotate their own egress if there is a pool.
+    if REPLAY or egress_pool.ENABLED:
+        return
+    import pyautogui
+
+    pyautogui.PAUSE = 1
+    pyautogui.FAILSAFE = True
     pyautogui.hotkey('win', str(icon_num))
     pyautogui.click(333, 563, clicks=3, interval=0.15)
     time.sleep(2)
@@ -157,7 +206,7 @@ def create_new_projects_db(database):
     
     path[str] - Location to save/load database
     """
-    con = sqlite3.connect(database)
+    con = sqlite3.connect(database, timeout=30)
     cur = con.cursor()
 
     # Table for projects data.
@@ -276,8 +325,56 @@ def get_digits(string, conv="float"):
     else:
         return None
 
+def get_pledge_fields(bs4_tag):
+    """Returns a dict of the raw text needed from a kickstarter pledge tag. Has the
+    same keys as the dicts returned by page_scripts.REWARD_FIELDS_JS.
+
+    Inputs:
+    bs4_tag [bs4.element.Tag] - A tag of a kickstarter Pledge."""
+    fields = {}
+
+    fields['id'] = bs4_tag['id']
+    fields['title'] = bs4_tag.select_one('[class="support-700 semibold type-18 m0 mr1 text-wrap-balance break-word"]').getText()
+    fields['price'] = bs4_tag.select_one('[class="support-700 type-18 m0 shrink0"]').getText()
+
+    desc_elem = bs4_tag.select_one('[class="type-14 lh20px mb0 support-700 text-prewrap"]')
+    fields['description'] = desc_elem.getText() if desc_elem != None else None
+
+    item_list_elem = bs4_tag.select_one('[class="flex flex-column gap1"]')
+    if item_list_elem != None:
+        fields['items'] = [item_elem.getText() for item_elem in item_list_elem.select('[class="border border-support-700 mb3 py3 px3 radius4px clip"]')]
+    else:
+        fields['items'] = None
+
+    delivery_date_elem = bs4_tag.select_one('time[datetime]')
+    fields['delivery_date'] = delivery_date_elem['datetime'] if delivery_date_elem != None else None
+
+    shipping_location_elem = bs4_tag.select_one('div[class="flex1"] > div[class="type-14 lh20px mb0 support-700"]')
+    fields['shipping_location'] = shipping_location_elem.getText() if shipping_location_elem != None else None
+
+    rd_backers_elem = bs4_tag.select_one("span[aria-label]")
+    fields['backers'] = rd_backers_elem.getText() if rd_backers_elem != None else None
+
+    # Check if h3 tag with text "Limited quantity" exists. If so, get sibling
+    # tag which contains the reward limit.
+    rd_limit_sib_elem = bs4_tag.select_one('h3:-soup-contains("Limited quantity")')
+    rd_limit_elem = rd_limit_sib_elem.find_next_sibling() if rd_limit_sib_elem != None else None
+    fields['limit'] = rd_limit_elem.getText() if rd_limit_elem != None else None
+
+    return fields
+
 def get_pledge_data(bs4_tag, index=0, conversion_rate=1):
-    """Returns a dict of data from a kickstarter pledge li bs4 tag.
+    """Returns a dict of data from a kickstarter pledge li bs4 tag. See
+    build_pledge_data for the keys.
+
+    Inputs:
+    bs4_tag [bs4.element.Tag] - A tag of a kickstarter Pledge.
+    Index [int] - Optional. The index of the current pledge. Has a default value of 0.
+    conversion_rate [int] - Conversion rate to use for converting pledge price. 1 by default."""
+    return build_pledge_data(get_pledge_fields(bs4_tag), index, conversion_rate)
+
+def build_pledge_data(fields, index=0, conversion_rate=1):
+    """Returns a dict of data from the raw fields of a kickstarter pledge.
     Dict will contain:
     rd_id: Pledge unique id.
     rd_title: Pledge title
@@ -292,33 +389,28 @@ def get_pledge_data(bs4_tag, index=0, conversion_rate=1):
     rd_gone: Status of pledge. If it is no longer available has a value of 1 and otherwise 0.
 
     Inputs:
-    bs4_tag [bs4.element.Tag] - A tag of a kickstarter Pledge.
+    fields [dict] - Raw pledge fields from get_pledge_fields or page_scripts.REWARD_FIELDS_JS.
     Index [int] - Optional. The index of the current pledge. Has a default value of 0.
     conversion_rate [int] - Conversion rate to use for converting pledge price. 1 by default."""
     pledge_data = {}
     i = str(index)
 
-    pledge_data['rd_id_' + i] = bs4_tag['id']
-    pledge_data['rd_title_' + i] = bs4_tag.select_one('[class="support-700 semibold type-18 m0 mr1 text-wrap-balance break-word"]').getText().strip()
+    pledge_data['rd_id_' + i] = fields['id']
+    pledge_data['rd_title_' + i] = fields['title'].strip()
     
-    pledge_data['rd_price_' + i] = get_digits(bs4_tag.select_one('[class="support-700 type-18 m0 shrink0"]').getText(), "int") * float(conversion_rate)
+    pledge_data['rd_price_' + i] = get_digits(fields['price'], "int") * float(conversion_rate)
 
     # Description may not exist for some pledges e.g. https://www.kickstarter.com/projects/davidgfores/tiny-creatures-alphabet-el-abc-de-las-criaturas-abominables/rewards
-    desc_elem = bs4_tag.select_one('[class="type-14 lh20px mb0 support-700 text-prewrap"]')
-    if desc_elem != None:
-        pledge_data['rd_desc_' + i] = desc_elem.getText()
+    if fields['description'] != None:
+        pledge_data['rd_desc_' + i] = fields['description']
     else:
         pledge_data['rd_desc_' + i] = ""
 
-    # Get container with included items for pledge and then extract text from
-    # every item.
+    # Extract text from every included item of the pledge.
     rd_list = []
-    item_list_elem = bs4_tag.select_one('[class="flex flex-column gap1"]')
     # No included items. e.g. https://www.kickstarter.com/projects/lucid-dreamers/empires-of-sorcery/rewards
-    if item_list_elem != None:
-        item_elems = item_list_elem.select('[class="border border-support-700 mb3 py3 px3 radius4px clip"]')
-        for item_elem in item_elems:
-            item = item_elem.getText()
+    if fields['items'] != None:
+        for item in fields['items']:
             if "Quantity: 1" in item:
                 item = item.replace("Quantity: 1", "")
             else:
@@ -331,30 +423,25 @@ def get_pledge_data(bs4_tag, index=0, conversion_rate=1):
     
     pledge_data['rd_list_' + i] = json.dumps(rd_list)
 
-    delivery_date_elem = bs4_tag.select_one('time[datetime]')
-    if delivery_date_elem != None:
-        pledge_data['rd_delivery_date_' + i] = bs4_tag.select_one('time[datetime]')['datetime']
+    if fields['delivery_date'] != None:
+        pledge_data['rd_delivery_date_' + i] = fields['delivery_date']
     else:
         pledge_data['rd_delivery_date_' + i] = MISSING
 
-    shipping_location_elem = bs4_tag.select_one('div[class="flex1"] > div[class="type-14 lh20px mb0 support-700"]')
-    if shipping_location_elem != None:
-        pledge_data['rd_shipping_location_' + i] = shipping_location_elem.getText()
+    if fields['shipping_location'] != None:
+        pledge_data['rd_shipping_location_' + i] = fields['shipping_location']
     else:
         pledge_data['rd_shipping_location_' + i] = MISSING
 
-    rd_backers_elem = bs4_tag.select_one("span[aria-label]")
-    if rd_backers_elem != None:
-        rd_backers = int(rd_backers_elem.getText())
+    if fields['backers'] != None:
+        rd_backers = int(fields['backers'])
     else:
         rd_backers = MISSING
     pledge_data["rd_backers_" + i] = rd_backers
 
-    # Check if h3 tag with text "Limited quantity" exists. If so, get sibling
-    # tag which contains the reward limit.
-    rd_limit_sib_elem = bs4_tag.select_one('h3:-soup-contains("Limited quantity")')
-    if rd_limit_sib_elem != None:
-        rd_limit_digits = get_digits(rd_limit_sib_elem.find_next_sibling().getText().split()[-1], "int")
+    # The limit text can be empty on a half rendered page.
+    if fields['limit'] != None and fields['limit'].split():
+        rd_limit_digits = get_digits(fields['limit'].split()[-1], "int")
         # Must have "None left" as value since get_digits failed. E.g. of reward page: https://www.kickstarter.com/projects/artorder/2018-snowman-greeting-card-collection/rewards
         if rd_limit_digits == None:
             rd_limit = rd_backers
@@ -403,24 +490,34 @@ def get_category_data(cat_str):
     
     return (category, subcategory)
 
-def get_live_soup(link, given_driver=None, page=None):
-    """Returns a bs4 soup object of the given link. Returns None if it is a deleted kickstarter account.
-    
+def open_page(driver, link, page=None, capture=None):
+    """Loads link in driver and waits for it depending on page type. Returns job_queue.HIDDEN if
+    it is a hidden project, job_queue.DELETED if it is a deleted kickstarter account or a 404 page
+    and job_queue.SUCCESS otherwise.
+
+    driver [selenium webdriver] - A webdriver.
     link [str] - A link to a website.
-    scroll [bool] - True if you want selenium to keep scrolling down till loading no longer happens.
-    False by default.
-    given_driver [selenium webdriver] - A webdriver. None by default.
-    page [str] - Additional behavior depending on page type."""
-    if given_driver == None:
-        driver = uc.Chrome(driver_executable_path=CHROMEDRIVER_PATH)
-    else:
-        driver = given_driver
-    driver.get(link)
+    page [str] - Additional behavior depending on page type.
+    capture [list] - If given, JSON responses made by the page are appended to it and waits
+    for rendering are replaced by waits for the responses. None by default."""
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.common.by import By
+
+    events = []
+    browser_profile.prepare_page(driver)
+    fetch_started = time.perf_counter()
+    with metrics.timer(stage="fetch"):
+        driver.get(link)
+    fetch_seconds = time.perf_counter() - fetch_started
+    metrics.inc("pages_total", page=page or "page")
 
     # Click creator page for page to load additional data if it is a campaign page.
     # There are two possible alternate selectors. One for successful campaigns and the
     # other for other campaigns. Try finding both and click whichever that exists.
     if page == "campaign":
+        with metrics.timer(stage="wait"):
             # Try reloading page at most 2 times if required elems aren't found.
             tries = 2
             while tries != 0:
@@ -431,7 +528,14 @@ def get_live_soup(link, given_driver=None, page=None):
                 elems.extend(driver.find_elements(By.CSS_SELECTOR, 'div[class="do-not-visually-track text-left type-16 bold clip text-ellipsis"]'))
                 try:
                     elems[0].click()
-                    time.sleep(5)
+                    if capture != None:
+                        # Wait only until the modal's creator data arrives.
+                        result, responses, new_events = network_capture.wait_for_responses(
+                            driver, lambda responses: network_capture.map_creator(responses, network_capture.project_slug(link)), 5)
+                        capture.extend(responses)
+                        events.extend(new_events)
+                    else:
+                        time.sleep(5)
                 except Exception:
                     driver.refresh()
                     tries -= 1
@@ -439,26 +543,40 @@ def get_live_soup(link, given_driver=None, page=None):
                 else:
                     break
 
-    soup = BeautifulSoup(driver.page_source, "lxml")
+    # Check page state in the browser instead of serializing the page source.
+    status = driver.execute_script(page_scripts.PAGE_STATUS_JS)
+    worker_session.record_page(fetch_seconds, status["captcha"])
 
     # Hidden project. For e.g. https://www.kickstarter.com/projects/732431717/photo-time-machine
-    hidden_elem = soup.select_one('div[id="hidden_project"]')
-    if hidden_elem != None:
-        driver.quit()
-        return
+    if status["hidden"]:
+        metrics.inc("hidden_projects_total")
+        return job_queue.HIDDEN
     
     # If there is a capcha, Beep and sleep.
-    capcha_elem = soup.select_one('div[id="px-captcha"]')
-    if capcha_elem != None:
+    if status["captcha"]:
+        metrics.inc("captchas_total")
+        # The worker's session moves to a new browser on another egress. The job is retried.
+        if egress_pool.ENABLED:
+            raise worker_session.BlockedError("Captcha encountered.")
         winsound.Beep(440, 1000)        
         time.sleep(30)
     
     # If it is a deleted account or there is a 404 error, return.
-    deleted_elem = soup.select_one('div[class="center"]')
-    non_existent_elem = soup.select_one('a[href="/?ref=404-ksr10"]')
-    if deleted_elem != None or non_existent_elem != None:
-        driver.quit()
-        return
+    if status["deleted"]:
+        metrics.inc("deleted_pages_total")
+        return job_queue.DELETED
+
+    # Wait for rewards data to arrive. Fall back to waiting for the rewards to render
+    # if no rewards response was seen.
+    if page == "rewards" and capture != None:
+        with metrics.timer(stage="wait"):
+            result, responses, new_events = network_capture.wait_for_responses(
+                driver, lambda responses: network_capture.map_rewards(responses, network_capture.project_slug(link)), 10)
+        capture.extend(responses)
+        events.extend(new_events)
+        if result != None:
+            browser_profile.log_bandwidth(link, events + browser_profile.get_network_events(driver))
+            return job_queue.SUCCESS
 
     # Wait for rewards to load.
     if page == "rewards":
@@ -469,7 +587,8 @@ def get_live_soup(link, given_driver=None, page=None):
         while tries != 0:
             try:
                 element_present = EC.presence_of_element_located((By.CSS_SELECTOR, 'article[data-test-id]'))
-                WebDriverWait(driver, max_timeout).until(element_present)
+                with metrics.timer(stage="wait"):
+                    WebDriverWait(driver, max_timeout).until(element_present)
             except TimeoutException:
                 print(f"Timed out waiting for {link} to load. Refreshing...")
                 driver.refresh()
@@ -477,36 +596,321 @@ def get_live_soup(link, given_driver=None, page=None):
             else:
                 break
 
-    soup = BeautifulSoup(driver.page_source, "lxml")
+    browser_profile.log_bandwidth(link, events + browser_profile.get_network_events(driver))
+    return job_queue.SUCCESS
+
+@tracing.traced
+def get_live_soup(link, given_driver=None, page=None, capture=None, state=None):
+    """Returns a bs4 soup object of the given link. Returns None if it is a hidden project, a deleted
+    kickstarter account or a 404 page.
+    
+    link [str] - A link to a website.
+    given_driver [selenium webdriver] - A webdriver. None by default.
+    page [str] - Additional behavior depending on page type.
+    capture [list] - List to append JSON responses made by the page to. None by default.
+    state [dict] - If given, "outcome" is set to the open_page outcome. None by default."""
+    if given_driver == None:
+        driver = browser_profile.new_driver(CHROMEDRIVER_PATH, egress=egress_pool.get_egress())
+    else:
+        driver = given_driver
+
+    outcome = open_page(driver, link, page, capture)
+    if state != None:
+        state["outcome"] = outcome
+    if outcome != job_queue.SUCCESS:
+        # Hidden and deleted pages are archived too so replays skip them the same way.
+        if page_archive.ENABLED:
+            archive_page(driver, link, page)
+        if given_driver == None:
+            driver.quit()
+        return
+
+    page_source = archive_page(driver, link, page)
+    with metrics.timer(stage="parse"):
+        soup = BeautifulSoup(page_source, "lxml")
 
     if given_driver == None:
         driver.quit()
 
     return soup
 
-def extract_campaign_data(path, conversion_rate=1):
+def archive_page(driver, link, page=None):
+    """Returns the page source of driver and stores it in page_archive if archiving is enabled.
+
+    driver [selenium webdriver] - A webdriver with link loaded.
+    link [str] - Link of the loaded page.
+    page [str] - Page type. "page" is used if None. None by default."""
+    page_source = driver.page_source
+    if page_archive.ENABLED:
+        page_archive.store(link, page_source, page or "page")
+    return page_source
+
+def get_archived_soup(link, page=None, state=None):
+    """Returns a bs4 soup object of the latest archived copy of link. Returns None if it is a
+    hidden project, a deleted kickstarter account or a 404 page. Raises job_queue.PermanentError if
+    link was never archived.
+
+    link [str] - A link to a website.
+    page [str] - Page type it was archived with. "page" is used if None. None by default.
+    state [dict] - If given, "outcome" is set like get_live_soup does. None by default."""
+    page_source = page_archive.load(link, page or "page")
+    if page_source == None:
+        raise job_queue.PermanentError(f"{link} is not in the page archive.")
+
+    soup = BeautifulSoup(page_source, "lxml")
+    if soup.select_one('div[id="hidden_project"]') != None:
+        outcome = job_queue.HIDDEN
+    elif soup.select_one('div[class="center"]') != None or soup.select_one('a[href="/?ref=404-ksr10"]') != None:
+        outcome = job_queue.DELETED
+    else:
+        outcome = job_queue.SUCCESS
+    if state != None:
+        state["outcome"] = outcome
+    if outcome != job_queue.SUCCESS:
+        return
+    return soup
+
+@tracing.traced
+def get_live_fields(link, given_driver=None, page=None, capture=None, state=None):
+    """Returns the raw fields of the given link extracted by javascript inside the browser.
+    A dict like get_campaign_fields for campaign pages and a list of dicts like get_pledge_fields
+    for rewards pages. Returns None if it is a hidden project, a deleted kickstarter account or a
+    404 page.
+
+    link [str] - A link to a website.
+    given_driver [selenium webdriver] - A webdriver. None by default.
+    page [str] - Either "campaign" or "rewards".
+    capture [list] - List to append JSON responses made by the page to. None by default.
+    state [dict] - If given, "outcome" is set to the open_page outcome. None by default."""
+    if given_driver == None:
+        driver = browser_profile.new_driver(CHROMEDRIVER_PATH, egress=egress_pool.get_egress())
+    else:
+        driver = given_driver
+
+    outcome = open_page(driver, link, page, capture)
+    if state != None:
+        state["outcome"] = outcome
+    if outcome != job_queue.SUCCESS:
+        if page_archive.ENABLED:
+            archive_page(driver, link, page)
+        if given_driver == None:
+            driver.quit()
+        return
+
+    # Archiving needs the page source which this mode otherwise avoids.
+    if page_archive.ENABLED:
+        archive_page(driver, link, page)
+
+    with metrics.timer(stage="parse"):
+        if page == "rewards":
+            # Rewards were already captured from the network.
+            if capture != None and network_capture.map_rewards(capture, network_capture.project_slug(link)) != None:
+                fields = []
+            else:
+                fields = driver.execute_script(page_scripts.REWARD_FIELDS_JS)
+        else:
+            fields = driver.execute_script(page_scripts.CAMPAIGN_FIELDS_JS)
+
+    if given_driver == None:
+        driver.quit()
+
+    return fields
+
+def get_campaign_fields(soup):
+    """Returns a dict of the raw fields needed from a kickstarter campaign page. Has the
+    same keys as the dict returned by page_scripts.CAMPAIGN_FIELDS_JS.
+
+    Inputs:
+    soup [bs4.BeautifulSoup] - Soup of a campaign page."""
+    fields = {}
+
+    def elem_attr(selector, name):
+        elem = soup.select_one(selector)
+        return elem.get(name) if elem != None else None
+
+    def elem_text(selector):
+        elem = soup.select_one(selector)
+        return elem.getText() if elem != None else None
+
+    fields["og_url"] = elem_attr('meta[property="og:url"]', "content")
+    fields["meta_description"] = elem_attr('meta[name="description"]', "content")
+    fields["data_initial"] = elem_attr('div[data-initial]', "data-initial")
+    fields["identity_name"] = elem_text('span[class="identity_name"]')
+
+    # Past collaborators.
+    fields["past_collaborators"] = []
+    past_collab_elem = soup.select_one('p[class="col col-12"]')
+    if past_collab_elem != None:
+        fields["past_collaborators"] = [(a_elem.getText(), a_elem['href']) for a_elem in past_collab_elem.select('a')]
+
+    # Single collaborator.
+    fields["single_collaborator"] = None
+    single_collab_elem = soup.select_one('[class="flag col col-4 mb3"] > div[class="flag-body"]')
+    if single_collab_elem != None:
+        a_elem = single_collab_elem.select_one('a')
+        fields["single_collaborator"] = (a_elem.getText(), a_elem['href'], single_collab_elem.select_one('div').getText())
+
+    # Number of images and photos. Get number of photos and videos within all content. Do not try
+    # to get all photos for all content because there are campaign unrelated photos within 
+    # this elem.
+    photos, videos = 0, 0
+    content_elem = soup.select_one('div[id="content-wrap"]')
+    description_elem = soup.select_one('div[class="story-content"]')
+    if content_elem != None:
+        # Front video.
+        videos += len(content_elem.select('video[preload="none"]'))
+        # Embedded videos.
+        videos += len(content_elem.select('div[class="embedly-card-hug"]'))
+        # Front image.
+        photos += len(content_elem.select('img[class="js-feature-image"]'))
+    
+    if description_elem != None:
+        # Images in description.
+        photos += len(description_elem.select('img'))
+
+    fields["num_photos"] = photos
+    fields["num_videos"] = videos
+
+    fields["created_backed_text"] = elem_text('[class="created-projects py2 f5 mb3"]')
+    fields["comments_count"] = elem_attr("a[id='comments-emoji']", "data-comments-count")
+    fields["updates_count"] = elem_attr("a[id='updates-emoji']", "emoji-data")
+    fields["faqs_count"] = elem_attr("a[id='faq-emoji']", "emoji-data")
+    fields["description"] = description_elem.getText() if description_elem != None else None
+    fields["risk"] = elem_text('p[class="js-risks-text text-preline"]')
+
+    return fields
+
+def get_reward_fields(soup):
+    """Returns a list of raw pledge fields for every pledge in a kickstarter rewards page.
+
+    Inputs:
+    soup [bs4.BeautifulSoup] - Soup of a rewards page."""
+    return [get_pledge_fields(pledge_elem) for pledge_elem in soup.select('article[data-test-id]')]
+
+def launch_driver(egress=None):
+    """Returns a new webdriver for a worker session.
+
+    egress [str] - Egress from egress_pool or None. None by default."""
+    return browser_profile.new_driver(CHROMEDRIVER_PATH, egress=egress, user_multi_procs=True)
+
+@tracing.traced
+def extract_campaign_data(path, conversion_rate=1, state=None):
     """Extracts data from a kickstarter campaign page and returns
-    it in a dictionary. 
+    it in a dictionary. Returns None if the campaign or its rewards page is unavailable.
     
     Inputs:
     path [str] - Path to html file.
-    conversion_rate[int] - Conversion rate to use for pledges. 1 by default."""
-    data = {"rd_project_link": path}
-    
+    conversion_rate[int] - Conversion rate to use for pledges. 1 by default.
+    state [dict] - If given, "outcome" is set to job_queue.HIDDEN or job_queue.DELETED when None is
+    returned. None by default."""
+    if REPLAY:
+        return extract_archived_campaign_data(path, conversion_rate, state)
+
+    # Lists for JSON responses made by the pages if they are being captured.
+    campaign_capture = [] if CAPTURE_NETWORK else None
+    reward_capture = [] if CAPTURE_NETWORK else None
+
+    # The worker keeps its browser between jobs.
+    session = worker_session.get_session(launch_driver)
     try:
-        driver = uc.Chrome(driver_executable_path=CHROMEDRIVER_PATH, user_multi_procs=True)
+        driver = session.get_driver()
 
-        campaign_soup = get_live_soup(path, given_driver=driver, page="campaign")
+        if IN_BROWSER:
+            campaign_fields = get_live_fields(path, given_driver=driver, page="campaign", capture=campaign_capture, state=state)
 
-        # Campaign is hidden.
-        if campaign_soup == None:
-            return
-        reward_soup = get_live_soup(path + "/rewards", given_driver=driver, page="rewards")
+            # Campaign is hidden.
+            if campaign_fields == None:
+                return
+        else:
+            campaign_soup = get_live_soup(path, given_driver=driver, page="campaign", capture=campaign_capture, state=state)
+
+            # Campaign is hidden.
+            if campaign_soup == None:
+                return
 
+        # Rewards page source is not needed if rewards are captured from the network.
+        if IN_BROWSER or CAPTURE_NETWORK:
+            reward_fields = get_live_fields(path + "/rewards", given_driver=driver, page="rewards", capture=reward_capture, state=state)
+
+            # Rewards page is hidden or gone.
+            if reward_fields == None:
+                return
+        else:
+            reward_soup = get_live_soup(path + "/rewards", given_driver=driver, page="rewards", state=state)
+
+            # Rewards page is hidden or gone.
+            if reward_soup == None:
+                return
+
+    except worker_session.BlockedError:
+        # The egress is blocked so the next job uses another one.
+        session.rotate(blocked=True)
+        raise
     except Exception:
-        raise Exception
-    finally:
-        driver.quit()
+        # Replace a browser left in an unknown state before the next job.
+        session.rotate(blocked=False)
+        raise
+
+    with metrics.timer(stage="parse"):
+        if not IN_BROWSER:
+            campaign_fields = get_campaign_fields(campaign_soup)
+        if not (IN_BROWSER or CAPTURE_NETWORK):
+            reward_fields = get_reward_fields(reward_soup)
+
+    if CAPTURE_NETWORK:
+        if page_archive.ENABLED:
+            page_archive.store(path, json.dumps(campaign_capture), "campaign_responses", "application/json")
+            page_archive.store(path + "/rewards", json.dumps(reward_capture), "rewards_responses", "application/json")
+        captured_rewards = network_capture.map_rewards(reward_capture, network_capture.project_slug(path))
+        if captured_rewards != None:
+            reward_fields = captured_rewards
+        campaign_fields["network_creator"] = network_capture.map_creator(campaign_capture, network_capture.project_slug(path))
+
+    return build_campaign_data(campaign_fields, reward_fields, conversion_rate)
+
+@tracing.traced
+def extract_archived_campaign_data(path, conversion_rate=1, state=None):
+    """Same as extract_campaign_data but uses the latest pages of path in page_archive
+    instead of fetching them.
+
+    Inputs:
+    path [str] - Link to a campaign.
+    conversion_rate[int] - Conversion rate to use for pledges. 1 by default.
+    state [dict] - Same as in extract_campaign_data. None by default."""
+    campaign_soup = get_archived_soup(path, "campaign", state)
+
+    # Campaign is hidden.
+    if campaign_soup == None:
+        return
+
+    campaign_fields = get_campaign_fields(campaign_soup)
+    reward_fields = None
+
+    # Use captured JSON responses if the pages were scraped with CAPTURE_NETWORK.
+    campaign_responses = page_archive.load(path, "campaign_responses")
+    if campaign_responses != None:
+        campaign_fields["network_creator"] = network_capture.map_creator(json.loads(campaign_responses), network_capture.project_slug(path))
+    reward_responses = page_archive.load(path + "/rewards", "rewards_responses")
+    if reward_responses != None:
+        reward_fields = network_capture.map_rewards(json.loads(reward_responses), network_capture.project_slug(path))
+    if reward_fields == None:
+        reward_soup = get_archived_soup(path + "/rewards", "rewards", state)
+
+        # Rewards page is hidden or gone.
+        if reward_soup == None:
+            return
+        reward_fields = get_reward_fields(reward_soup)
+
+    return build_campaign_data(campaign_fields, reward_fields, conversion_rate)
+
+def build_campaign_data(fields, reward_fields, conversion_rate=1):
+    """Returns a dictionary of campaign data built from the raw fields of a
+    campaign page and its rewards page.
+
+    Inputs:
+    fields [dict] - Raw campaign fields from get_campaign_fields or page_scripts.CAMPAIGN_FIELDS_JS.
+    reward_fields [list] - Raw pledge fields from get_reward_fields or page_scripts.REWARD_FIELDS_JS.
+    conversion_rate[int] - Conversion rate to use for pledges. 1 by default."""
 
     # Prepare str for getting date and time. 
     path = datetime.now().strftime('_%Y%m%d-%H%M%S.html')
@@ -521,11 +925,9 @@ def extract_campaign_data(path, conversion_rate=1):
     data["date_accessed"] = date
 
     # rd_project_link. If missing, do not continue.
-    try:
-        rd_project_link_elem = campaign_soup.select_one('meta[property="og:url"]')
-        data["rd_project_link"] = rd_project_link_elem["content"]
-    except:
+    if fields["og_url"] == None:
         return data
+    data["rd_project_link"] = fields["og_url"]
 
     # Project Id and Creator Id.
     creator_id, project_id = data["rd_project_link"].split("/")[-2:]
@@ -533,8 +935,7 @@ def extract_campaign_data(path, conversion_rate=1):
     data["creator_id"] = creator_id
 
     # Creator, Title and Blurb
-    meta_elem = campaign_soup.select_one('meta[name="description"]')
-    lines = meta_elem["content"].splitlines()
+    lines = fields["meta_description"].splitlines()
     rd_creator_name, title = lines[0].split(" is raising funds for ")
     title = title.strip().replace(" on Kickstarter!", "")
     blurb = lines[-1].strip()
@@ -545,17 +946,15 @@ def extract_campaign_data(path, conversion_rate=1):
 
     # data-initial attribute has a lot of the required data elements
     # so check if it exists.
-    project_data_elem = campaign_soup.select_one('div[data-initial]')
     project_data = None
-    if project_data_elem != None:
-        project_data = json.loads(project_data_elem['data-initial']).get('project', None)  
+    if fields["data_initial"] != None:
+        project_data = json.loads(fields["data_initial"]).get('project', None)  
 
     # Creator verified identity.
     if project_data:
         verified_identity = project_data['verifiedIdentity']
     else:
-        verified_identity_elem = campaign_soup.select_one('span[class="identity_name"]')
-        verified_identity = verified_identity_elem.getText().strip() if verified_identity_elem != None else MISSING
+        verified_identity = fields["identity_name"].strip() if fields["identity_name"] != None else MISSING
 
         # Creators who verified their account don't have their name posted. e.g. https://www.kickstarter.com/projects/perry/video-chat-at-35000-feet
         if verified_identity == "(name not available)":
@@ -564,10 +963,17 @@ def extract_campaign_data(path, conversion_rate=1):
 
     # Status of campaign.
     data["status"] = MISSING
+    if project_data and project_data.get('state'):
+        data["status"] = project_data['state'].title()
     data["cv_duration"] = MISSING
 
     # Backers.
     data["cv_num_backers"] = MISSING
+    if project_data:
+        if 'backersCount' in project_data:
+            data["cv_num_backers"] = project_data['backersCount']
+        elif project_data.get('backers'):
+            data["cv_num_backers"] = project_data['backers']['totalCount']
 
     # Collaborators. Empty list if no collaborators and
     # empty string if it was not possible to extract.
@@ -578,17 +984,14 @@ def extract_campaign_data(path, conversion_rate=1):
             collaborators.append((collab['node']['name'], collab['node']['url'], collab['title']))
     else:
         # Get past collaborators if available.
-        past_collab_elem = campaign_soup.select_one('p[class="col col-12"]')
-        if past_collab_elem != None:
-            for a_elem in past_collab_elem.select('a'):
-                # Past collaborators don't have titles.
-                collaborators.append((a_elem.getText(), "https://www.kickstarter.com/" + a_elem['href'], ""))
-
-        # Selector in case of single collaborator.
-        single_collab_elem = campaign_soup.select_one('[class="flag col col-4 mb3"] > div[class="flag-body"]')
-        if single_collab_elem != None:
-            a_elem = single_collab_elem.select_one('a')
-            collaborators.append((a_elem.getText(), "https://www.kickstarter.com/" + a_elem['href'], single_collab_elem.select_one('div').getText()))
+        for name, href in fields["past_collaborators"]:
+            # Past collaborators don't have titles.
+            collaborators.append((name, "https://www.kickstarter.com/" + href, ""))
+
+        # In case of single collaborator.
+        if fields["single_collaborator"] != None:
+            name, href, collab_title = fields["single_collaborator"]
+            collaborators.append((name, "https://www.kickstarter.com/" + href, collab_title))
 
     data["collaborators"] = json.dumps(collaborators)
 
@@ -601,6 +1004,14 @@ def extract_campaign_data(path, conversion_rate=1):
     data["pledged"] = MISSING
     data["converted_pledged"] = MISSING
 
+    # Goal and pledged amount in the project's currency.
+    if project_data and project_data.get('goal'):
+        data["goal"] = float(project_data['goal']['amount'])
+        data["converted_goal"] = data["goal"] * float(conversion_rate)
+    if project_data and project_data.get('pledged'):
+        data["pledged"] = float(project_data['pledged']['amount'])
+        data["converted_pledged"] = data["pledged"] * float(conversion_rate)
+
     # Campaign start time.
     data["cv_startday"] = MISSING
     data["cv_startmonth"] = MISSING
@@ -612,26 +1023,8 @@ def extract_campaign_data(path, conversion_rate=1):
     data["cv_endyear"] = MISSING
 
     # Number of images and photos.
-    photos, videos = 0, 0
-    # Get number of photos and videos within all content. Do not try to get
-    # all photos for all content because there are campaign unrelated photos within 
-    # this elem.
-    content_elem = campaign_soup.select_one('div[id="content-wrap"]')
-    description_elem = campaign_soup.select_one('div[class="story-content"]')
-    if content_elem != None:
-        # Front video.
-        videos += len(content_elem.select('video[preload="none"]'))
-        # Embedded videos.
-        videos += len(content_elem.select('div[class="embedly-card-hug"]'))
-        # Front image.
-        photos += len(content_elem.select('img[class="js-feature-image"]'))
-    
-    if description_elem != None:
-        # Images in description.
-        photos += len(description_elem.select('img'))
-
-    data["num_photos"] = photos
-    data["num_videos"] = videos
+    data["num_photos"] = fields["num_photos"]
+    data["num_videos"] = fields["num_videos"]
 
     # Make 100 (make100), Projects we love (pwl), Category, Location. make100/pwl is 1 if project is 
     # part of it and otherwise 0. prj.db
@@ -651,9 +1044,8 @@ def extract_campaign_data(path, conversion_rate=1):
 
     if not project_data:
         # This elem contains information about both created and backed projects by creator.
-        created_backed_elem = campaign_soup.select_one('[class="created-projects py2 f5 mb3"]')
-        if created_backed_elem != None:
-            created_text, backed_text = created_backed_elem.getText().replace('\n', '').split('·')
+        if fields["created_backed_text"] != None:
+            created_text, backed_text = fields["created_backed_text"].replace('\n', '').split('·')
             digits = get_digits(created_text, "int")
             if digits != None:
                 rd_creator_created = digits
@@ -661,6 +1053,11 @@ def extract_campaign_data(path, conversion_rate=1):
                 # If not digits, then this project must be "First Created"
                 rd_creator_created = 1
     
+    # Creator counts captured from the creator modal's own request.
+    network_creator = fields.get("network_creator")
+    if rd_creator_created == MISSING and network_creator and network_creator["created"] != None:
+        rd_creator_created = network_creator["created"]
+    
     data["rd_creator_created"] = rd_creator_created
 
     # Number of projects backed.
@@ -672,64 +1069,67 @@ def extract_campaign_data(path, conversion_rate=1):
         else:
             num_backed = project_data['creator']['backingsCount']
 
-    if not project_data and created_backed_elem != None:
+    if not project_data and fields["created_backed_text"] != None:
             digits = get_digits(backed_text, "int")
             if digits != None:
                 num_backed = digits
 
+    if num_backed == MISSING and network_creator and network_creator["backed"] != None:
+        num_backed = network_creator["backed"]
+
     data["num_backed"] = num_backed 
 
     # Number of comments.
-    comments_elem = campaign_soup.select_one("a[id='comments-emoji']")
-    if comments_elem != None:
-        data["rd_comments"] = comments_elem["data-comments-count"]
+    if fields["comments_count"] != None:
+        data["rd_comments"] = fields["comments_count"]
     else:
         data["rd_comments"] = MISSING
     
     # Number of updates.
-    updates_elem = campaign_soup.select_one("a[id='updates-emoji']")
-    if updates_elem != None:
-        data["rd_updates"] = updates_elem["emoji-data"]
+    if fields["updates_count"] != None:
+        data["rd_updates"] = fields["updates_count"]
     else:
         data["rd_updates"] = MISSING
 
     # Number of faq.
-    faq_elem = campaign_soup.select_one("a[id='faq-emoji']")
-    if faq_elem != None:
-        data["rd_faqs"] = faq_elem["emoji-data"]
+    if fields["faqs_count"] != None:
+        data["rd_faqs"] = fields["faqs_count"]
     else:
         data["rd_faqs"] = MISSING
 
     # Description.
-    if description_elem != None:
-        description = description_elem.getText().strip()
+    if fields["description"] != None:
+        description = fields["description"].strip()
     else:
         description = MISSING
     data["description"] = description
     
     # Risks.
-    risk_elem = campaign_soup.select_one('p[class="js-risks-text text-preline"]')
-    if risk_elem != None:
-        risk = risk_elem.getText().strip()
+    if fields["risk"] != None:
+        risk = fields["risk"].strip()
     else:
         risk = MISSING
     data["risk"] = risk
 
     # Pledges. rd_gone is 0 for available pledges and 1 for complete pledges. 
-    all_pledge_elems = []
-    all_pledge_elems.extend([pledge_elem for pledge_elem in reward_soup.select('article[data-test-id]')])
-
-    data["cv_num_rewards"] = len(all_pledge_elems)
+    data["cv_num_rewards"] = len(reward_fields)
 
-    for i, pledge_elem in enumerate(all_pledge_elems):
-        data |= get_pledge_data(pledge_elem, i, conversion_rate)
+    for i, pledge_fields in enumerate(reward_fields):
+        data |= build_pledge_data(pledge_fields, i, conversion_rate)
 
     return data
 
+@tracing.traced
 def scrape_write(row):
-    """Takes a row of data, scrapes additional data from url and adds full data to database."""
+    """Takes a row of data, scrapes additional data from url and adds full data to database.
+    Returns the job_queue outcome."""
+    if REPLAY and not page_archive.has(row["url"], "campaign"):
+        logging.info(f"{row['url']} is not archived. Skipping...")
+        return job_queue.PERMANENT
+
     logging.info(f"Started scraping {row['url']}...")
-    project_data = extract_campaign_data(row["url"], row["conversion_rate"])
+    state = {}
+    project_data = extract_campaign_data(row["url"], row["conversion_rate"], state)
 
     if project_data != None:
         # Merge data.
@@ -746,14 +1146,19 @@ def scrape_write(row):
         project_data["cv_endyear"] = end_date.year
         project_data["cv_duration"] = duration
 
-        project_data["status"] = row["state"]
         project_data["original_curr_symbol"] = row["original_currency"]
         project_data["converted_curr_symbol"] = row["converted_currency"]   
         project_data["conversion_rate"] = float(row["conversion_rate"])
-        project_data["goal"] = float(row["goal"]) / project_data["conversion_rate"]
-        project_data["converted_goal"] = float(row["goal"])
-        project_data["pledged"] = float(row["pledged"]) / project_data["conversion_rate"]
-        project_data["converted_pledged"] = float(row["pledged"])
+
+        # Values of the input are only as fresh as the first load, so they only fill in what
+        # the page didn't have when the project is new. Revisits keep the live values.
+        input_values = {
+            "status": row["state"],
+            "goal": float(row["goal"]) / project_data["conversion_rate"],
+            "converted_goal": float(row["goal"]),
+            "pledged": float(row["pledged"]) / project_data["conversion_rate"],
+            "converted_pledged": float(row["pledged"]),
+        }
 
         project_data["pwl"] = row["pwl"]
         project_data["make100"] = MISSING
@@ -761,26 +1166,39 @@ def scrape_write(row):
         project_data["subcategory"] = row["subcategory"]
         project_data["location"] = row["location"]
 
-    with db_lock:
-        con = create_new_projects_db(DATABASE)
-        cur = con.cursor()
-
-        if project_data != None:
-            columns = ', '.join(project_data.keys())
-            placeholders = ', '.join('?' * len(project_data))
-            insert_command = "INSERT OR IGNORE INTO projects ({}) VALUES ({})".format(columns, placeholders)
-            cur.execute(insert_command, tuple(project_data.values()))
-            logging.info(f"Added {row['url']} to table...")
-        else:
-            columns = ', '.join(row.keys())
-            placeholders = ', '.join('?' * len(row))
-            insert_command = "INSERT OR IGNORE INTO hidden_projects ({}) VALUES ({})".format(columns, placeholders)           
-            cur.execute(insert_command, tuple(row.values()))
-
-        con.commit()
-        con.close()
+    if project_data != None:
+        # Revisits only write changed fields.
+        change_history.write_changes("project", "projects", "rd_project_link", project_data, ignore=("date_accessed",), defaults=input_values)
+        # The live status is newer than the input's when the page has it.
+        refresh_scheduler.record_visit("project", row["url"], refresh_scheduler.project_volatile(project_data),
+                                       project_data["status"] or row["state"], row["deadline_date"])
+        logging.info(f"Added {row['url']} to table...")
+        return job_queue.SUCCESS
+    elif state.get("outcome") == job_queue.DELETED:
+        # Deleted and 404 pages don't come back so they aren't revisited.
+        change_history.write_changes("hidden_project", "hidden_projects", "url", row)
+        refresh_scheduler.record_visit("project", row["url"], {"deleted": True})
+        logging.info(f"{row['url']} is deleted.")
+        return job_queue.DELETED
+    else:
+        change_history.write_changes("hidden_project", "hidden_projects", "url", row)
+        refresh_scheduler.record_visit("project", row["url"], {"hidden": True}, row["state"], row["deadline_date"])
+        return job_queue.HIDDEN
+
+@profiling.profiled
+def scrape_write_job(row):
+    """Runs scrape_write on row in a new trace and returns (outcome, error) where error is None
+    if it succeeded or the traceback otherwise."""
+    with tracing.trace(row["url"]) as root, db_writer.job(row["url"]):
+        try:
+            outcome, error = scrape_write(row), None
+        except Exception as e:
+            outcome, error = job_queue.error_outcome(e), traceback.format_exc()
+        root["outcome"] = outcome
+    return outcome, error
 
 if __name__ == "__main__":
+    sharding.from_args()
     if not TESTING:
         main()
     else:
@@ -0,0 +1,84 @@
+import time
+
+# Columns of project_store after id, in the order of parse_data_project.
+COLUMNS = [
+    "name", "url", "creator_id", "blurb", "original_currency", "converted_currency", "conversion_rate", "goal",
+    "pledged", "backers", "state", "pwl", "location", "subcategory", "category", "created_date", "launched_date",
+    "deadline_date",
+]
+
+# Inserts a project or replaces it if this observation is newer than the stored one.
+UPSERT_SQL = f"""INSERT INTO project_store (id, {", ".join(COLUMNS)}, observed_at)
+                VALUES ({", ".join("?" * (len(COLUMNS) + 2))})
+                ON CONFLICT(id) DO UPDATE SET {", ".join(f"{column} = excluded.{column}" for column in COLUMNS)},
+                observed_at = excluded.observed_at
+                WHERE excluded.observed_at > project_store.observed_at"""
+
+# Links a creator to a project. relation is either created or backed.
+LINK_SQL = "INSERT OR IGNORE INTO creator_projects (creator_id, relation, project_id) VALUES (?, ?, ?)"
+
+def create_project_store(con):
+    """
+    Creates the project_store and creator_projects tables in the database of con if they don't
+    exist. Every project is stored once keyed by its kickstarter id and creators refer to it
+    through creator_projects.
+
+    con [sqlite3.Connection] - A database connection.
+    """
+    cur = con.cursor()
+
+    # Table for projects. observed_at is when the stored values were scraped.
+    cur.execute(f"""CREATE TABLE IF NOT EXISTS project_store(
+                id INTEGER PRIMARY KEY,
+                name TEXT,
+                url TEXT,
+                creator_id TEXT,
+                blurb TEXT,
+                original_currency TEXT,
+                converted_currency TEXT,
+                conversion_rate REAL,
+                goal REAL,
+                pledged REAL,
+                backers INTEGER,
+                state TEXT,
+                pwl INTEGER,
+                location TEXT,
+                subcategory TEXT,
+                category TEXT,
+                created_date TEXT,
+                launched_date TEXT,
+                deadline_date TEXT,
+                observed_at REAL
+                )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS project_store_creator_id ON project_store(creator_id)")
+
+    # Table linking creators to the projects they created or backed.
+    cur.execute("""CREATE TABLE IF NOT EXISTS creator_projects(
+                creator_id TEXT NOT NULL,
+                relation TEXT NOT NULL,
+                project_id INTEGER NOT NULL,
+                PRIMARY KEY (creator_id, relation, project_id)
+                ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS creator_projects_project_id ON creator_projects(project_id, relation)")
+    con.commit()
+
+def project_params(project, observed_at=None):
+    """
+    Returns UPSERT_SQL parameters for a parsed data project.
+
+    project [dict] - A dict returned by parse_data_project.
+    observed_at [float] - Unix time the project was scraped. Now by default.
+    """
+    if observed_at == None:
+        observed_at = time.time()
+    return (project["id"], *(project[column] for column in COLUMNS), observed_at)
+
+def link_params(creator_id, relation, projects):
+    """
+    Returns LINK_SQL parameters linking creator_id to every project in projects.
+
+    creator_id [str] - A kickstarter creator id.
+    relation [str] - created or backed.
+    projects [list] - Dicts returned by parse_data_project.
+    """
+    return [(str(creator_id), relation, project["id"]) for project in projects]
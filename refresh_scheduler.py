@@ -0,0 +1,205 @@
+import json
+import time
+import hashlib
+from datetime import datetime
+
+import db_writer
+import job_queue
+
+# Settings.
+
+# Seconds between the first two visits of a live project.
+LIVE_INTERVAL = 60 * 60
+# Bounds of the seconds between live project visits. The interval halves after a visit that found
+# a change and doubles after one that didn't, like creator visits.
+LIVE_MIN_INTERVAL = 15 * 60
+LIVE_MAX_INTERVAL = 24 * 60 * 60
+# Seconds between visits of projects which have not launched yet.
+UPCOMING_INTERVAL = 24 * 60 * 60
+# Seconds after its deadline a project gets its final visit, once its numbers have settled.
+# Projects first seen later than this are never revisited.
+ENDED_DELAY = 3 * 24 * 60 * 60
+# Seconds between the first two visits of a creator.
+CREATOR_START_INTERVAL = 7 * 24 * 60 * 60
+# Bounds of the seconds between creator visits. The interval halves after a visit that found a
+# change and doubles after one that didn't.
+CREATOR_MIN_INTERVAL = 24 * 60 * 60
+CREATOR_MAX_INTERVAL = 180 * 24 * 60 * 60
+# Lowercase project states.
+LIVE_STATES = {"live"}
+UPCOMING_STATES = {"submitted", "started"}
+
+# Fields of a project_data_extractor row which change while a project runs. Reward backers and
+# gone flags are added by project_volatile.
+PROJECT_FIELDS = ["status", "converted_pledged", "cv_num_backers", "rd_comments", "rd_updates", "rd_faqs", "cv_num_rewards"]
+# Fields of a creator_data_extractor row which change over time.
+CREATOR_FIELDS = ["location", "biography", "num_backed", "num_created", "websites", "num_comments",
+                  "created_projects", "backed_projects"]
+
+# Selects keys of an entity type due for a visit at a time.
+DUE_SQL = "SELECT key FROM visits WHERE entity_type = ? AND next_visit <= ?"
+
+def create_visits_table(con):
+    """
+    Creates the visits table in the database of con if it doesn't exist.
+
+    con [sqlite3.Connection] - A database connection.
+    """
+    cur = con.cursor()
+
+    # One row per project or creator. next_visit is NULL for items never revisited.
+    cur.execute("""CREATE TABLE IF NOT EXISTS visits(
+                entity_type TEXT NOT NULL,
+                key TEXT NOT NULL,
+                state TEXT,
+                deadline REAL,
+                fingerprint TEXT,
+                first_visit REAL,
+                last_visit REAL,
+                last_change REAL,
+                visits INTEGER,
+                changes INTEGER,
+                interval REAL,
+                next_visit REAL,
+                PRIMARY KEY (entity_type, key)
+                )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS visits_due ON visits(entity_type, next_visit)")
+    con.commit()
+
+def fingerprint(volatile):
+    """Returns a hash of a dict of volatile field values."""
+    return hashlib.sha1(json.dumps(volatile, sort_keys=True, default=str).encode("utf8")).hexdigest()
+
+def to_timestamp(date):
+    """Returns a unix time from a YYYY-MM-DD string or number. Returns None for empty values."""
+    if date == None or date == "":
+        return None
+    if isinstance(date, (int, float)):
+        return float(date)
+    return datetime.strptime(date, "%Y-%m-%d").timestamp()
+
+def project_volatile(project_data):
+    """
+    Returns the values of project_data which change while a project runs.
+
+    project_data [dict] - A row written by project_data_extractor.scrape_write.
+    """
+    return {key: value for key, value in project_data.items()
+            if key in PROJECT_FIELDS or key.startswith("rd_backers_") or key.startswith("rd_gone_")}
+
+def creator_volatile(creator_data):
+    """
+    Returns the values of creator_data which change over time.
+
+    creator_data [dict] - A row written by creator_data_extractor.extract_write.
+    """
+    return {key: creator_data[key] for key in CREATOR_FIELDS if key in creator_data}
+
+def next_project_visit(state, deadline, now, interval=LIVE_INTERVAL):
+    """
+    Returns the unix time of the next visit to a project or None if it should not be visited
+    again. Live projects are visited every interval until their deadline, after which they
+    get a single final visit ENDED_DELAY later.
+
+    state [str] - Project state e.g. Live or Successful.
+    deadline [float] - Unix time of the deadline or None if unknown.
+    now [float] - Unix time of the current visit.
+    interval [float] - Seconds between visits of a live project. LIVE_INTERVAL by default.
+    """
+    if deadline == None:
+        return None
+
+    # The state in the input may be older than the deadline so it is only trusted before it.
+    state = (state or "").lower()
+    if now < deadline:
+        if state in UPCOMING_STATES:
+            return now + UPCOMING_INTERVAL
+        if state in LIVE_STATES:
+            return min(now + interval, deadline + ENDED_DELAY)
+
+    final = deadline + ENDED_DELAY
+    if now >= final:
+        return None
+    return final
+
+def next_project_interval(interval, changed):
+    """
+    Returns the seconds between visits of a live project.
+
+    interval [float] - Seconds used after the previous visit or None on the first visit.
+    changed [bool] - True if this visit found a change.
+    """
+    if interval == None:
+        return LIVE_INTERVAL
+    interval = interval / 2 if changed else interval * 2
+    return min(max(interval, LIVE_MIN_INTERVAL), LIVE_MAX_INTERVAL)
+
+def next_creator_interval(interval, changed):
+    """
+    Returns the seconds until the next visit to a creator.
+
+    interval [float] - Seconds used after the previous visit or None on the first visit.
+    changed [bool] - True if this visit found a change.
+    """
+    if interval == None:
+        return CREATOR_START_INTERVAL
+    interval = interval / 2 if changed else interval * 2
+    return min(max(interval, CREATOR_MIN_INTERVAL), CREATOR_MAX_INTERVAL)
+
+def apply_visit(cur, entity_type, key, new_fingerprint, state, deadline, observed_at):
+    """
+    db_writer handler which records a visit and schedules the next one.
+
+    cur [sqlite3.Cursor] - Writer cursor.
+    entity_type [str] - project or creator.
+    key [str] - Project url or creator id.
+    new_fingerprint [str] - fingerprint of the volatile fields seen.
+    state [str] - Project state or None.
+    deadline [float] - Unix time of the project deadline or None.
+    observed_at [float] - Unix time of the visit.
+    """
+    row = cur.execute("SELECT fingerprint, first_visit, last_change, visits, changes, interval FROM visits WHERE entity_type = ? AND key = ?",
+                      (entity_type, key)).fetchone()
+    if row == None:
+        changed = False
+        first_visit, last_change, visits, changes, interval = observed_at, observed_at, 0, 0, None
+    else:
+        old_fingerprint, first_visit, last_change, visits, changes, interval = row
+        changed = old_fingerprint != new_fingerprint
+        if changed:
+            last_change = observed_at
+            changes += 1
+
+    if entity_type == "project":
+        interval = next_project_interval(interval, changed)
+        next_visit = next_project_visit(state, deadline, observed_at, interval)
+    else:
+        interval = next_creator_interval(interval, changed)
+        next_visit = observed_at + interval
+
+    cur.execute("INSERT OR REPLACE INTO visits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (entity_type, key, state, deadline, new_fingerprint, first_visit, observed_at, last_change,
+                 visits + 1, changes, interval, next_visit))
+
+db_writer.HANDLERS["record_visit"] = apply_visit
+
+def record_visit(entity_type, key, volatile, state=None, deadline=None):
+    """
+    Sends a visit to the db_writer so the next visit is scheduled.
+
+    entity_type [str] - project or creator.
+    key [str] - Project url or creator id.
+    volatile [dict] - Values of the fields that change over time.
+    state [str] - Project state. None by default.
+    deadline [str/float] - Project deadline as YYYY-MM-DD or unix time. None by default.
+    """
+    db_writer.send("record_visit", entity_type, key, fingerprint(volatile), state, to_timestamp(deadline), time.time())
+
+def enqueue_due_projects(con, now=None):
+    """
+    Makes done project jobs which are due for a visit pending again and returns how many there were.
+
+    con [sqlite3.Connection] - Connection to a database with jobs and visits tables.
+    now [float] - Unix time to compare visit times with. Now by default.
+    """
+    return job_queue.requeue_jobs(con, DUE_SQL, ("project", now if now != None else time.time()))
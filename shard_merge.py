@@ -0,0 +1,197 @@
+import csv
+import sys
+import sqlite3
+import logging
+
+# Settings.
+
+# Tables left out of merged databases. They only track the progress of a shard.
+SKIPPED_TABLES = {"jobs", "job_sources", "dead_letter", "bulk_sources", "workers"}
+# Entity type change_history observes the rows of each table under. Rows of these tables are
+# kept from the shard which observed them last.
+ENTITY_TYPES = {"projects": "project", "creator": "creator", "hidden_projects": "hidden_project"}
+# Columns holding the time a row was last refreshed. Rows of these tables are kept from the shard
+# where the column is the latest.
+FRESHNESS_COLUMNS = {"observations": "observed_at", "visits": "last_visit", "project_store": "observed_at"}
+# Key column of merged csv files.
+CSV_KEY = "url"
+# Columns compared in order to find the freshest row of a key in merged csv files.
+CSV_FRESHNESS_COLUMNS = ["date_accessed", "time_accessed"]
+# Columns holding the time a row was first seen, which keep the earliest value of every shard
+# whichever row is kept.
+EARLIEST_COLUMNS = {"observations": ["first_observed_at"]}
+# Rows written per batch when merging csv files.
+BATCH_SIZE = 10000
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def get_key(con, table, schema="main"):
+    """Returns the columns of the first unique index or primary key of table, or None if rows of
+    table are not unique."""
+    for row in con.execute(f"PRAGMA {schema}.index_list({quote(table)})"):
+        if row[2]:
+            return [info[2] for info in con.execute(f"PRAGMA {schema}.index_info({quote(row[1])})")]
+    pk = sorted((row[5], row[1]) for row in con.execute(f"PRAGMA {schema}.table_info({quote(table)})") if row[5])
+    return [name for position, name in pk] or None
+
+def has_table(con, table, schema="main"):
+    return con.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() != None
+
+def copy_schema(con, table):
+    """Creates table and its indexes in the output database the way they are in the attached
+    shard."""
+    for (sql,) in con.execute("""SELECT sql FROM shard.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL
+                              ORDER BY type = 'index'""", (table,)).fetchall():
+        con.execute(sql.replace("CREATE TABLE ", "CREATE TABLE IF NOT EXISTS ", 1)
+                       .replace("CREATE UNIQUE INDEX ", "CREATE UNIQUE INDEX IF NOT EXISTS ", 1)
+                       .replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1))
+
+def merge_table(con, table):
+    """
+    Upserts the rows of table in the attached shard into the output database in one statement,
+    so rows are streamed by sqlite instead of loaded into memory. A row whose key is already in
+    the output replaces it only if it is at least as fresh. Returns the number of rows written.
+
+    con [sqlite3.Connection] - Connection to the output database with the shard attached as shard.
+    table [str] - Table name.
+    """
+    copy_schema(con, table)
+    output_columns = {row[1] for row in con.execute(f"PRAGMA main.table_info({quote(table)})")}
+    columns = [row[1] for row in con.execute(f"PRAGMA shard.table_info({quote(table)})") if row[1] in output_columns]
+    column_list = ", ".join(quote(column) for column in columns)
+    select = f"SELECT {column_list} FROM shard.{quote(table)} WHERE true"
+
+    key = get_key(con, table)
+    if key == None or not set(key) <= set(columns):
+        cur = con.execute(f"INSERT OR IGNORE INTO main.{quote(table)} ({column_list}) {select}")
+        return cur.rowcount
+
+    earliest = EARLIEST_COLUMNS.get(table, [])
+    updates = ", ".join(f"{quote(column)} = excluded.{quote(column)}" if column not in earliest else
+                        f"{quote(column)} = MIN(COALESCE(excluded.{quote(column)}, {quote(column)}), COALESCE({quote(column)}, excluded.{quote(column)}))"
+                        for column in columns if column not in key)
+    if not updates:
+        cur = con.execute(f"INSERT OR IGNORE INTO main.{quote(table)} ({column_list}) {select}")
+        return cur.rowcount
+
+    # Ties go to the later shard.
+    condition = "true"
+    params = ()
+    if table in FRESHNESS_COLUMNS and FRESHNESS_COLUMNS[table] in columns:
+        column = quote(FRESHNESS_COLUMNS[table])
+        condition = f"COALESCE(excluded.{column}, 0) >= COALESCE(main.{quote(table)}.{column}, 0)"
+    elif table in ENTITY_TYPES and len(key) == 1 and has_table(con, "observations", "shard") and has_table(con, "observations"):
+        # Observations of earlier shards are merged after their entity tables so main.observations
+        # holds the freshest observation so far.
+        observed = "(SELECT observed_at FROM {}.observations WHERE entity_type = ? AND entity_id = excluded.{})"
+        condition = (f"COALESCE({observed.format('shard', quote(key[0]))}, 0) >= "
+                     f"COALESCE({observed.format('main', quote(key[0]))}, 0)")
+        params = (ENTITY_TYPES[table], ENTITY_TYPES[table])
+
+    cur = con.execute(f"""INSERT INTO main.{quote(table)} ({column_list}) {select}
+                      ON CONFLICT({", ".join(quote(column) for column in key)}) DO UPDATE SET {updates} WHERE {condition}""", params)
+    rows = cur.rowcount
+
+    match = " AND ".join(f"s.{quote(column)} = main.{quote(table)}.{quote(column)}" for column in key)
+    # Rows which weren't replaced still take the earliest value of the shard.
+    for column in earliest:
+        if column in columns:
+            con.execute(f"""UPDATE main.{quote(table)} SET {quote(column)} = (
+                        SELECT MIN(s.{quote(column)}) FROM shard.{quote(table)} AS s WHERE {match})
+                        WHERE (SELECT MIN(s.{quote(column)}) FROM shard.{quote(table)} AS s WHERE {match}) < {quote(column)}""")
+    return rows
+
+def merge_databases(output, inputs):
+    """
+    Merges the sqlite outputs of shards into output, deduplicating rows by their unique key and
+    keeping the freshest. Inputs are merged in order so later ones win ties, and output may
+    already hold an earlier merge.
+
+    output [str] - Path to the merged database.
+    inputs [list] - Paths to the shard databases.
+    """
+    con = sqlite3.connect(output, isolation_level=None)
+    con.execute("PRAGMA journal_mode=WAL")
+    for path in inputs:
+        con.execute("ATTACH DATABASE ? AS shard", (path,))
+        con.execute("BEGIN")
+        try:
+            tables = [row[0] for row in con.execute("SELECT name FROM shard.sqlite_master WHERE type = 'table'")
+                      if row[0] not in SKIPPED_TABLES and not row[0].startswith("sqlite_")]
+            # Entity tables compare against observations before it is updated.
+            tables.sort(key=lambda table: table == "observations")
+            for table in tables:
+                rows = merge_table(con, table)
+                logging.info(f"{path}: merged {rows} rows of {table}.")
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.execute("DETACH DATABASE shard")
+    con.close()
+
+def iter_csv(path):
+    with open(path, encoding="utf8", newline="") as f_obj:
+        yield from csv.DictReader(f_obj)
+
+def merge_csvs(output, inputs, key=CSV_KEY, fresh=CSV_FRESHNESS_COLUMNS):
+    """
+    Merges csv outputs of shards into output, keeping one row per key. Streams the inputs twice,
+    first keeping only the position of the freshest row of every key and then copying those
+    rows, so only the keys are held in memory. Rows with an empty or missing key e.g. pages
+    without an og:url are all kept since they can't be told apart.
+
+    output [str] - Path to the merged csv.
+    inputs [list] - Paths to the shard csvs. Later ones win ties.
+    key [str] - Column identifying a row e.g. url.
+    fresh [list] - Columns compared in order to find the freshest row. Compared as numbers if
+    possible and as text otherwise. Without them the row of the later input is kept.
+    """
+    def freshness(value):
+        try:
+            return (1, float(value), "")
+        except (TypeError, ValueError):
+            return (0, 0, value or "")
+
+    best = {}
+    fieldnames = []
+    for index, path in enumerate(inputs):
+        with open(path, encoding="utf8", newline="") as f_obj:
+            fieldnames.extend(name for name in next(csv.reader(f_obj), []) if name not in fieldnames)
+        for position, row in enumerate(iter_csv(path)):
+            if not row.get(key):
+                continue
+            value = tuple(freshness(row.get(column)) for column in fresh or [])
+            current = best.get(row[key])
+            if current == None or value >= current[0]:
+                best[row[key]] = (value, index, position)
+
+    written = 0
+    with open(output, "w", encoding="utf8", newline="") as f_obj:
+        writer = csv.DictWriter(f_obj, fieldnames)
+        writer.writeheader()
+        for index, path in enumerate(inputs):
+            batch = []
+            for position, row in enumerate(iter_csv(path)):
+                if not row.get(key) or best[row[key]][1:] == (index, position):
+                    batch.append(row)
+                if len(batch) == BATCH_SIZE:
+                    writer.writerows(batch)
+                    written += len(batch)
+                    batch.clear()
+            writer.writerows(batch)
+            written += len(batch)
+    logging.info(f"Merged {written} unique rows from {len(inputs)} files into {output}.")
+    return written
+
+if __name__ == "__main__":
+    # python shard_merge.py <merged .db> <shard .db>...
+    # python shard_merge.py <merged .csv> <shard .csv>...
+    # Shards are given oldest first.
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO, datefmt='%m/%d/%Y %I:%M:%S %p')
+    if sys.argv[1].endswith(".csv"):
+        merge_csvs(sys.argv[1], sys.argv[2:])
+    else:
+        merge_databases(sys.argv[1], sys.argv[2:])
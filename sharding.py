@@ -0,0 +1,115 @@
+import os
+import sys
+import hashlib
+
+import metrics
+import tracing
+import profiling
+
+# Settings.
+
+# Part of the work done by this process as (index, count) with index from 1 to count, or None
+# to do all of it. Set from --shard i/n on the command line by from_args.
+SHARD = None
+# Environment variable passing the shard to worker processes, which don't see the command line
+# of the parent when they are spawned.
+ENVIRONMENT_VARIABLE = "KICKSTARTER_SHARD"
+
+# Folders of metrics, tracing and profiling before the shard suffix was added.
+_paths = None
+
+def parse(text):
+    """
+    Returns (index, count) from a shard like "2/4".
+
+    text [str] - Shard as index/count with index from 1 to count.
+    """
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard {text} is not of the form i/n e.g. 2/4.")
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Shard {text} needs 1 <= i <= n.")
+    return index, count
+
+def set_shard(shard):
+    """
+    Makes this process and the workers it starts do only shard. Shards running on the same host
+    also get their own metrics, trace and profile folders.
+
+    shard [tuple] - (index, count).
+    """
+    global SHARD, _paths
+    if _paths == None:
+        _paths = metrics.METRICS_PATH, tracing.TRACE_PATH, profiling.PROFILE_PATH
+    SHARD = shard
+    os.environ[ENVIRONMENT_VARIABLE] = f"{shard[0]}/{shard[1]}"
+    metrics.METRICS_PATH, tracing.TRACE_PATH, profiling.PROFILE_PATH = (shard_path(path, shard) for path in _paths)
+
+def from_args(argv=None):
+    """
+    Sets the shard from a --shard i/n (or --shard=i/n) argument if there is one and returns
+    SHARD.
+
+    argv [list] - Command line arguments. sys.argv by default.
+    """
+    argv = argv if argv != None else sys.argv
+    for i, arg in enumerate(argv):
+        if arg == "--shard" and i + 1 < len(argv):
+            set_shard(parse(argv[i + 1]))
+        elif arg.startswith("--shard="):
+            set_shard(parse(arg[len("--shard="):]))
+    return SHARD
+
+def shard_of(key, count):
+    """
+    Returns the shard from 1 to count key belongs to. Stable across processes, hosts and python
+    versions, unlike hash().
+
+    key - Work key e.g. a url or creator id. Compared as a string so 123 and "123" match.
+    count [int] - Number of shards.
+    """
+    digest = hashlib.blake2b(str(key).encode("utf8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count + 1
+
+def in_shard(key, shard=None):
+    """
+    Returns True if key belongs to shard.
+
+    key - Work key.
+    shard [tuple] - (index, count). SHARD by default, where None means every key.
+    """
+    shard = shard if shard != None else SHARD
+    return shard == None or shard_of(key, shard[1]) == shard[0]
+
+def select(items, key=None, shard=None):
+    """
+    Yields the items of shard.
+
+    items [iterable] - Work items.
+    key [function] - Returns the work key of an item. The item itself by default.
+    shard [tuple] - (index, count). SHARD by default.
+    """
+    for item in items:
+        if in_shard(key(item) if key != None else item, shard):
+            yield item
+
+def suffix(shard=None):
+    """Returns the suffix of the outputs of shard e.g. "_shard2of4", or "" if not sharded."""
+    shard = shard if shard != None else SHARD
+    return "" if shard == None else f"_shard{shard[0]}of{shard[1]}"
+
+def shard_path(path, shard=None):
+    """
+    Returns path with the suffix of shard added before its extension so every shard writes its
+    own outputs e.g. projects.db becomes projects_shard2of4.db.
+
+    path [str] - Output file or folder.
+    shard [tuple] - (index, count). SHARD by default.
+    """
+    root, extension = os.path.splitext(path)
+    return root + suffix(shard) + extension
+
+# Workers take the shard of the process which started them.
+if os.environ.get(ENVIRONMENT_VARIABLE):
+    set_shard(parse(os.environ[ENVIRONMENT_VARIABLE]))
@@ -0,0 +1,111 @@
+import sys
+import time
+import logging
+import importlib
+import subprocess
+import multiprocessing
+
+# Settings.
+
+# Scripts whose worker startup is measured.
+SCRIPTS = ["project_data_extractor", "creator_data_extractor", "extra_project_finder", "html_data_extractor"]
+# Modules reported when a worker has loaded them by the end of its startup.
+HEAVY_MODULES = ["undetected_chromedriver", "selenium", "pyautogui", "pandas", "numpy", "bs4", "lxml", "tqdm"]
+# Workers started per script.
+WORKERS = 4
+# Number of slowest modules listed per script.
+TOP_MODULES = 10
+
+def import_script(name):
+    """
+    Imports the script name the way a spawned pool worker does and returns (pid, seconds, heavy
+    modules loaded, error). error is None if the import succeeded.
+
+    name [str] - Module name of the script e.g. project_data_extractor.
+    """
+    import os
+
+    start = time.perf_counter()
+    error = None
+    try:
+        importlib.import_module(name)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+    return os.getpid(), seconds, [module for module in HEAVY_MODULES if module in sys.modules], error
+
+def measure_workers(name, workers=WORKERS):
+    """
+    Starts workers fresh spawned processes, each importing the script name once, and returns
+    their import_script results.
+
+    name [str] - Module name of the script.
+    workers [int] - Number of workers. WORKERS by default.
+    """
+    # Spawned workers import the script like they do on Windows, where the scrapers run.
+    # maxtasksperchild=1 makes every measurement start from an empty process.
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, maxtasksperchild=1) as pool:
+        return pool.map(import_script, [name] * workers, chunksize=1)
+
+def slowest_modules(name, top=TOP_MODULES):
+    """
+    Imports the script name in a new interpreter with -X importtime and returns its top
+    slowest modules imported by the script itself as (cumulative seconds, module) tuples.
+
+    name [str] - Module name of the script.
+    top [int] - Number of modules returned. TOP_MODULES by default.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {name}"], capture_output=True, text=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:       512 |       1730 | selenium.webdriver".
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(parts[1]) / 1e6
+        except ValueError:
+            continue
+        # Every nesting level indents the module by two more spaces and children are listed
+        # before their parent. Level 1 modules listed before the script are the ones it imports
+        # itself, the others belong to interpreter startup.
+        module = parts[2].strip()
+        depth = (len(parts[2]) - len(parts[2].lstrip()) - 1) // 2
+        if depth == 0:
+            if module == name:
+                break
+            modules = {}
+        elif depth == 1:
+            root = module.split(".")[0]
+            modules[root] = max(modules.get(root, 0), cumulative)
+    return sorted(((seconds, module) for module, seconds in modules.items()), reverse=True)[:top]
+
+def benchmark(scripts=SCRIPTS, workers=WORKERS):
+    """
+    Logs the import time of each worker of every script, the heavy modules it loaded and the
+    slowest modules it imports. Returns a dict of average worker import seconds by script.
+
+    scripts [list] - Module names of the scripts. SCRIPTS by default.
+    workers [int] - Workers started per script. WORKERS by default.
+    """
+    averages = {}
+    for name in scripts:
+        results = measure_workers(name, workers)
+        errors = {error for pid, seconds, modules, error in results if error != None}
+        for error in errors:
+            logging.info(f"{name}: import failed with {error}")
+
+        for pid, seconds, modules, error in results:
+            logging.info(f"{name} worker {pid}: {seconds * 1000:.0f}ms, loaded {', '.join(modules) or 'no heavy modules'}.")
+        averages[name] = sum(result[1] for result in results) / len(results)
+        logging.info(f"{name}: {averages[name] * 1000:.0f}ms average worker import.")
+
+        if not errors:
+            for seconds, module in slowest_modules(name):
+                logging.info(f"{name}:     {seconds * 1000:8.1f}ms {module}")
+    return averages
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    benchmark(sys.argv[1:] or SCRIPTS)
@@ -0,0 +1,229 @@
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import functools
+import threading
+import multiprocessing.util
+from contextlib import contextmanager
+
+# Settings.
+
+# Set to False to turn off tracing.
+ENABLED = True
+# Folder for the per process trace files.
+TRACE_PATH = "traces"
+# Spans buffered by a process before they are appended to its file.
+BUFFER_SIZE = 200
+# Seconds after which buffered spans are written even if the buffer isn't full.
+FLUSH_SECONDS = 10
+# Number of items listed by the command line tool.
+SLOWEST_ITEMS = 20
+
+# Trace id and span depth of the item each thread is working on.
+_local = threading.local()
+# Spans of the current process waiting to be written and the pid they were recorded in.
+_lock = threading.Lock()
+_buffer = []
+_pid = None
+_last_flush = 0
+
+def _check_process():
+    """Drops spans inherited from a parent process and registers the exit flush. Must be called
+    with _lock held."""
+    global _pid, _last_flush
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _buffer.clear()
+        _last_flush = time.time()
+        # Finalizers also run when pool workers exit, unlike atexit handlers.
+        multiprocessing.util.Finalize(None, flush, exitpriority=0)
+
+def current_id():
+    """Returns the trace id of the item the calling thread is working on or None."""
+    return getattr(_local, "trace_id", None)
+
+def _record(span):
+    with _lock:
+        _check_process()
+        _buffer.append(span)
+        full = len(_buffer) >= BUFFER_SIZE or time.time() - _last_flush >= FLUSH_SECONDS
+    if full:
+        flush()
+
+@contextmanager
+def trace(item, **attrs):
+    """
+    Context manager which gives the work item processed in its block a new trace id. Spans
+    recorded by the thread in the block, and db_writer writes it sends, belong to the trace.
+    Yields a dict of attributes of the item's root span which can be added to e.g. its outcome.
+
+    item [str] - Item key e.g. a project url or creator id.
+    attrs - Extra attributes of the root span.
+    """
+    if not ENABLED:
+        yield {}
+        return
+    previous = current_id(), getattr(_local, "depth", 0)
+    _local.trace_id, _local.depth = uuid.uuid4().hex[:16], 0
+    root = dict(attrs)
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        yield root
+    finally:
+        _record({"trace": _local.trace_id, "name": "item", "item": str(item), "start": started_at,
+                 "seconds": time.perf_counter() - start, "depth": 0, "pid": os.getpid(), **root})
+        _local.trace_id, _local.depth = previous
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Context manager which records its block as a span of the current trace. Does nothing outside
+    of a trace.
+
+    name [str] - Span name e.g. get_live_soup.
+    attrs - Extra attributes of the span.
+    """
+    trace_id = current_id()
+    if trace_id == None:
+        yield
+        return
+    depth = _local.depth
+    _local.depth += 1
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.depth = depth
+        _record({"trace": trace_id, "name": name, "start": started_at, "seconds": time.perf_counter() - start,
+                 "depth": depth + 1, "pid": os.getpid(), **attrs})
+
+def traced(function):
+    """Decorator which records every call of function made inside a trace as a span named after
+    it."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with span(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+def traced_item(function):
+    """Decorator which runs every call of function in a new trace of the item given as its first
+    argument."""
+    @functools.wraps(function)
+    def wrapper(item, *args, **kwargs):
+        with trace(item):
+            return function(item, *args, **kwargs)
+    return wrapper
+
+def add_span(name, started_at, seconds, trace_id=None, **attrs):
+    """
+    Records a span which was already timed e.g. by metrics.timer or by the db_writer process.
+
+    name [str] - Span name.
+    started_at [float] - Unix time the span started.
+    seconds [float] - Duration.
+    trace_id [str] - Trace the span belongs to. The current trace by default. Nothing is
+    recorded without one.
+    attrs - Extra attributes of the span.
+    """
+    if not ENABLED:
+        return
+    if trace_id == None:
+        trace_id = current_id()
+        if trace_id == None:
+            return
+        depth = _local.depth + 1
+    else:
+        depth = 1
+    _record({"trace": trace_id, "name": name, "start": started_at, "seconds": seconds, "depth": depth,
+             "pid": os.getpid(), **attrs})
+
+def flush():
+    """Appends the buffered spans of this process to its file in TRACE_PATH."""
+    global _last_flush
+    with _lock:
+        if _pid != os.getpid():
+            return
+        spans = list(_buffer)
+        _buffer.clear()
+        _last_flush = time.time()
+    if not spans:
+        return
+
+    os.makedirs(TRACE_PATH, exist_ok=True)
+    with open(os.path.join(TRACE_PATH, f"proc-{os.getpid()}.jsonl"), "a") as f_obj:
+        f_obj.write("".join(json.dumps(span) + "\n" for span in spans))
+
+def start():
+    """Removes the traces of earlier runs. Called once by the parent process before starting
+    workers."""
+    if not ENABLED:
+        return
+    for path in glob.glob(os.path.join(TRACE_PATH, "proc-*.jsonl")):
+        os.remove(path)
+
+def load(path=TRACE_PATH):
+    """Returns a dict of the spans of every trace in the files of path, sorted by start time."""
+    traces = {}
+    for file_path in glob.glob(os.path.join(path, "proc-*.jsonl")):
+        with open(file_path) as f_obj:
+            for line in f_obj:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    # Last line of a process that was killed while writing.
+                    continue
+                traces.setdefault(span["trace"], []).append(span)
+    for spans in traces.values():
+        spans.sort(key=lambda span: (span["start"], span["depth"]))
+    return traces
+
+def breakdown(spans):
+    """Returns (name, total seconds, count) of every span name in spans except the root, slowest
+    first. Spans nest so the totals of different names overlap."""
+    totals = {}
+    for span in spans:
+        if span["name"] == "item":
+            continue
+        seconds, count = totals.get(span["name"], (0, 0))
+        totals[span["name"]] = (seconds + span["seconds"], count + 1)
+    return sorted(((name, seconds, count) for name, (seconds, count) in totals.items()), key=lambda row: -row[1])
+
+def slowest(traces, number=SLOWEST_ITEMS):
+    """Returns the root spans of the number slowest finished items of traces."""
+    roots = [span for spans in traces.values() for span in spans if span["name"] == "item"]
+    return sorted(roots, key=lambda span: -span["seconds"])[:number]
+
+def print_slowest(path=TRACE_PATH, number=SLOWEST_ITEMS):
+    """Prints the slowest items with the seconds spent in each kind of span."""
+    traces = load(path)
+    for root in slowest(traces, number):
+        extra = ", ".join(f"{key}={value}" for key, value in root.items()
+                          if key not in ("trace", "name", "item", "start", "seconds", "depth", "pid"))
+        print(f"{root['seconds']:8.2f}s  {root['item']}  trace {root['trace']}{'  ' + extra if extra else ''}")
+        for name, seconds, count in breakdown(traces[root["trace"]]):
+            print(f"{'':10}{seconds:8.2f}s  {name}" + (f" x{count}" if count > 1 else ""))
+
+def print_trace(trace_id, path=TRACE_PATH):
+    """Prints every span of a trace in start order, indented by depth, with its offset from the
+    start of the item."""
+    spans = load(path).get(trace_id, [])
+    if not spans:
+        print(f"No trace {trace_id}.")
+        return
+    first = spans[0]["start"]
+    for span in spans:
+        print(f"+{span['start'] - first:8.3f}s {span['seconds']:8.3f}s  {'  ' * span['depth']}{span['name']}"
+              f"  (pid {span['pid']})")
+
+if __name__ == "__main__":
+    # python tracing.py lists the slowest items, python tracing.py <trace id> shows one of them.
+    if len(sys.argv) > 1:
+        print_trace(sys.argv[1])
+    else:
+        print_slowest()
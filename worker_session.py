@@ -0,0 +1,175 @@
+import os
+import logging
+import threading
+import multiprocessing.util
+
+import metrics
+import egress_pool
+
+# Settings.
+
+# Page loads a browser makes before it is replaced by one on another egress.
+REQUEST_BUDGET = 150
+# Fraction of REQUEST_BUDGET after which the replacement starts launching in the background.
+WARM_AT = 0.8
+
+# Sessions of the current process by owner and the pid they were made in.
+_sessions = {}
+_pid = None
+_lock = threading.Lock()
+
+class BlockedError(Exception):
+    """Raised when a page shows the egress is blocked e.g. a captcha or a 403 or 429 response, so
+    the session rotates to another egress and records the block."""
+
+class Session:
+    """
+    Browser kept by one worker across items together with its egress. Rotating launches the
+    replacement in a background thread and only swaps it in once it is running, so a rotation
+    never stops other workers and only waits for the launch when the old browser was blocked.
+
+    launch [function] - Takes an egress (or None) and returns a new webdriver.
+    owner [str] - egress_pool owner of the session. egress_pool.owner_name() by default.
+    """
+    def __init__(self, launch, owner=None):
+        self.launch = launch
+        self.owner = owner if owner != None else egress_pool.owner_name()
+        self.egress = egress_pool.get_egress(self.owner)
+        self.driver = launch(self.egress)
+        self.requests = 0
+        self.blocked = False
+        self._warming = None
+        self._next_egress = None
+        self._replacement = None
+
+    def get_driver(self):
+        """Returns the browser to use for the next item, swapping in the replacement if it is due."""
+        if self.blocked:
+            # The current browser is burned so wait for the replacement.
+            self._swap()
+        elif self.requests >= REQUEST_BUDGET and self._warming != None and not self._warming.is_alive():
+            self._swap()
+        return self.driver
+
+    def record_page(self, seconds=None, blocked=False):
+        """
+        Counts a page load against the request budget and reports it to egress_pool. A block
+        makes the next get_driver return a browser on another egress.
+
+        seconds [float] - Load time or None if unknown. None by default.
+        blocked [bool] - True if the page had a captcha. False by default.
+        """
+        # The pool may already have moved owner to the replacement's egress.
+        if self.egress != None:
+            egress_pool.record(self.egress, seconds, blocked)
+        self.requests += 1
+        if blocked:
+            # The block is already reported so it isn't recorded again by the rotation.
+            self.rotate(False)
+        elif self.requests >= REQUEST_BUDGET * WARM_AT:
+            self._start_warming(False)
+
+    def rotate(self, blocked=True):
+        """
+        Replaces the browser before the next item e.g. after a captcha or a crash. The browser
+        already launching for the request budget is used if there is one.
+
+        blocked [bool] - True to record a block on the egress. A block record_page already
+        recorded isn't recorded again. True by default.
+        """
+        self._start_warming(blocked)
+        self.blocked = True
+
+    def _start_warming(self, blocked):
+        if self._warming != None:
+            return
+        egress = egress_pool.rotate(self.owner, blocked) if egress_pool.ENABLED else None
+        self._next_egress = egress
+
+        def run():
+            try:
+                self._replacement = self.launch(egress)
+            except Exception as e:
+                logging.info(f"Failed to launch a replacement browser for {self.owner}: {e}")
+
+        self._warming = threading.Thread(target=run, daemon=True)
+        self._warming.start()
+
+    def _swap(self):
+        self._warming.join()
+        egress, replacement = self._next_egress, self._replacement
+        self._warming, self._next_egress, self._replacement = None, None, None
+        if replacement == None:
+            replacement = self.launch(egress)
+
+        # Quitting the old browser is left to a background thread too.
+        threading.Thread(target=quit_driver, args=(self.driver,), daemon=True).start()
+        self.egress, self.driver = egress, replacement
+        self.requests = 0
+        self.blocked = False
+        metrics.inc("session_rotations_total")
+        logging.info(f"{self.owner} switched to a new browser on {self.egress or 'the default network'}.")
+
+    def close(self):
+        """Quits the browser and any replacement."""
+        if self._warming != None:
+            self._warming.join()
+            if self._replacement != None:
+                quit_driver(self._replacement)
+        quit_driver(self.driver)
+
+def quit_driver(driver):
+    """Quits driver, ignoring browsers that already exited."""
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+def get_session(launch, owner=None):
+    """
+    Returns the session of owner in this process, starting it with launch if there is none.
+
+    launch [function] - Takes an egress (or None) and returns a new webdriver.
+    owner [str] - egress_pool owner of the session. egress_pool.owner_name() by default.
+    """
+    global _pid
+    if owner == None:
+        owner = egress_pool.owner_name()
+    with _lock:
+        if _pid != os.getpid():
+            # Sessions inherited from a parent process belong to its browsers.
+            _sessions.clear()
+            _pid = os.getpid()
+            # Finalizers also run when pool workers exit, unlike atexit handlers.
+            multiprocessing.util.Finalize(None, close_all, exitpriority=1)
+        session = _sessions.get(owner)
+    if session == None:
+        session = Session(launch, owner)
+        with _lock:
+            _sessions[owner] = session
+    return session
+
+def record_page(seconds=None, blocked=False, owner=None):
+    """
+    Records a page load on the session of owner in this process, or only in egress_pool if it
+    has none.
+
+    seconds [float] - Load time or None if unknown. None by default.
+    blocked [bool] - True if the page had a captcha. False by default.
+    owner [str] - egress_pool owner of the session. egress_pool.owner_name() by default.
+    """
+    if owner == None:
+        owner = egress_pool.owner_name()
+    session = _sessions.get(owner) if _pid == os.getpid() else None
+    if session == None:
+        egress_pool.report(seconds, blocked, owner)
+    else:
+        session.record_page(seconds, blocked)
+
+def close_all():
+    """Quits the browsers of every session of this process."""
+    if _pid != os.getpid():
+        return
+    for session in list(_sessions.values()):
+        session.close()
+    _sessions.clear()